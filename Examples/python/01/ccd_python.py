@@ -23,7 +23,7 @@ config['fixed_lambda'] = 10
 ccd_obj = ccd_single.ccd_single(config)
 ccd_obj.fit_data()
 
-last_it = ccd_obj.results[0].iterations[-1]
+last_it = ccd_obj.results[0]
 print(dir(last_it))
 print('fit parameters', last_it.m)
 print('stat_pars', last_it.stat_pars)
@@ -14,7 +14,6 @@ FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along
 with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-from NDimInv.plot_helper import *
 import logging
 import numpy as np
 import os
@@ -409,6 +408,7 @@ class starting_pars_3():
 
         plot_starting_model = False
         if(plot_starting_model):
+            from NDimInv.plot_helper import plt
             # # plot
             fig, axes = plt.subplots(4, 1, figsize=(6, 7))
             # plot spectrum
@@ -508,7 +508,9 @@ class integrated_parameters():
         -------
         stat_pars : dict containing the computed parameters
 
-        Also store stat_pars in self.stat_pars
+        The model object is shared by the fits of all spectra with the same
+        NaN pattern (see ccd_single_stateless), therefore the parameters are
+        not stored in the object.
         """
         # integrated parameters are computed from the tau/chargeability values
         # corresponding to the data frequency ranges. Therefore we first create
@@ -562,8 +564,7 @@ class integrated_parameters():
             else:
                 stat_pars[key] = result
 
-        self.stat_pars = stat_pars
-        return self.stat_pars
+        return stat_pars
 
     def _compute_coverages(self, pars):
         """
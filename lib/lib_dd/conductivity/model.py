@@ -2,6 +2,7 @@
 Template class for models
 """
 import lib_dd.base_class as base_class
+import lib_dd.kernels as kernels
 import numpy as np
 import NDimInv.model_template as mt
 import lib_dd.starting_parameters as starting_parameters
@@ -41,7 +42,10 @@ class dd_conductivity(
         self.tau_data_min = 1 / (2 * np.pi * self.frequencies.max())
         self.tau_data_max = 1 / (2 * np.pi * self.frequencies.min())
 
-        self.tau, self.s, self.tau_f_values = base_class.determine_tau_range(settings)
+        self.tau, self.s, self.tau_f_values = kernels.determine_tau_range(
+            settings)
+        self.kernel = kernels.get_kernel(
+            self.frequencies, self.tau, None, 'conductivity')
 
     def convert_parameters(self, pars):
         """Convert from linear to the actually used scale
@@ -65,89 +69,74 @@ class dd_conductivity(
         response: Nx2 array, first axis denotes frequencies, seconds real and
                   imaginary parts
         """
-        # pars = log10(sigma_0), log10(m_i)
-        # sigma0 = 10**pars[0]
-        m = 10**pars[1:]
-        nan_indices = np.where(np.isnan(m))
-        m[nan_indices] = 0
-
-        # mtot = np.sum(m)
-        # sigmai = sigma0 / (1 - mtot)
-        sigmai = 10**pars[0]
-        relterms = np.array([mi / (1 + 1j * self.omega * taui) for
-                             mi, taui in zip(m, self.tau)])
-        response_complex = sigmai * (1 - np.sum(relterms, axis=0))
-        response = np.vstack((np.real(response_complex),
-                              np.imag(response_complex))).T
-        return response
-
-    """
-    def forward_re_mim(self, pars):
-        response = self.forward(pars)
-        return response[0, :], response[1, :]
-    """
+        return self.kernel.forward(self._ignore_nan(pars))
+
+    def _ignore_nan(self, pars):
+        """The forward response ignores NaN chargeabilities, i.e. they are set
+        to zero (-inf in log10)
+        """
+        m_nan = np.isnan(pars[..., 1:])
+        if np.any(m_nan):
+            pars = pars.copy()
+            pars[..., 1:][m_nan] = -np.inf
+        return pars
 
     def Jacobian(self, pars):
         r"""Return the Jacobian corresponding to the forward response. The
-        Jacobian has the dimensions :math:`B \times D \times M`
-
-        TODO: Check the return dimensions
-        """
-        # sigma0 = 10**pars[0]
-        m = 10**pars[1:]
-        # mtot = np.sum(m)
-        # sigmai = sigma0 / (1 - mtot)
-        sigmai = 10**pars[0]
-
-        # compute 1 / (1 + omega^2 tau^2)
-        relterms = np.zeros((self.tau.size, self.omega.size))
-        for nr1, omega in enumerate(self.omega):
-            for nr2, tau in enumerate(self.tau):
-                relterms[nr2, nr1] = 1.0 / (1.0 + omega**2 * tau**2)
-        # relterms2 = np.array([1 / (1 + self.omega**2 * taui**2) for
-        #                      mi, taui in zip(m, self.tau)])
-
-        del_cre_dsigi = np.zeros(self.omega.size)
-        for nr, omega in enumerate(self.omega):
-            for nr2, mi in enumerate(m):
-                taui = self.tau[nr2]
-                del_cre_dsigi[nr] += (mi / (1 + omega**2 * taui**2))
-        del_cre_dsigi = 1 - del_cre_dsigi
-
-        # del_cre_dsigi = (1 - np.sum(m[:, np.newaxis] * relterms, axis=0))
-        del_cre_dsigi *= sigmai
-
-        del_cre_dmi = - sigmai * relterms
-        del_cre_dmi *= m[:, np.newaxis]
-
-        # omegatau = np.array([omega * taui for mi, taui in zip(m, self.tau)])
-        # omegatau = self.omega[np.newaxis, :] * self.tau[:, np.newaxis]
-        # del_cim_dsigi1 = np.sum(omegatau * m[:, np.newaxis] * relterms,
-        #                         axis=0)
-        del_cim_dsigi = np.zeros(self.omega.size)
-        for mi, taui in zip(m, self.tau):
-            del_cim_dsigi += (mi * self.omega * taui) / (
-                1 + self.omega**2 * taui**2)
-
-        del_cim_dsigi *= sigmai
-
-        # del_cim_dmi1 = sigmai * omegatau / relterms
-        del_cim_dmi = np.zeros((self.tau.size, self.omega.size))
-        for nr1, omega in enumerate(self.omega):
-            for nr2, taui in enumerate(self.tau):
-                mi = m[nr2]
-                del_cim_dmi[nr2, nr1] = sigmai * omega * taui / (
-                    1 + omega**2 * taui**2)
-
-        del_cim_dmi *= m[:, np.newaxis]
-
-        J_re = np.vstack((del_cre_dsigi[np.newaxis, :],
-                          del_cre_dmi)).T
-        J_im = np.vstack((del_cim_dsigi[np.newaxis, :],
-                          del_cim_dmi)).T
-        J = np.vstack((J_re, J_im))
-        J *= np.log(10)
-        return J
+        Jacobian has the dimensions :math:`2N \times (K + 1)`, with N the
+        number of frequencies and K the number of relaxation times. The first
+        N rows hold the derivatives of the real parts, the last N rows the
+        derivatives of the imaginary parts.
+        """
+        return self.kernel.Jacobian(pars)
+
+    def forward_and_Jacobian(self, pars):
+        """Return both the forward response and the Jacobian for one parameter
+        set. The kernel products are shared between both computations.
+
+        Returns
+        -------
+        response: Nx2 array, see self.forward
+        J: 2N x (K + 1) array, see self.Jacobian
+        """
+        if np.any(np.isnan(pars[1:])):
+            return self.forward(pars), self.Jacobian(pars)
+        return self.kernel.forward_and_Jacobian(pars)
+
+    def forward_batch(self, pars):
+        """Forward responses of multiple parameter sets
+
+        Parameters
+        ----------
+        pars: S x (K + 1) array, each row containing [log10(sigma_infty),
+              log10(m_i)]
+
+        Returns
+        -------
+        response: S x N x 2 array, see self.forward
+        """
+        return self.kernel.forward_batch(self._ignore_nan(pars))
+
+    def Jacobian_batch(self, pars):
+        """Jacobians of multiple parameter sets
+
+        Parameters
+        ----------
+        pars: S x (K + 1) array, see self.forward_batch
+
+        Returns
+        -------
+        J: S x 2N x (K + 1) array
+        """
+        return self.kernel.Jacobian_batch(pars)
+
+    def forward_and_Jacobian_batch(self, pars):
+        """Forward responses (S x N x 2) and Jacobians (S x 2N x (K + 1)) of
+        multiple parameter sets
+        """
+        if np.any(np.isnan(pars[:, 1:])):
+            return self.forward_batch(pars), self.Jacobian_batch(pars)
+        return self.kernel.forward_and_Jacobian_batch(pars)
 
     def get_data_base_size(self):
         """Usually you do not need to modify this.
@@ -184,16 +173,17 @@ class dd_conductivity(
         This is the way to compute any secondary results based on the fit
         results.
 
-        Store in self.stat_pars = dict()
+        Returns a new dict, see
+        base_class.integrated_parameters.compute_par_stats
 
         """
-        base_class.integrated_parameters.compute_par_stats(self, pars)
+        stat_pars = base_class.integrated_parameters.compute_par_stats(
+            self, pars)
 
-        # self.stat_pars = {}
         # the statistical parameters as computed above relate to the
         # resistivity formulation. We must correct some of them and add a few
         # parameters.
-        self.stat_pars['sigma_infty'] = self.stat_pars['rho0'].copy()
+        stat_pars['sigma_infty'] = stat_pars['rho0'].copy()
 
         def sigma0_linear(pars, tau, s, stat_pars):
             """Compute :math:`sigma0` using math:`\sigma_\infty` and
@@ -211,11 +201,10 @@ class dd_conductivity(
         def sigma0(pars, tau, s, stat_pars):
             return np.log10(sigma0_linear(pars, tau, s, stat_pars))
 
-        self.stat_pars['sigma0'] = sigma0(pars, self.tau, self.s,
-                                          self.stat_pars)
+        stat_pars['sigma0'] = sigma0(pars, self.tau, self.s, stat_pars)
 
         # rho0 is stored in log10, change sign for 1/rho0
-        self.stat_pars['rho0'] = self.stat_pars['sigma0'] * -1
+        stat_pars['rho0'] = stat_pars['sigma0'] * -1
 
         def mtotn(pars, tau, s, stat_pars):
             """
@@ -229,6 +218,5 @@ class dd_conductivity(
             mtotn = stat_pars['m_tot'] - stat_pars['rho0']
             return mtotn
 
-        self.stat_pars['m_tot_n'] = mtotn(pars, self.tau, self.s,
-                                          self.stat_pars)
-        return self.stat_pars
+        stat_pars['m_tot_n'] = mtotn(pars, self.tau, self.s, stat_pars)
+        return stat_pars
@@ -0,0 +1,70 @@
+"""
+Test the broadcast forward/Jacobian engine of the conductivity formulation
+against straightforward term-by-term implementations
+
+Run with
+
+nosetests test_model_engine.py -s -v
+"""
+import numpy as np
+import lib_dd.conductivity.model as lDDc
+
+
+def _get_model_and_pars():
+    frequencies = np.logspace(-3, 4, 30)
+    settings = {'Nd': 20,
+                'frequencies': frequencies,
+                'tausel': 'data_ext'
+                }
+    ddc = lDDc.dd_conductivity(settings)
+    random = np.random.RandomState(42)
+    pars = np.hstack((np.log10(0.01),
+                      random.uniform(-6, -2, ddc.tau.size)))
+    return ddc, pars
+
+
+def _forward_termwise(ddc, pars):
+    sigmai = 10 ** pars[0]
+    m = 10 ** pars[1:]
+    terms = [mi / (1 + 1j * ddc.omega * taui) for mi, taui in zip(m, ddc.tau)]
+    response = sigmai * (1 - np.sum(terms, axis=0))
+    return np.vstack((np.real(response), np.imag(response))).T
+
+
+def test_forward():
+    ddc, pars = _get_model_and_pars()
+    np.testing.assert_allclose(
+        ddc.forward(pars), _forward_termwise(ddc, pars), rtol=1e-12)
+
+
+def test_forward_nan():
+    """NaN chargeabilities are ignored by the forward response"""
+    ddc, pars = _get_model_and_pars()
+    pars_nan = pars.copy()
+    pars_nan[3] = np.nan
+    pars_zero = pars.copy()
+    pars_zero[3] = -np.inf
+    np.testing.assert_allclose(
+        ddc.forward(pars_nan), _forward_termwise(ddc, pars_zero), rtol=1e-12)
+
+
+def test_Jacobian():
+    """Compare the Jacobian to a central finite difference approximation"""
+    ddc, pars = _get_model_and_pars()
+    J = ddc.Jacobian(pars)
+    h = 1e-6
+    J_num = np.zeros_like(J)
+    for i in range(pars.size):
+        dp = np.zeros_like(pars)
+        dp[i] = h
+        diff = ddc.forward(pars + dp) - ddc.forward(pars - dp)
+        J_num[:, i] = diff.flatten(order='F') / (2 * h)
+    np.testing.assert_allclose(
+        J, J_num, rtol=1e-5, atol=1e-8 * np.abs(J).max())
+
+
+def test_forward_and_Jacobian():
+    ddc, pars = _get_model_and_pars()
+    response, J = ddc.forward_and_Jacobian(pars)
+    np.testing.assert_allclose(response, ddc.forward(pars))
+    np.testing.assert_allclose(J, ddc.Jacobian(pars))
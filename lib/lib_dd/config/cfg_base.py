@@ -423,6 +423,15 @@ class cfg_base(dict):
             if not none_missing:
                 exit()
 
+        # resumed runs (dd_single --resume) continue in the existing output
+        # directory
+        if self.get('resume', False):
+            if self['use_tmp']:
+                raise IOError(
+                    '--resume requires the output directory of the ' +
+                    'aborted run and can not be used with --tmp')
+            return
+
         # check if output directory already exists
         if os.path.isdir(self['output_dir']):
             raise IOError(
@@ -17,6 +17,41 @@ class cfg_single(cfg_base.cfg_base):
             }
         )
 
+        self['backend'] = 'processes'
+        self.cfg['backend'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'Execution backend for multiple cores: processes (one ',
+                'worker process per core), threads (one worker thread per ',
+                'core, no pickling of data and results, no plotting ',
+                'possible)',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--backend',
+                'metavar': 'BACKEND',
+            },
+            possible_values=[
+                'processes',
+                'threads',
+            ],
+        )
+
+        self['blas_threads'] = None
+        self.cfg['blas_threads'] = self.cfg_obj(
+            type='int',
+            help=''.join((
+                'Number of BLAS/OpenMP threads of each worker for multiple ',
+                'cores. Default: number of CPUs divided by the number of ',
+                'cores used (--nr_cores)',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--blas_threads',
+                'metavar': 'INT',
+            }
+        )
+
         self['fixed_lambda'] = None
         self.cfg['fixed_lambda'] = self.cfg_obj(
             type='float',
@@ -28,6 +63,123 @@ class cfg_single(cfg_base.cfg_base):
             }
         )
 
+        self['engine'] = 'ndiminv'
+        self.cfg['engine'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'Fit engine: ndiminv (one NDimInv inversion per spectrum), ',
+                'batch (fit all spectra with the same frequencies ',
+                'simultaneously), nnls (one-step linear fit for fast ',
+                'triage, --lambda is relative to the kernel norm)',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--engine',
+                'metavar': 'ENGINE',
+            },
+            possible_values=[
+                'ndiminv',
+                'batch',
+                'nnls',
+            ],
+        )
+
+        self['keep_nd'] = False
+        self.cfg['keep_nd'] = self.cfg_obj(
+            type='bool',
+            help=''.join((
+                'Keep the full NDimInv objects of all fits in the results ',
+                '(only useful for the Python interface)',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--keep_nd',
+                'action': 'store_true',
+            },
+        )
+
+        self['stream'] = False
+        self.cfg['stream'] = self.cfg_obj(
+            type='bool',
+            help=''.join((
+                'Write the result of each spectrum to a journal in the ',
+                'output directory as soon as it is fitted. The output ',
+                'files are assembled from the journal at the end.',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--stream',
+                'action': 'store_true',
+            },
+        )
+
+        self['resume'] = False
+        self.cfg['resume'] = self.cfg_obj(
+            type='bool',
+            help=''.join((
+                'Resume an aborted --stream run: spectra already stored in ',
+                'the journal of the output directory are not fitted again ',
+                '(implies --stream, not possible with --tmp)',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--resume',
+                'action': 'store_true',
+            },
+        )
+
+        self['warm_start'] = False
+        self.cfg['warm_start'] = self.cfg_obj(
+            type='bool',
+            help=''.join((
+                'Start each fit from the final model of the previous ',
+                'spectrum (if this lowers the starting rms). Each core ',
+                'fits a contiguous chunk of the spectra. Only for ',
+                '--engine ndiminv',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--warm_start',
+                'action': 'store_true',
+            },
+        )
+
+        self['nan_handling'] = 'crop'
+        self.cfg['nan_handling'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'Handling of frequencies with NaN values: crop (remove ',
+                'them from the spectrum), weights (keep the common ',
+                'frequency grid, fill in interpolated values and set their ',
+                'data weights to zero)',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--nan_handling',
+                'metavar': 'MODE',
+            },
+            possible_values=[
+                'crop',
+                'weights',
+            ],
+        )
+
+        self['prior_iterations'] = None
+        self.cfg['prior_iterations'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'nr_iterations.dat file of a previous run with the same ',
+                'number of spectra. The iteration counts are used to ',
+                'estimate the fit costs, so that the most expensive ',
+                'spectra are dispatched to the worker processes first',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--prior_iterations',
+                'metavar': 'FILE',
+            },
+        )
+
     def split_options(self):
         """
         Extract options for two groups:
@@ -42,5 +194,13 @@ class cfg_single(cfg_base.cfg_base):
         # now add options specific to dd_single
         prep_opts['lambda'] = self['fixed_lambda']
         prep_opts['nr_cores'] = self['nr_cores']
+        prep_opts['backend'] = self['backend']
+        prep_opts['blas_threads'] = self['blas_threads']
+        prep_opts['engine'] = self['engine']
+        prep_opts['keep_nd'] = self['keep_nd']
+        prep_opts['stream'] = self['stream']
+        prep_opts['resume'] = self['resume']
+        prep_opts['warm_start'] = self['warm_start']
+        prep_opts['nan_handling'] = self['nan_handling']
 
         return prep_opts, inv_opts
@@ -6,6 +6,22 @@ class cfg_time(cfg_base.cfg_base):
     def __init__(self):
         super(cfg_time, self).__init__()
 
+        self['nr_cores'] = 1
+        self.cfg['nr_cores'] = self.cfg_obj(
+            type='int',
+            help=''.join((
+                'Numer of CPU cores to use (dd_space_time.py: number of ',
+                'time series fitted in parallel; dd_time.py: number of ',
+                'windows, or of time steps without time regularization, ',
+                'fitted in parallel)',
+            )),
+            cmd_dict={
+                'short': '-c',
+                'long': '--nr_cores',
+                'metavar': 'INT',
+            }
+        )
+
         self['times'] = 'times.dat'
         self.cfg['times'] = self.cfg_obj(
             type='string',
@@ -64,7 +80,14 @@ class cfg_time(cfg_base.cfg_base):
         self['f_lam0'] = None
         self.cfg['f_lam0'] = self.cfg_obj(
             type='float',
-            help='Initial lambda for f-regularization',
+            help=''.join((
+                'Initial lambda for f-regularization. Without it, the ',
+                'ndiminv engine uses the initial lambda of ',
+                'NDimInv.reg_pars.Lam0_Easylam, and the sparse engine the ',
+                'ratio of the traces of the data and the regularization ',
+                'parts of the normal equations (the engines then find ',
+                'different lambdas)',
+            )),
             cmd_dict={
                 'short': None,
                 'long': '--lam0',
@@ -128,6 +151,78 @@ class cfg_time(cfg_base.cfg_base):
             }
         )
 
+        self['engine'] = 'ndiminv'
+        self.cfg['engine'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'Fit engine: ndiminv (time-regularized NDimInv inversion), ',
+                'nnls (one-step linear fit of each time step for fast ',
+                'triage, no time regularization, --f_lambda is relative ',
+                'to the kernel norm), sparse (time-regularized inversion ',
+                'using sparse matrices, scales linearly with the number of ',
+                'time steps; equals ndiminv for fixed lambdas, or with ',
+                '--lam0, see --lam0)',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--engine',
+                'metavar': 'ENGINE',
+            },
+            possible_values=[
+                'ndiminv',
+                'nnls',
+                'sparse',
+            ],
+        )
+
+        self['sparse_solver'] = 'banded'
+        self.cfg['sparse_solver'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'Solver of the normal equations of the sparse engine: ',
+                'banded (block banded Cholesky factorization for first or ',
+                'second order time smoothing, linear in the number of time ',
+                'steps; falls back to splu for other systems), splu ',
+                '(sparse LU factorization)',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--sparse_solver',
+                'metavar': 'SOLVER',
+            },
+            possible_values=[
+                'banded',
+                'splu',
+            ],
+        )
+
+        self['window'] = None
+        self.cfg['window'] = self.cfg_obj(
+            type='int',
+            help=''.join((
+                'Invert overlapping windows of INT time steps instead of ',
+                'all time steps at once, and stitch the results. With ',
+                'multiple cores (--nr_cores), the windows are fitted in ',
+                'parallel',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--window',
+                'metavar': 'INT',
+            }
+        )
+
+        self['window_overlap'] = 2
+        self.cfg['window_overlap'] = self.cfg_obj(
+            type='int',
+            help='Number of time steps shared by neighbouring windows',
+            cmd_dict={
+                'short': None,
+                'long': '--window_overlap',
+                'metavar': 'INT',
+            }
+        )
+
     def split_options(self):
         """
         Extract options for two groups:
@@ -147,6 +242,11 @@ class cfg_time(cfg_base.cfg_base):
         prep_opts['tmi_first_order'] = self['tmi_first_order']
         prep_opts['time_weighting_rho0'] = self['time_weighting_rho0']
         prep_opts['time_weighting_mi'] = self['time_weighting_mi']
+        prep_opts['engine'] = self['engine']
+        prep_opts['nr_cores'] = self['nr_cores']
+        prep_opts['sparse_solver'] = self['sparse_solver']
+        prep_opts['window'] = self['window']
+        prep_opts['window_overlap'] = self['window_overlap']
         return prep_opts, inv_opts
 
 
@@ -0,0 +1,188 @@
+"""
+Execution backends of multi-core ccd_single fits and the coordination of the
+BLAS/OpenMP threads used by the fits.
+
+Two backends are available (see --backend):
+
+processes: one worker process per core (multiprocessing.Pool). Each worker
+           limits its BLAS/OpenMP thread pools when it is started, so that
+           nr_cores workers do not oversubscribe the CPUs.
+threads: one worker thread per core (multiprocessing.pool.ThreadPool) in the
+         main process. No fit data and results need to be pickled, and no
+         processes are forked. This pays off for small problems (few
+         frequencies and relaxation times), where the fit time per spectrum
+         is comparable to the communication overhead. Only the parts of the
+         fits running outside the Python interpreter (mainly numpy/BLAS)
+         run concurrently, so processes win for larger problems.
+
+The number of BLAS/OpenMP threads of each worker can be set using
+--blas_threads. By default, the available CPUs are divided between the
+workers. Libraries which are already loaded are limited using threadpoolctl,
+if it is installed. Otherwise only the environment variables (e.g.
+OMP_NUM_THREADS) are set, which affect libraries loaded afterwards.
+
+The pools are kept and reused by all further runs of the same process (see
+get_pool), so that each worker imports the fit modules and builds its tau
+ranges and kernels only once.
+"""
+import os
+import sys
+import atexit
+import logging
+import multiprocessing
+import multiprocessing.pool
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+logger = logging.getLogger('lib_dd.decomposition.backends')
+
+# environment variables controlling the thread pools of BLAS/OpenMP libraries
+_variables = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+# original settings of the current process, see limit_blas_threads
+_original = {}
+
+# persistent pools, see get_pool
+_pools = {}
+
+
+def get_start_method():
+    """Return the start method of new worker processes ('fork', 'spawn' or
+    'forkserver'). Python 2 has no start methods: it forks on all platforms
+    but Windows.
+    """
+    if hasattr(multiprocessing, 'get_start_method'):
+        return multiprocessing.get_start_method()
+    if sys.platform == 'win32':
+        return 'spawn'
+    return 'fork'
+
+
+def get_blas_threads(prep_opts):
+    """Return the number of BLAS/OpenMP threads of each worker: either
+    prep_opts['blas_threads'], or the number of CPUs divided by the number of
+    workers (at least one)
+    """
+    if prep_opts.get('blas_threads') is not None:
+        return max(1, int(prep_opts['blas_threads']))
+    nr_cores = max(1, prep_opts['nr_cores'])
+    return max(1, multiprocessing.cpu_count() // nr_cores)
+
+
+def limit_blas_threads(nr_threads):
+    """Limit the BLAS/OpenMP thread pools of the current process to nr_threads
+    threads. The original settings can be restored using
+    restore_blas_threads.
+    """
+    if 'environ' not in _original:
+        _original['environ'] = dict(
+            (x, os.environ.get(x)) for x in _variables)
+    for variable in _variables:
+        os.environ[variable] = str(nr_threads)
+
+    if threadpoolctl is not None:
+        limits = threadpoolctl.threadpool_limits(limits=nr_threads)
+        _original.setdefault('threadpool_limits', limits)
+    else:
+        logger.info(
+            'threadpoolctl not available, BLAS threads are only limited for '
+            'libraries loaded after this point')
+
+
+def restore_blas_threads():
+    """Restore the settings changed by limit_blas_threads
+    """
+    if 'threadpool_limits' in _original:
+        _original.pop('threadpool_limits').restore_original_limits()
+    for variable, value in _original.pop('environ', {}).items():
+        if value is None:
+            os.environ.pop(variable, None)
+        else:
+            os.environ[variable] = value
+
+
+def _init_worker(nr_threads, initializer, initargs):
+    limit_blas_threads(nr_threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _environment_key():
+    """Return the DD_* environment variables (e.g. DD_COND, DD_C), which are
+    read by the fits. Worker processes only see the environment of the time
+    they were started, so pools are not shared between different settings.
+    """
+    return tuple(sorted(
+        (key, value) for key, value in os.environ.items() if
+        key.startswith('DD_')
+    ))
+
+
+def _is_running(pool):
+    return pool._state == multiprocessing.pool.RUN
+
+
+def get_pool(prep_opts, initializer=None, initargs=(), persistent=True):
+    """Return a pool of prep_opts['nr_cores'] workers for the backend
+    prep_opts['backend']. initializer(*initargs) is called in each worker
+    process when it is started (or once, in the main process, for the thread
+    backend), e.g. to import modules and build the kernel caches.
+
+    By default, the pools are persistent: the pool is kept after the run and
+    returned again by all further calls with the same backend, number of
+    workers and BLAS threads. The workers therefore keep their imported
+    modules and caches between runs, e.g. when fitting many data files from
+    Python. The initializer is only called for new pools. All persistent
+    pools are shut down at exit, or by calling shutdown.
+
+    Non-persistent pools must be closed by the caller.
+
+    For the thread backend, the BLAS threads of the main process are limited
+    until restore_blas_threads is called.
+    """
+    nr_cores = prep_opts['nr_cores']
+    nr_threads = get_blas_threads(prep_opts)
+    backend = prep_opts.get('backend', 'processes')
+    if backend == 'threads':
+        # the worker threads use the BLAS library of the main process
+        limit_blas_threads(nr_threads)
+
+    key = (backend, nr_cores, nr_threads, _environment_key())
+    if persistent and key in _pools and _is_running(_pools[key]):
+        return _pools[key]
+
+    logger.info('starting {0} worker {1} with {2} BLAS thread(s) each'.format(
+        nr_cores, backend, nr_threads))
+    if backend == 'threads':
+        if initializer is not None:
+            initializer(*initargs)
+        pool = ThreadPool(nr_cores)
+    else:
+        pool = Pool(nr_cores, initializer=_init_worker,
+                    initargs=(nr_threads, initializer, initargs))
+    if persistent:
+        _pools[key] = pool
+    return pool
+
+
+def shutdown():
+    """Shut down all persistent pools. Called at exit.
+    """
+    while _pools:
+        key, pool = _pools.popitem()
+        pool.close()
+        pool.join()
+
+
+atexit.register(shutdown)
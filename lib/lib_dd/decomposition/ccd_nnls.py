@@ -0,0 +1,51 @@
+"""
+NNLS engine (--engine nnls) of dd_single and dd_time, see lib_dd.nnls. The
+results are stored as the only iteration (nr 0) of the NDimInv objects, so
+that stat_pars and all output functions work unchanged.
+"""
+import numpy as np
+import NDimInv.main
+import lib_dd.nnls as nnls
+import lib_dd.fit_result as fit_result
+import ccd_single_stateless as decomp_single_sl
+
+
+def fit_ND(ND, lam=None):
+    """Fit all spectra of a prepared NDimInv object and store the result as
+    its only iteration (nr 0)
+    """
+    kernel = ND.Model.obj.kernel
+    WD = ND.Data.WD()
+    M = np.zeros(ND.Model.get_M_dimensions())
+    for d_slice, m_slice in ND.Model.DM_iterator():
+        M[m_slice] = nnls.fit_spectrum(
+            kernel, ND.Data.D[d_slice], WD[d_slice], lam)
+
+    it = NDimInv.main.Iteration(0, ND.Data, ND.Model, ND.RMS, ND.settings)
+    it.m = M.flatten(order='F')
+    it.f = ND.Model.f(it.m)
+    it.lams = [lam if lam is not None else nnls.default_lambda]
+    ND.iterations = [it]
+
+
+def fit_spectra(fit_datas):
+    """Fit the spectra of the given fit_datas (see
+    ccd_single_stateless._get_fit_datas) and return a list with one
+    lib_dd.fit_result.fit_result object for each spectrum
+    """
+    results = []
+    for fit_data in fit_datas:
+        ND = decomp_single_sl._prepare_ND_object(fit_data)
+        fit_ND(ND, fit_data['prep_opts']['lambda'])
+        decomp_single_sl.call_fit_functions(fit_data, ND)
+        result = fit_result.fit_result(ND, fit_data['prep_opts']['keep_nd'])
+        result.index = fit_data['nr'] - 1
+        results.append(result)
+    return results
+
+
+def fit_spectra_indexed(fit_datas):
+    """Fit the spectra of the given fit_datas and return a list of (index,
+    fit_result) tuples, index being the zero-based number of the spectrum
+    """
+    return [(x.index, x) for x in fit_spectra(fit_datas)]
@@ -2,10 +2,84 @@
 
 """
 import os
+import logging
+import numpy as np
 import ccd_single_stateless as decomp_single_sl
-from multiprocessing import Pool
+import ccd_single_batch as decomp_single_batch
+import ccd_nnls as decomp_nnls
+import ccd_single_shared as decomp_single_shared
+import scheduler
+import backends
 import lib_dd.interface as lDDi
 import lib_dd.config.cfg_single as cfg_single
+import lib_dd.io.journal as journal
+
+logger = logging.getLogger('lib_dd.decomposition.ccd_single')
+
+
+# max. number of spectra in one task of the worker processes (batches of the
+# batch and nnls engines, warm started chunks, streaming mode)
+batch_size = 500
+
+
+def _split_into_chunks(indices, nr_chunks):
+    """Split the spectrum indices into (at most) nr_chunks contiguous chunks
+    """
+    chunk_size = max(1, int(np.ceil(len(indices) / float(nr_chunks))))
+    return [indices[i: i + chunk_size] for i in
+            range(0, len(indices), chunk_size)]
+
+
+def _get_chunks(indices, nr_chunks):
+    """Split the spectrum indices into at least nr_chunks contiguous chunks of
+    at most batch_size spectra
+    """
+    nr_chunks = max(
+        nr_chunks, int(np.ceil(len(indices) / float(batch_size))))
+    return _split_into_chunks(indices, nr_chunks)
+
+
+def _sort_by_mask_group(indices, mask_groups):
+    """Sort the spectrum indices by frequency mask group, keeping the order of
+    the spectra within each group
+    """
+    return sorted(indices, key=lambda index: mask_groups.groups[index])
+
+
+def _log_kernel_cache_stats(results):
+    stats = [result.kernel_cache_stats for result in results if
+             result.kernel_cache_stats is not None]
+    if stats:
+        hits, misses = np.sum(stats, axis=0)
+        logger.info('kernel cache: {0} hits, {1} misses'.format(hits, misses))
+
+
+def _log_warm_start_stats(results):
+    """Log the iterations of all warm started fits. Savings are estimated
+    with respect to the mean number of iterations of the cold started fits.
+    """
+    # (index, warm_start, nr) of the warm started fits
+    warm = []
+    cold = []
+    for result in results:
+        if result.warm_start is None:
+            cold.append(result.nr)
+        else:
+            warm.append((result.index, result.warm_start, result.nr))
+    if not warm:
+        return
+    mean_cold = np.mean(cold) if cold else np.nan
+    for index, warm_start, nr in warm:
+        logger.info(
+            'spectrum {0}: warm start from spectrum {1}, {2} iterations '
+            '({3:.1f} saved)'.format(
+                index + 1, warm_start + 1, nr, mean_cold - nr))
+    mean_warm = np.mean([nr for index, warm_start, nr in warm])
+    logger.info(
+        'warm start: {0} spectra with {1:.2f} iterations on average, {2} '
+        'cold started spectra with {3:.2f} iterations, {4:.0f} iterations '
+        'saved'.format(len(warm), mean_warm, len(cold), mean_cold,
+                       (mean_cold - mean_warm) * len(warm)))
 
 
 class ccd_single(object):
@@ -27,23 +101,264 @@ class ccd_single(object):
         if self.data is None:
             self.get_data_dd_single()
 
-        # prepare data for multiprocessing by sorting it into individual dicts
-        # note that this process duplicated a lot of data!
-        fit_datas = decomp_single_sl._get_fit_datas(self.data)
+        # the data of the individual spectra is prepared on demand, see
+        # self._get_fit_datas
+        self.mask_groups = decomp_single_sl._mask_groups(self.data)
+        indices = np.arange(0, len(self.data['cr_data']))
+        logger.info('{0} spectra in {1} frequency mask group(s)'.format(
+            len(indices), len(self.mask_groups)))
 
         # fit
-        if(self.data['prep_opts']['nr_cores'] == 1):
+        prep_opts = self.data['prep_opts']
+        if prep_opts['warm_start'] and prep_opts['engine'] != 'ndiminv':
+            raise Exception('--warm_start requires --engine ndiminv')
+
+        # the batch and nnls engines only keep the final iteration
+        if prep_opts['engine'] != 'ndiminv' and (
+                prep_opts['plot_it_spectra'] or
+                prep_opts['plot_lambda'] is not None):
+            raise Exception(
+                '--plot_it_spectra and --plot_lambda require --engine ndiminv')
+
+        if (prep_opts.get('backend') == 'threads' and
+                decomp_single_sl._plots_requested(prep_opts)):
+            raise Exception('plotting is not possible with --backend threads')
+
+        try:
+            if prep_opts['stream'] or prep_opts['resume']:
+                results = self._fit_streaming(indices)
+            elif self._use_shared_memory(indices):
+                results = self._fit_shared(indices)
+            elif prep_opts['engine'] == 'batch':
+                results = self._fit_chunks(
+                    decomp_single_batch.fit_spectra, indices)
+            elif prep_opts['engine'] == 'nnls':
+                results = self._fit_chunks(decomp_nnls.fit_spectra, indices)
+            else:
+                results = self._fit_ndiminv(indices)
+        finally:
+            # the thread backend limits the BLAS threads of this process
+            backends.restore_blas_threads()
+        _log_warm_start_stats(results)
+
+        # results now contains one lib_dd.fit_result.fit_result object for
+        # each spectrum
+        self.results = results
+
+    def _get_fit_datas(self, indices):
+        """Return a generator of the fit_datas of the given spectra
+        """
+        return decomp_single_sl._get_fit_datas(
+            self.data, indices, self.mask_groups)
+
+    def _get_task_fit_datas(self, tasks):
+        """Generate one list of fit_datas for each list of spectrum indices
+        """
+        for task in tasks:
+            yield list(self._get_fit_datas(task))
+
+    def _get_tasks(self, indices, nr_chunks, contiguous=False):
+        """Split the spectrum indices into nr_chunks chunks of similar
+        expected cost (at most batch_size spectra each) for the worker
+        processes, most expensive first, see scheduler.get_tasks
+        """
+        costs = scheduler.expected_costs(
+            self.data, self.mask_groups, self.data.get('prior_iterations'))
+        return scheduler.get_tasks(
+            indices, costs, self.mask_groups.groups, nr_chunks, batch_size,
+            contiguous)
+
+    def _fit_ndiminv(self, indices):
+        """Fit each spectrum with its own NDimInv inversion
+        """
+        if self.data['prep_opts']['warm_start']:
+            return self._fit_warm_start(indices)
+
+        prep_opts = self.data['prep_opts']
+        nr_cores = prep_opts['nr_cores']
+        fit_datas = self._get_fit_datas(indices)
+        if(nr_cores == 1):
             print('single processing')
             # single processing
             results = list(map(decomp_single_sl.fit_one_spectrum, fit_datas))
         else:
             # multi processing
             print('multi processing')
-            p = Pool(self.data['prep_opts']['nr_cores'])
-            results = p.map(decomp_single_sl.fit_one_spectrum, fit_datas)
+            tasks = self._get_tasks(
+                indices, scheduler.chunks_per_core * nr_cores)
+            p = self._get_pool()
+            task_results = scheduler.imap(
+                p, nr_cores, decomp_single_sl.fit_spectra,
+                self._get_task_fit_datas(tasks))
+            results = [result for chunk in task_results for result in chunk]
+            results.sort(key=lambda result: result.index)
 
-        # results now contains one or more ND objects
-        self.results = results
+        _log_kernel_cache_stats(results)
+        return results
+
+    def _fit_warm_start(self, indices):
+        """Fit the spectra sequentially, warm starting from the previous
+        spectrum. For multiple cores, each task fits a contiguous chunk of
+        the spectra.
+        """
+        prep_opts = self.data['prep_opts']
+        nr_cores = prep_opts['nr_cores']
+        if nr_cores == 1:
+            results = decomp_single_sl.fit_spectra_warm_start(
+                self._get_fit_datas(indices))
+        else:
+            tasks = self._get_tasks(indices, nr_cores, contiguous=True)
+            p = self._get_pool()
+            task_results = scheduler.imap(
+                p, nr_cores, decomp_single_sl.fit_spectra_warm_start,
+                self._get_task_fit_datas(tasks))
+            results = [result for chunk in task_results for result in chunk]
+            results.sort(key=lambda result: result.index)
+
+        _log_kernel_cache_stats(results)
+        return results
+
+    def _fit_chunks(self, fit_function, indices):
+        """Fit all spectra with an engine working on lists of spectra
+        (batch, nnls). The spectra are fitted in chunks of at most batch_size
+        spectra, sorted by mask group (single core) or by expected cost
+        (multiple cores).
+        """
+        prep_opts = self.data['prep_opts']
+        nr_cores = prep_opts['nr_cores']
+        if nr_cores == 1:
+            tasks = _get_chunks(
+                _sort_by_mask_group(indices, self.mask_groups), nr_cores)
+            task_results = (fit_function(x) for x in
+                            self._get_task_fit_datas(tasks))
+        else:
+            tasks = self._get_tasks(
+                indices, scheduler.chunks_per_core * nr_cores)
+            p = self._get_pool()
+            task_results = scheduler.imap(
+                p, nr_cores, fit_function, self._get_task_fit_datas(tasks))
+        results = [result for chunk in task_results for result in chunk]
+        return sorted(results, key=lambda result: result.index)
+
+    def _get_pool(self):
+        """Return the (persistent) pool of worker processes or threads, see
+        backends.get_pool. New workers of the ndiminv engine build the ND
+        templates of all frequency mask groups when they are started.
+        """
+        prep_opts = self.data['prep_opts']
+        if prep_opts['engine'] != 'ndiminv':
+            return backends.get_pool(prep_opts)
+        # one spectrum of each mask group
+        indices = [np.flatnonzero(self.mask_groups.groups == group)[0] for
+                   group in range(len(self.mask_groups))]
+        return backends.get_pool(
+            prep_opts, initializer=decomp_single_sl.warm_up,
+            initargs=(list(self._get_fit_datas(indices)), ))
+
+    def _use_shared_memory(self, indices):
+        """Multi-core fits use shared memory for the data and the results, if
+        all spectra share the same frequencies and the NDimInv objects are
+        not kept. Worker threads (--backend threads) share all data anyway.
+
+        The worker processes inherit the shared arrays (see
+        ccd_single_shared), which requires the 'fork' start method. With
+        other start methods (e.g. 'spawn' on Windows and macOS) the data and
+        results are sent to the workers instead.
+        """
+        prep_opts = self.data['prep_opts']
+        return (prep_opts['nr_cores'] > 1 and len(indices) > 1 and
+                prep_opts.get('backend') != 'threads' and
+                backends.get_start_method() == 'fork' and
+                not prep_opts['keep_nd'] and len(self.mask_groups) == 1)
+
+    def _fit_shared(self, indices):
+        """Fit the spectra on multiple cores, sending only spectrum indices
+        to the worker processes, see ccd_single_shared. The first spectrum is
+        fitted in the main process.
+        """
+        prep_opts = self.data['prep_opts']
+        nr_cores = prep_opts['nr_cores']
+        if prep_opts['engine'] == 'batch':
+            fit_function = decomp_single_batch.fit_spectra
+        elif prep_opts['engine'] == 'nnls':
+            fit_function = decomp_nnls.fit_spectra
+        elif prep_opts['warm_start']:
+            fit_function = decomp_single_sl.fit_spectra_warm_start
+        else:
+            fit_function = decomp_single_sl.fit_spectra
+        if prep_opts['warm_start']:
+            tasks = self._get_tasks(indices[1:], nr_cores, contiguous=True)
+        else:
+            tasks = self._get_tasks(
+                indices[1:], scheduler.chunks_per_core * nr_cores)
+
+        probe_fit_data = next(self._get_fit_datas(indices[0:1]))
+        results = decomp_single_shared.fit_spectra(
+            self.data, self.mask_groups, fit_function, probe_fit_data, tasks,
+            prep_opts)
+        _log_kernel_cache_stats(results)
+        return results
+
+    def _fit_streaming(self, indices):
+        """Fit the spectra in arbitrary order and append each result to the
+        journal in the output directory as soon as it is available. With
+        --resume, spectra already stored in the journal are not fitted again.
+        The results are returned as a journal_results sequence, which reads
+        each result from the journal when it is accessed, so that the
+        results of all spectra are never held in memory at the same time.
+        """
+        prep_opts = self.data['prep_opts']
+        nr_cores = prep_opts['nr_cores']
+        fit_journal = journal.journal(
+            self.data['outdir'], len(indices), resume=prep_opts['resume'])
+        indices = [x for x in indices if x not in fit_journal.indices]
+        logger.info('{0} spectra already in the journal, fitting {1}'.format(
+            len(fit_journal.indices), len(indices)))
+
+        if prep_opts['engine'] != 'ndiminv' or prep_opts['warm_start']:
+            # chunks of at most batch_size spectra, so results are written
+            # regularly
+            if prep_opts['engine'] == 'batch':
+                fit_function = decomp_single_batch.fit_spectra_indexed
+            elif prep_opts['engine'] == 'nnls':
+                fit_function = decomp_nnls.fit_spectra_indexed
+            else:
+                fit_function = decomp_single_sl.fit_spectra_warm_start_indexed
+            if nr_cores == 1:
+                if not prep_opts['warm_start']:
+                    indices = _sort_by_mask_group(indices, self.mask_groups)
+                tasks = _get_chunks(indices, nr_cores)
+            elif prep_opts['warm_start']:
+                tasks = self._get_tasks(indices, nr_cores, contiguous=True)
+            else:
+                tasks = self._get_tasks(
+                    indices, scheduler.chunks_per_core * nr_cores)
+            tasks = self._get_task_fit_datas(tasks)
+        else:
+            # one spectrum per task, most expensive first
+            fit_function = decomp_single_sl.fit_one_spectrum_indexed
+            if nr_cores > 1:
+                indices = scheduler.order_by_cost(
+                    indices, scheduler.expected_costs(
+                        self.data, self.mask_groups,
+                        self.data.get('prior_iterations')),
+                    self.mask_groups.groups)
+            tasks = self._get_fit_datas(indices)
+
+        if nr_cores == 1:
+            task_results = (fit_function(task) for task in tasks)
+        else:
+            p = self._get_pool()
+            task_results = scheduler.imap(p, nr_cores, fit_function, tasks)
+
+        for task_result in task_results:
+            for index, result in task_result:
+                fit_journal.append(index, result)
+        fit_journal.close()
+
+        results = fit_journal.load_results()
+        _log_kernel_cache_stats(results)
+        return results
 
     def get_data_dd_single(self):
         """
@@ -65,11 +380,8 @@ class ccd_single(object):
 
         data, self.config = lDDi.load_frequencies_and_data(self.config)
 
-        # we need list of spectra
-        size_y = int(data['raw_data'].shape[1] / 2)
-        cr_data = [x.reshape((size_y, 2), order='F') for x in data['raw_data']]
-
-        data['cr_data'] = cr_data
+        # we need a sequence of (N x 2) spectra (views into raw_data)
+        data['cr_data'] = decomp_single_sl._cr_spectra(data['raw_data'])
 
         # we distinguish two sets of options:
         # prep_opts : all settings we need to prepare the inversion (i.e. set
@@ -78,6 +390,10 @@ class ccd_single(object):
         # object
         prep_opts, inv_opts = self.config.split_options()
 
+        if self.config['prior_iterations'] is not None:
+            data['prior_iterations'] = np.loadtxt(
+                self.config['prior_iterations'])
+
         data['outdir'] = outdir
         data['options'] = self.config
         data['prep_opts'] = prep_opts
@@ -0,0 +1,269 @@
+"""
+Batched Gauss-Newton engine for the ccd_single decomposition.
+
+Instead of running NDimInv.run_inversion for each spectrum, all spectra
+sharing a frequency grid are updated in lock-step using stacked Jacobians and
+batched solves of the normal equations. Spectra drop out of the batch once a
+stopping criterion applies.
+
+The NDimInv objects are still prepared for each spectrum (data conversion,
+data weighting, starting model, regularization), and the inversion procedure
+of NDimInv is replicated:
+
+    * first order smoothing regularization of the chargeabilities
+    * fixed lambda or the lambda search of NDimInv.reg_pars.SearchLambda
+    * steplength selection by fitting a parabola (SearchSteplengthParFit)
+    * the stopping criteria of NDimInv.main.InversionControl
+
+All selections and stopping criteria use the RMS of the imaginary parts
+selected by ND.stop_rms_key (index 1), as set up in
+ccd_single_stateless._prepare_ND_object: the unweighted rms_re_im_noerr, or
+the error weighted rms_re_im for spectra with masked data points (zero-weight
+masking of NaN values, see ccd_single_stateless._get_rms_key). Only the final
+iteration of each spectrum is stored in the ND objects.
+"""
+import collections
+import numpy as np
+import NDimInv.main
+import NDimInv.reg_pars as LamFuncs
+import lib_dd.fit_result as fit_result
+import ccd_single_stateless as decomp_single_sl
+
+# allowed rms increase in the first iteration
+allowed_rms_increase_first_iteration = 1e2
+# min. requested rms change between iterations
+rms_upd_eps = 1e-5
+
+
+def _group_by_frequencies(NDs):
+    """Return lists of indices of ND objects sharing the same frequencies
+    """
+    groups = collections.OrderedDict()
+    for index, ND in enumerate(NDs):
+        key = ND.Data.obj.frequencies.tobytes()
+        groups.setdefault(key, []).append(index)
+    return list(groups.values())
+
+
+def fit_spectra(fit_datas):
+    """Fit the spectra of the given fit_datas (see
+    ccd_single_stateless._get_fit_datas) and return a list with one
+    lib_dd.fit_result.fit_result object for each spectrum
+    """
+    NDs = [decomp_single_sl._prepare_ND_object(x) for x in fit_datas]
+    for indices in _group_by_frequencies(NDs):
+        print('Fitting {0} spectra with {1} frequencies in one batch'.format(
+            len(indices), NDs[indices[0]].Data.obj.frequencies.size))
+        inversion = batch_inversion([NDs[x] for x in indices])
+        inversion.run_inversion()
+
+    results = []
+    for fit_data, ND in zip(fit_datas, NDs):
+        decomp_single_sl.call_fit_functions(fit_data, ND)
+        result = fit_result.fit_result(ND, fit_data['prep_opts']['keep_nd'])
+        result.index = fit_data['nr'] - 1
+        results.append(result)
+    return results
+
+
+def fit_spectra_indexed(fit_datas):
+    """Fit the spectra of the given fit_datas and return a list of (index,
+    fit_result) tuples, index being the zero-based number of the spectrum
+    """
+    results = fit_spectra(fit_datas)
+    return [(x['nr'] - 1, result) for x, result in zip(fit_datas, results)]
+
+
+class batch_inversion(object):
+    """Gauss-Newton inversion of multiple spectra with identical frequencies.
+    The ND objects must be prepared by ccd_single_stateless._prepare_ND_object.
+    """
+
+    def __init__(self, NDs):
+        self.NDs = NDs
+        ND0 = NDs[0]
+        self.model = ND0.Model.obj
+        self.max_iterations = ND0.settings['max_iterations']
+
+        # stacked data (S x N x 2), weights and starting models
+        self.D = np.array([ND.Data.D for ND in NDs])
+        self.nr_f = self.D.shape[1]
+        self.d = self.D.transpose(0, 2, 1).reshape(len(NDs), -1)
+        self.wd = np.array([ND.Data.WD().flatten(order='F') for ND in NDs])
+        self.m0 = np.array([ND.Model.m0 for ND in NDs])
+        # rms weights of the imaginary parts: the error weights for spectra
+        # optimizing the error weighted rms (rms_re_im), otherwise one
+        error_weighted = np.array(
+            [ND.stop_rms_key == 'rms_re_im' for ND in NDs])
+        self.rms_weights = np.where(
+            error_weighted[:, np.newaxis], self.wd[:, self.nr_f:], 1.0)
+
+        # the regularization is the same for all spectra
+        reg_obj, self.lam_obj = ND0.Model.regularizations[0][0]
+        self.WtWm = ND0.Model.map_reg_matrix_to_global_Wm(
+            0, func=reg_obj.WtWm, outside_first_dim=reg_obj.outside_first_dim)
+        self.lam0 = self.lam_obj.get_lambda(
+            ND0.get_initial_iteration(), self.WtWm, lam_index=0)
+        self.search_lambda = isinstance(self.lam_obj, LamFuncs.SearchLambda)
+
+    def rms(self, f, indices):
+        """Return the rms of the imaginary parts of the forward responses f
+        (S x N x 2) for the spectra with the given indices
+        """
+        diff = (self.D[indices, :, 1] - f[:, :, 1]) * \
+            self.rms_weights[indices]
+        return np.sqrt(np.sum(diff ** 2, axis=1) / self.nr_f)
+
+    def rms_of(self, m, indices):
+        return self.rms(self.model.forward_batch(m), indices)
+
+    def normal_equations(self, m, indices):
+        r"""Return the regularization independent parts of the normal
+        equations, :math:`J^T W_d^T W_d J` and :math:`J^T W_d^T W_d (d - f)`
+        """
+        f, J = self.model.forward_and_Jacobian_batch(m)
+        f_flat = f.transpose(0, 2, 1).reshape(m.shape[0], -1)
+        wd = self.wd[indices]
+        JW = J * wd[:, :, np.newaxis]
+        JWt = JW.transpose(0, 2, 1)
+        A = np.matmul(JWt, JW)
+        b = np.matmul(
+            JWt, (wd * (self.d[indices] - f_flat))[:, :, np.newaxis])[:, :, 0]
+        return A, b
+
+    def model_update(self, A, b, m, lams):
+        """Solve the regularized normal equations for each spectrum. Spectra
+        for which the system cannot be solved get NaN updates.
+        """
+        A = A + lams[:, np.newaxis, np.newaxis] * self.WtWm[np.newaxis]
+        b = b - lams[:, np.newaxis] * m.dot(self.WtWm.T)
+        try:
+            return np.linalg.solve(A, b[:, :, np.newaxis])[:, :, 0]
+        except np.linalg.LinAlgError:
+            pass
+
+        update = np.empty_like(b)
+        for index in range(b.shape[0]):
+            try:
+                update[index] = np.linalg.solve(A[index], b[index])
+            except np.linalg.LinAlgError:
+                update[index] = np.nan
+        return update
+
+    def steplength(self, m, update, rms_old, indices):
+        """Fit a parabola through the rms values for the steplengths 0, 0.5
+        and 1 and return the steplengths of the minima, see
+        NDimInv.main.SearchSteplengthParFit
+        """
+        x = np.array((0, 0.5, 1))
+        y = np.vstack((
+            rms_old,
+            self.rms_of(m + 0.5 * update, indices),
+            self.rms_of(m + update, indices),
+        ))
+        A = np.zeros((3, 3), dtype=np.float64)
+        A[:, 0] = x ** 2
+        A[:, 1] = x
+        A[:, 2] = 1
+        a, b, c = np.linalg.solve(A, y)
+        x_min = -b / (2 * a)
+
+        x_min[x_min > 1] = 1
+        x_min[x_min <= 0] = 0.1
+        return x_min
+
+    def update_with_lambdas(self, A, b, m, rms_old, lams, indices):
+        """Return the new models after a model update with the given lambdas
+        """
+        update = self.model_update(A, b, m, lams)
+        alpha = self.steplength(m, update, rms_old, indices)
+        return m + alpha[:, np.newaxis] * update
+
+    def search_lambdas(self, A, b, m, rms_old, lams_old, indices):
+        """Test multiple lambda values around the last lambdas and return the
+        lambdas with the lowest resulting rms values, see
+        NDimInv.reg_pars.SearchLambda
+        """
+        test_lams = np.vstack((
+            lams_old,
+            lams_old / 10, lams_old / 5, lams_old * 5,
+            lams_old * 10, lams_old * 100, lams_old * 1e4,
+        ))
+        test_rms = np.empty_like(test_lams)
+        # the last iteration itself is the first candidate
+        test_rms[0] = rms_old
+        for nr in range(1, test_lams.shape[0]):
+            m_test = self.update_with_lambdas(
+                A, b, m, rms_old, test_lams[nr], indices)
+            test_rms[nr] = self.rms_of(m_test, indices)
+            # lambdas for which no update could be computed are skipped
+            test_rms[nr][np.any(np.isnan(m_test), axis=1)] = np.inf
+
+        best = np.argmin(test_rms, axis=0)
+        return test_lams[best, np.arange(best.size)]
+
+    def stop_now(self, m_new, rms_new, rms_old, nrs):
+        """Evaluate the stopping criteria of
+        NDimInv.main.InversionControl.check_stopping_criteria_before_update
+        for each spectrum
+        """
+        stop = np.any(np.isnan(m_new), axis=1)
+        stop |= np.any(m_new[:, 1:] < -15, axis=1)
+
+        increase = rms_new > rms_old
+        stop |= increase & (nrs > 0)
+        stop |= (increase & (nrs == 0) &
+                 (rms_new - rms_old > allowed_rms_increase_first_iteration))
+
+        stop |= np.abs(rms_new - rms_old) < rms_upd_eps
+        return stop
+
+    def run_inversion(self):
+        """Run the inversion for all spectra and store the final iterations
+        in the ND objects
+        """
+        nr_spectra = len(self.NDs)
+        m = self.m0.copy()
+        all_indices = np.arange(nr_spectra)
+        rms = self.rms_of(m, all_indices)
+        lams = np.ones(nr_spectra) * self.lam0
+        nrs = np.zeros(nr_spectra, dtype=int)
+        active = nrs < self.max_iterations
+
+        while np.any(active):
+            indices = np.where(active)[0]
+            m_old = m[indices]
+            rms_old = rms[indices]
+            A, b = self.normal_equations(m_old, indices)
+
+            # select the lambdas for this iteration
+            lams_new = lams[indices].copy()
+            if self.search_lambda:
+                later = np.where(nrs[indices] > 0)[0]
+                if later.size > 0:
+                    lams_new[later] = self.search_lambdas(
+                        A[later], b[later], m_old[later], rms_old[later],
+                        lams_new[later], indices[later])
+
+            m_new = self.update_with_lambdas(
+                A, b, m_old, rms_old, lams_new, indices)
+            rms_new = self.rms_of(m_new, indices)
+
+            stop = self.stop_now(m_new, rms_new, rms_old, nrs[indices])
+            accept = indices[~stop]
+            m[accept] = m_new[~stop]
+            rms[accept] = rms_new[~stop]
+            lams[accept] = lams_new[~stop]
+            nrs[accept] += 1
+
+            active[indices[stop]] = False
+            active &= nrs < self.max_iterations
+
+        f = self.model.forward_batch(m)
+        for index, ND in enumerate(self.NDs):
+            it = NDimInv.main.Iteration(
+                int(nrs[index]), ND.Data, ND.Model, ND.RMS, ND.settings)
+            it.m = m[index]
+            it.f = f[index].flatten(order='F')
+            it.lams = [lams[index]]
+            ND.iterations = [it]
@@ -0,0 +1,203 @@
+"""
+Shared memory data plane of multi-core ccd_single fits.
+
+The raw data of all spectra and the numeric parts of the fit results are
+stored in shared ctypes arrays, which are inherited by the worker processes
+when the pool is created. The tasks sent to the workers then only consist of
+spectrum indices: each worker prepares the fit data of its spectra from the
+shared input array and writes the results directly into the shared output
+arrays. Only values that do not fit into the output arrays (e.g. a varying
+number of peaks) are pickled and sent back.
+
+The layout of the output arrays is taken from the result of the first
+spectrum, which is fitted in the main process. Therefore, all spectra must
+share the same frequencies (i.e., one frequency mask group).
+
+The shared arrays are only inherited by forked worker processes, so this
+data plane is only used with the 'fork' start method (see
+backends.get_start_method).
+"""
+import copy
+import ctypes
+import logging
+from multiprocessing import sharedctypes
+import numpy as np
+import ccd_single_stateless as decomp_single_sl
+import scheduler
+import backends
+
+logger = logging.getLogger('lib_dd.decomposition.ccd_single_shared')
+
+# fit_result attributes which differ between spectra
+_result_attributes = (
+    'm', 'f', 'errors', 'nr', 'lams', 'kernel_cache_stats', 'warm_start'
+)
+_result_dicts = ('stat_pars', 'rms_values')
+
+# state of the worker processes, see _init_worker
+_worker = {}
+
+
+def shared_array(shape, dtype=np.float64):
+    """Return a zero-initialized numpy array in shared memory. The array must
+    be created before the worker processes, which inherit it.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    raw = sharedctypes.RawArray(ctypes.c_char, max(1, size * dtype.itemsize))
+    return np.frombuffer(raw, dtype=dtype, count=size).reshape(shape)
+
+
+def _get_fields(result):
+    """Return a dict with all spectrum dependent values of a fit result
+    """
+    fields = dict((name, getattr(result, name)) for name in
+                  _result_attributes)
+    for name in _result_dicts:
+        for key, value in getattr(result, name).items():
+            fields[(name, key)] = value
+    return fields
+
+
+def _get_layout(result):
+    """Return the layout of the output arrays for fit results similar to the
+    given one: a dict field -> (type, shape, dtype) for all numeric fields
+    """
+    layout = {}
+    for field, value in _get_fields(result).items():
+        array = np.asarray(value)
+        if array.dtype.kind in 'biuf':
+            layout[field] = (type(value), array.shape, array.dtype)
+    return layout
+
+
+def _store_result(outputs, layout, index, result):
+    """Write the numeric fields of a fit result into the output arrays and
+    return a dict with all remaining fields
+    """
+    remainder = {}
+    for field, value in _get_fields(result).items():
+        if field in layout:
+            value_type, shape, dtype = layout[field]
+            array = np.asarray(value)
+            if (type(value) is value_type and array.shape == shape and
+                    array.dtype.kind in 'biuf'):
+                outputs[field][index] = array
+                continue
+        remainder[field] = value
+    return remainder
+
+
+def _get_result(probe, outputs, layout, index, remainder):
+    """Assemble the fit result of a spectrum from the output arrays (views)
+    and the remaining fields. All spectrum independent attributes are copied
+    from the probe result.
+    """
+    result = copy.copy(probe)
+    for name in _result_dicts:
+        setattr(result, name, {})
+    fields = dict(remainder)
+    for field, (value_type, shape, dtype) in layout.items():
+        if field in fields:
+            continue
+        value = outputs[field][index]
+        if value_type is list:
+            value = list(value)
+        elif value_type is not np.ndarray:
+            value = value_type(value)
+        fields[field] = value
+
+    for field, value in fields.items():
+        if isinstance(field, tuple):
+            getattr(result, field[0])[field[1]] = value
+        else:
+            setattr(result, field, value)
+    result.index = index
+    return result
+
+
+def _init_worker(data, mask_groups, fit_function, outputs, layout):
+    _worker['data'] = data
+    _worker['mask_groups'] = mask_groups
+    _worker['fit_function'] = fit_function
+    _worker['outputs'] = outputs
+    _worker['layout'] = layout
+
+
+def _fit_indices(indices):
+    """Fit the spectra with the given indices, write the results into the
+    output arrays and return a list of (index, remaining fields) tuples
+    """
+    fit_datas = decomp_single_sl._get_fit_datas(
+        _worker['data'], indices, _worker['mask_groups'])
+    results = _worker['fit_function'](fit_datas)
+    return [
+        (result.index, _store_result(
+            _worker['outputs'], _worker['layout'], result.index, result))
+        for result in results
+    ]
+
+
+def fit_spectra(data, mask_groups, fit_function, probe_fit_data, tasks,
+                prep_opts):
+    """Fit all spectra on multiple cores using shared memory for the data and
+    the results
+
+    Parameters
+    ----------
+    data: data dict of ccd_single (see ccd_single.get_data_dd_single). Its
+          raw_data and cr_data are replaced by the shared input array.
+    mask_groups: ccd_single_stateless._mask_groups object of the data
+    fit_function: function fitting a list of fit_datas, returning a list of
+                  fit_results (with the index attribute set)
+    probe_fit_data: fit_data of the spectrum that is fitted first, in the
+                    main process, to determine the layout of the output arrays
+    tasks: lists of the indices of all other spectra, in the order of
+           dispatch. Each list is fitted by one call to fit_function in a
+           worker process.
+    prep_opts: prep_opts of the run, with the number of worker processes
+               (nr_cores) and BLAS threads, see backends.get_pool
+
+    Returns
+    -------
+    results: list with one fit_result for each spectrum, sorted by index
+    """
+    probe = fit_function([probe_fit_data])[0]
+    layout = _get_layout(probe)
+
+    nr_of_spectra = data['raw_data'].shape[0]
+    outputs = dict(
+        (field, shared_array((nr_of_spectra, ) + shape, dtype)) for
+        field, (value_type, shape, dtype) in layout.items()
+    )
+    logger.info('shared memory: {0} output arrays, {1:.1f} MB'.format(
+        len(outputs), sum(x.nbytes for x in outputs.values()) / 1e6))
+    remainders = {probe.index: _store_result(
+        outputs, layout, probe.index, probe)}
+
+    raw_data = shared_array(data['raw_data'].shape, data['raw_data'].dtype)
+    raw_data[:] = data['raw_data']
+    # the shared array replaces the input data of the main process, so the
+    # data is not held twice
+    data['raw_data'] = raw_data
+    data['cr_data'] = decomp_single_sl._cr_spectra(raw_data)
+    worker_data = dict((key, value) for key, value in data.items() if key
+                       not in ('raw_data', 'cr_data'))
+    worker_data['cr_data'] = decomp_single_sl._cr_spectra(raw_data)
+
+    nr_cores = prep_opts['nr_cores']
+    # the workers inherit the shared arrays when they are started, therefore
+    # the pool can not be reused
+    p = backends.get_pool(
+        prep_opts, initializer=_init_worker,
+        initargs=(worker_data, mask_groups, fit_function, outputs, layout),
+        persistent=False)
+    for task_result in scheduler.imap(p, nr_cores, _fit_indices, tasks):
+        remainders.update(task_result)
+    p.close()
+    p.join()
+
+    return [
+        _get_result(probe, outputs, layout, index, remainders[index]) for
+        index in sorted(remainders.keys())
+    ]
@@ -6,64 +6,192 @@ import os
 import NDimInv
 import NDimInv.regs as RegFuncs
 import NDimInv.reg_pars as LamFuncs
-import gc
 import lib_dd.plot as lDDp
 import sip_formats.convert as sip_converter
 import lib_dd.conductivity.model as cond_model
+import lib_dd.kernels as kernels
+import lib_dd.fit_result as fit_result
 from lib_dd.models import ccd_res
 
 import numpy as np
 
 
-def _filter_nan_values(frequencies, cr_spectrum):
+def _fill_nan_values(frequencies, cr_spectrum, nan_along_freq):
     """
-    Filter nan values along the frequency axis (we always ne part1 and
-    part2).
+    Replace the data of frequencies with NaN values by values interpolated
+    (log10 of frequencies) from the remaining frequencies. Used when missing
+    data points are masked by zero data weights.
+    """
+    filled = cr_spectrum.copy()
+    valid = ~nan_along_freq
+    logf = np.log10(frequencies)
+    for column in range(filled.shape[1]):
+        filled[nan_along_freq, column] = np.interp(
+            logf[nan_along_freq], logf[valid], cr_spectrum[valid, column])
+    return filled
+
+
+class _data_weighting(object):
+    """Data weighting function of one spectrum. The weights are requested for
+    each rms evaluation, but only change with the data, and are therefore
+    cached. The weights of masked frequencies are set to zero.
+    """
+
+    def __init__(self, weighting_func, mask=None):
+        self.weighting_func = weighting_func
+        self.mask = mask
+        self.data = None
+        self.weights = None
+
+    def __call__(self, base_data, settings):
+        if self.data is None or not np.array_equal(base_data, self.data):
+            weights = self.weighting_func(base_data, settings=settings)
+            if self.mask is not None:
+                weights[self.mask, :] = 0
+            self.data = base_data.copy()
+            self.weights = weights
+        return self.weights
+
+
+class _smoothing_first_order(RegFuncs.SmoothingFirstOrder):
+    """First order smoothing with cached, read-only regularization matrices.
+    The regularization objects of all spectra of a template share the cache
+    WtWms (parameter size -> WtWm).
+    """
+
+    def __init__(self, *args, **kwargs):
+        WtWms = kwargs.pop('WtWms', None)
+        super(_smoothing_first_order, self).__init__(*args, **kwargs)
+        if WtWms is None:
+            WtWms = {}
+        self.WtWms = WtWms
 
-    Return filtered frequencies, cr_spectrum
+    def WtWm(self, parsize):
+        if parsize not in self.WtWms:
+            WtWm = super(_smoothing_first_order, self).WtWm(parsize)
+            WtWm.flags.writeable = False
+            self.WtWms[parsize] = WtWm
+        return self.WtWms[parsize]
+
+
+class _cr_spectra(object):
+    """Sequence of the (N x 2) spectra of a (nr_spectra x 2N) data array,
+    returned as views into the data array
     """
 
-    # check for NaN values
-    nan_indices = np.isnan(cr_spectrum)
-    nan_along_freq = np.any(nan_indices, axis=1)
-    to_delete = np.where(nan_along_freq)
-    frequencies_cropped = np.delete(frequencies, to_delete)
-    cr_spectrum_cropped = np.delete(cr_spectrum, to_delete, axis=0)
-    return frequencies_cropped, cr_spectrum_cropped
+    def __init__(self, raw_data):
+        self.raw_data = raw_data
+
+    def __len__(self):
+        return self.raw_data.shape[0]
+
+    def __getitem__(self, index):
+        return self.raw_data[index].reshape((-1, 2), order='F')
+
 
+class _mask_groups(object):
+    """
+    Frequency mask groups of all spectra: spectra with NaN values at the same
+    frequencies form one group, and all spectra of a group share the same
+    frequency array. Depending on prep_opts['nan_handling'], the frequencies
+    with NaN values are either removed ('crop'), or kept and masked by zero
+    data weights ('weights'). In the latter case all spectra share one
+    frequency grid.
+
+    Attributes
+    ----------
+    groups: group number of each spectrum
+    frequencies: frequencies of each group
+    masks: for each group a boolean array marking the frequencies with NaN
+           values, or None if there are none
+    """
 
-def _get_fit_datas(data):
+    def __init__(self, data):
+        nan_handling = data['prep_opts'].get('nan_handling', 'crop')
+        nr_of_spectra = len(data['cr_data'])
+        self.groups = np.zeros(nr_of_spectra, dtype=int)
+        self.frequencies = []
+        self.masks = []
+
+        # mask key -> group number
+        keys = {}
+        for i in range(0, nr_of_spectra):
+            nan_along_freq = np.any(np.isnan(data['cr_data'][i]), axis=1)
+            key = nan_along_freq.tobytes()
+            if key not in keys:
+                keys[key] = len(keys)
+                if not np.any(nan_along_freq):
+                    self.frequencies.append(data['frequencies'])
+                    self.masks.append(None)
+                elif nan_handling == 'weights':
+                    self.frequencies.append(data['frequencies'])
+                    self.masks.append(nan_along_freq)
+                else:
+                    self.frequencies.append(
+                        data['frequencies'][~nan_along_freq])
+                    self.masks.append(nan_along_freq)
+            self.groups[i] = keys[key]
+
+    def __len__(self):
+        return len(self.frequencies)
+
+
+def _get_fit_datas(data, indices=None, mask_groups=None):
     """
-    Prepare data for fitting. Prepare a set of variables/objects for each
-    spectrum. Also filter nan values
+    Prepare data for fitting. Yield a set of variables/objects for each
+    spectrum (fit_data dicts). Also filter nan values, see _mask_groups.
+
+    The fit_datas are generated one at a time, and the data of each spectrum
+    is a view into data['cr_data'] (unless NaN values are removed or
+    replaced), so the required memory does not depend on the number of
+    spectra.
 
     Parameters
     ----------
     data : dict containing the keys 'frequencies', 'cr_data'
+    indices : zero-based numbers of the spectra to prepare. Default: all
+    mask_groups : _mask_groups object of the data. Default: determine
     """
-    fit_datas = []
+    nan_handling = data['prep_opts'].get('nan_handling', 'crop')
+    if mask_groups is None:
+        mask_groups = _mask_groups(data)
 
     nr_of_spectra = len(data['cr_data'])
-    for i in range(0, nr_of_spectra):
+    if indices is None:
+        indices = range(0, nr_of_spectra)
+    for i in indices:
+        i = int(i)
         fit_data = {}
         fit_data['outdir'] = data['outdir']
-        # change file prefix for each spectrum
-        # at the moment we need a copy for this
-        frequencies_cropped, cr_data = _filter_nan_values(
-            data['frequencies'], data['cr_data'][i]
-        )
+
+        group = int(mask_groups.groups[i])
+        frequencies = mask_groups.frequencies[group]
+        mask = mask_groups.masks[group]
+
+        cr_data = data['cr_data'][i]
+        if mask is not None:
+            if nan_handling == 'weights':
+                cr_data = _fill_nan_values(data['frequencies'], cr_data, mask)
+            else:
+                cr_data = cr_data[~mask, :]
+                mask = None
 
         fit_data['prep_opts'] = data['prep_opts']
         fit_data['data'] = cr_data
         fit_data['nr'] = i + 1
         fit_data['nr_of_spectra'] = nr_of_spectra
-        fit_data['frequencies'] = frequencies_cropped
+        fit_data['frequencies'] = frequencies
+        fit_data['mask_group'] = group
+        fit_data['mask'] = mask
 
         # inversion options are changed for each spectrum, so we have to
         # copy it each time
         inv_opts_i = data['inv_opts'].copy()
-        inv_opts_i['frequencies'] = frequencies_cropped
-        inv_opts_i['global_prefix'] = 'spec_{0:03}_'.format(i)
+        inv_opts_i['frequencies'] = frequencies
+        # NDimInv prefixes all plot files with the global prefix, i.e. they
+        # are written to the output directory
+        inv_opts_i['global_prefix'] = os.path.join(
+            data['outdir'], 'spec_{0:03}_'.format(i))
         if('norm_factors' in data):
             inv_opts_i['norm_factors'] = data['norm_factors'][i]
         else:
@@ -71,84 +199,221 @@ def _get_fit_datas(data):
 
         fit_data['inv_opts'] = inv_opts_i
 
-        fit_datas.append(fit_data)
+        yield fit_data
+
+
+def _settings_key(value):
+    if isinstance(value, np.ndarray):
+        return value.tobytes()
+    return repr(value)
+
+
+def _template_key(fit_data):
+    """Return the key of the ND template of a spectrum: the frequencies,
+    all spectrum independent settings, and if data points are masked (see
+    _get_rms_key)
+    """
+    inv_opts = fit_data['inv_opts']
+    settings = tuple(sorted(
+        (key, _settings_key(value)) for key, value in inv_opts.items() if
+        key not in ('global_prefix', 'norm_factors')
+    ))
+    return (os.environ.get('DD_COND', None), fit_data['mask'] is not None,
+            settings)
+
+
+def _get_rms_key(fit_data):
+    """Return the rms used for the lambda search, the steplength selection
+    and the stopping criteria. Masked data points (zero-weight masking, see
+    _get_fit_datas) hold interpolated values, which are included in the
+    unweighted rms (rms_re_im_noerr). The error weighted rms ignores them,
+    as their data weights are zero.
+    """
+    if fit_data['mask'] is not None:
+        return 'rms_re_im'
+    return 'rms_re_im_noerr'
+
+
+class _ND_template(object):
+    """Spectrum independent parts of the NDimInv objects of all spectra with
+    the same frequencies and settings: the model settings and the
+    regularization matrices. Only read-only objects are shared by the
+    spectra, as NDimInv modifies the model, regularization, lambda and
+    steplength objects during the inversion, and the spectra of a template
+    can be fitted at the same time (--backend threads). The model objects of
+    all spectra share the cached tau values and kernels (see lib_dd.kernels).
+    """
+    # rms value to optimize
+    optimize_rms_index = 1  # imaginary part
+
+    def __init__(self, fit_data):
+        self.optimize_rms_key = _get_rms_key(fit_data)
+
+        # use conductivity or resistivity model?
+        if 'DD_COND' in os.environ and os.environ['DD_COND'] == '1':
+            # there is only one parameterisation: log10(sigma_i), log10(m)
+            self.model_class = cond_model.dd_conductivity
+        else:
+            # model = lib_cc2.decomposition_resistivity(fit_data['inv_opts'])
+            self.model_class = ccd_res.decomposition_resistivity
+
+        # the model settings do not include the spectrum dependent settings
+        self.model_settings = dict(
+            (key, value) for key, value in fit_data['inv_opts'].items() if
+            key not in ('global_prefix', 'norm_factors')
+        )
+
+        # compute the (cached) tau values and kernel in advance
+        self.model_class(self.model_settings.copy())
+
+        # regularization matrices of the frequency regularization
+        self.WtWms = {}
+
+    def new_ND(self, fit_data):
+        """Return a new NDimInv object for the spectrum of fit_data
+        """
+        model = self.model_class(self.model_settings.copy())
+        ND = NDimInv.NDimInv(model, fit_data['inv_opts'])
+        ND.finalize_dimensions()
+        ND.Data.data_converter = sip_converter.convert
+        ND.Data.data_weighting_func = _data_weighting(
+            ND.Data.data_weighting_func, fit_data['mask'])
+
+        # read in data
+        # print fit_data['data'], fit_data['prep_opts']['data_format']
+        ND.Data.add_data(
+            fit_data['data'],
+            fit_data['prep_opts']['data_format'],
+            extra=[]
+        )
+
+        # now that we know the frequencies we can call the post_frequency
+        # handler for the model side
+        ND.update_model()
+
+        # add rms types
+        ND.RMS.add_rms('rms_re_im',
+                       [True, False],
+                       ['rms_real_parts', 'rms_imag_parts'])
+
+        # use imaginary part for stopping criteria
+        ND.stop_rms_key = self.optimize_rms_key
+        ND.stop_rms_index = 1
+
+        ND.set_custom_plot_func(lDDp.plot_iteration())
+
+        # the lambda objects can be modified for each spectrum (warm start)
+        if(fit_data['prep_opts']['lambda'] is None):
+            lam_obj = LamFuncs.SearchLambda(LamFuncs.Lam0_Easylam())
+            lam_obj.rms_key = self.optimize_rms_key
+            lam_obj.rms_index = self.optimize_rms_index
+        else:
+            lam_obj = LamFuncs.FixedLambda(fit_data['prep_opts']['lambda'])
+
+        # frequency regularization for the DD model
+        regularization = _smoothing_first_order(
+            decouple=[0, ], WtWms=self.WtWms)
+        ND.Model.add_regularization(0, regularization, lam_obj)
 
-    return fit_datas
+        # choose from a fixed set of step lengths
+        ND.Model.steplength_selector = NDimInv.main.SearchSteplengthParFit(
+            self.optimize_rms_key, self.optimize_rms_index)
+        return ND
+
+
+_templates = kernels._lru_cache(kernels._maxsize)
 
 
 def _prepare_ND_object(fit_data):
-    # use conductivity or resistivity model?
-    if 'DD_COND' in os.environ and os.environ['DD_COND'] == '1':
-        # there is only one parameterisation: log10(sigma_i), log10(m)
-        model = cond_model.dd_conductivity(fit_data['inv_opts'])
-    else:
+    """Return the NDimInv object for the spectrum of fit_data, based on the
+    (cached) template of its frequencies and settings
+    """
+    return _get_template(fit_data).new_ND(fit_data)
+
+
+def _get_template(fit_data):
+    """Return the (cached) ND template of the frequencies and settings of
+    fit_data
+    """
+    if not ('DD_COND' in os.environ and os.environ['DD_COND'] == '1'):
         # there are multiple parameterisations available, use the log10 one
         # model = lib_dd.main.get('log10rho0log10m', fit_data['inv_opts'])
         if 'DD_C' in os.environ:
             fit_data['inv_opts']['c'] = float(os.environ['DD_C'])
         else:
             fit_data['inv_opts']['c'] = 1.0
-        # model = lib_cc2.decomposition_resistivity(fit_data['inv_opts'])
-        model = ccd_res.decomposition_resistivity(fit_data['inv_opts'])
-    ND = NDimInv.NDimInv(model, fit_data['inv_opts'])
-    ND.finalize_dimensions()
-    ND.Data.data_converter = sip_converter.convert
-
-    # read in data
-    # print fit_data['data'], fit_data['prep_opts']['data_format']
-    ND.Data.add_data(
-        fit_data['data'],
-        fit_data['prep_opts']['data_format'],
-        extra=[]
-    )
-
-    # now that we know the frequencies we can call the post_frequency
-    # handler for the model side
-    ND.update_model()
 
-    # add rms types
-    ND.RMS.add_rms('rms_re_im',
-                   [True, False],
-                   ['rms_real_parts', 'rms_imag_parts'])
+    return _templates.get(
+        _template_key(fit_data), lambda: _ND_template(fit_data))
 
-    # use imaginary part for stopping criteria
-    ND.stop_rms_key = 'rms_re_im_noerr'
-    ND.stop_rms_index = 1
 
-    ND.set_custom_plot_func(lDDp.plot_iteration())
+def warm_up(fit_datas):
+    """Build the ND templates (tau ranges, kernels and regularization) of the
+    given spectra in advance. Used as initializer of new worker processes.
+    """
+    for fit_data in fit_datas:
+        _get_template(fit_data)
 
-    # rms value to optimize
-    optimize_rms_key = 'rms_re_im_noerr'
-    optimize_rms_index = 1  # imaginary part
 
-    # add a frequency regularization for the DD model
-    if(fit_data['prep_opts']['lambda'] is None):
-        lam_obj = LamFuncs.SearchLambda(LamFuncs.Lam0_Easylam())
-        lam_obj.rms_key = optimize_rms_key
-        lam_obj.rms_index = optimize_rms_index
-    else:
-        lam_obj = LamFuncs.FixedLambda(fit_data['prep_opts']['lambda'])
+def _apply_warm_start(ND, warm_start):
+    """Replace the chargeabilities of the starting model with those of a
+    previously fitted spectrum, if this improves the starting rms. The
+    log10(rho0) (or log10(sigma_infty)) value is always estimated from the
+    data. When searching for lambda, the search starts at the final lambda of
+    the previous spectrum.
 
-    ND.Model.add_regularization(0,
-                                RegFuncs.SmoothingFirstOrder(
-                                    decouple=[0, ]),
-                                lam_obj
-                                )
+    Parameters
+    ----------
+    ND: NDimInv object prepared by _prepare_ND_object
+    warm_start: fit_result of the previous spectrum
 
-    # choose from a fixed set of step lengths
-    ND.Model.steplength_selector = NDimInv.main.SearchSteplengthParFit(
-        optimize_rms_key, optimize_rms_index)
-    return ND
+    Returns
+    -------
+    True if the warm start model is used
+    """
+    model = ND.Model.obj
+    if (warm_start.tau.shape != model.tau.shape or
+            not np.allclose(warm_start.tau, model.tau) or
+            np.any(np.isnan(warm_start.m))):
+        return False
+
+    m0_cold = ND.Model.m0
+    rms_cold = ND.get_initial_iteration().rms_values[ND.stop_rms_key][
+        ND.stop_rms_index]
+    ND.Model.m0 = np.hstack((m0_cold[0], warm_start.m[1:]))
+    rms_warm = ND.get_initial_iteration().rms_values[ND.stop_rms_key][
+        ND.stop_rms_index]
+    if rms_warm <= rms_cold:
+        lam_obj = ND.Model.regularizations[0][0][1]
+        if isinstance(lam_obj, LamFuncs.SearchLambda):
+            lam_obj.lam0_obj = LamFuncs.Lam0_Fixed(warm_start.lams[0])
+        return True
+    ND.Model.m0 = m0_cold
+    return False
 
 
 # @profile
-def fit_one_spectrum(fit_data):
+def fit_one_spectrum(fit_data, warm_start=None):
     """
-    Fit one spectrum
+    Fit one spectrum and return a lib_dd.fit_result.fit_result object
+
+    Parameters
+    ----------
+    fit_data: dict, see _get_fit_datas
+    warm_start: fit_result of a previously fitted (similar) spectrum, which
+                is used to derive the starting model. Default: None
     """
     print('Fitting spectrum {0} of {1}'.format(fit_data['nr'],
                                                fit_data['nr_of_spectra']))
+    # kernel cache usage of this fit: the cache is local to each process,
+    # and shared by the threads of --backend threads, so only the accesses
+    # of this thread are counted
+    hits, misses = kernels.thread_cache_info()
     ND = _prepare_ND_object(fit_data)
+    cache_stats = np.array(kernels.thread_cache_info()) - (hits, misses)
+
+    warm_started = (warm_start is not None and
+                    _apply_warm_start(ND, warm_start))
 
     # run the inversion
     ND.run_inversion()
@@ -170,15 +435,53 @@ def fit_one_spectrum(fit_data):
 
     call_fit_functions(fit_data, ND)
 
-    # invoke the garbage collection just to be sure
-    gc.collect()
-    return ND
+    result = fit_result.fit_result(ND, fit_data['prep_opts']['keep_nd'])
+    result.kernel_cache_stats = cache_stats
+    result.index = fit_data['nr'] - 1
+    if warm_started:
+        result.warm_start = warm_start.index
 
+    return result
 
-def call_fit_functions(fit_data, ND):
-    # only proceed if one of the plot functions will be called. This makes sure
-    # that we can run without an existing output directory, and only fail if we
-    # really try to plot...
+
+def fit_spectra(fit_datas):
+    """Fit the spectra one after another and return a list with one
+    fit_result for each spectrum
+    """
+    return [fit_one_spectrum(fit_data) for fit_data in fit_datas]
+
+
+def fit_one_spectrum_indexed(fit_data):
+    """Fit one spectrum and return a list with one (index, fit_result) tuple,
+    index being the zero-based number of the spectrum
+    """
+    return [(fit_data['nr'] - 1, fit_one_spectrum(fit_data))]
+
+
+def fit_spectra_warm_start(fit_datas):
+    """Fit the spectra one after another, warm starting each fit from the
+    final model of the previous spectrum. Return a list with one fit_result
+    for each spectrum.
+    """
+    results = []
+    previous = None
+    for fit_data in fit_datas:
+        result = fit_one_spectrum(fit_data, previous)
+        results.append(result)
+        previous = result
+    return results
+
+
+def fit_spectra_warm_start_indexed(fit_datas):
+    """Same as fit_spectra_warm_start, but return a list of (index,
+    fit_result) tuples, index being the zero-based number of the spectrum
+    """
+    return [(x.index, x) for x in fit_spectra_warm_start(fit_datas)]
+
+
+def _plots_requested(prep_opts):
+    """Return True if any of the plot functions will be called after a fit
+    """
     keys = (
         'plot',
         'plot_reg_strength',
@@ -186,23 +489,28 @@ def call_fit_functions(fit_data, ND):
         'plot_lambda',
     )
     will_activate = [
-        fit_data['prep_opts'][key] for key in keys if
-        fit_data['prep_opts'][key] is not None
+        prep_opts[key] for key in keys if prep_opts.get(key) is not None
     ]
-    if not np.any(np.array(will_activate)):
+    return bool(np.any(np.array(will_activate)))
+
+
+def call_fit_functions(fit_data, ND):
+    # only proceed if one of the plot functions will be called. This makes sure
+    # that we can run without an existing output directory, and only fail if we
+    # really try to plot...
+    if not _plots_requested(fit_data['prep_opts']):
         return
 
-    # run plot functions in output directory
-    pwd = os.getcwd()
-    os.chdir(fit_data['outdir'])
-    print('Changing to: {0}'.format(fit_data['outdir']))
+    # all plots are written to the output directory: the file names of the
+    # NDimInv plots start with inv_opts['global_prefix']
 
     if(fit_data['prep_opts']['plot']):
         print('Plotting final iteration')
         ND.iterations[-1].plot(
             norm_factors=fit_data['inv_opts']['norm_factors'])
         ND.iterations[-1].Model.obj.plot_stats(
-            '{0}'.format(fit_data['nr'])
+            ND.iterations[-1].stat_pars, '{0}'.format(fit_data['nr']),
+            fit_data['outdir']
         )
 
     if(fit_data['prep_opts']['plot_reg_strength']):
@@ -214,4 +522,3 @@ def call_fit_functions(fit_data, ND):
 
     if(fit_data['prep_opts']['plot_lambda'] is not None):
         ND.iterations[fit_data['prep_opts']['plot_lambda']].plot_lcurve()
-    os.chdir(pwd)
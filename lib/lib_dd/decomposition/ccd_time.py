@@ -0,0 +1,459 @@
+"""
+Sparse Gauss-Newton engine (--engine sparse) of dd_time.
+
+NDimInv maps the regularization matrices of the frequency and time
+regularizations to dense matrices over the whole (time x parameter) model
+vector, and solves dense normal equations. This engine assembles the
+Jacobian, the regularization operators and the normal equations as
+scipy.sparse matrices, and solves the normal equations using a sparse LU
+factorization. Memory and run time grow linearly with the number of time
+steps.
+
+The model vector holds the K parameters (rho0, m_i) of all T time steps, time
+step after time step. The data of each time step only depend on the
+parameters of this time step, i.e. the Jacobian is block diagonal. It is
+kept as the T blocks of the time steps (see block_jacobian), so the memory
+needed is O(T * N * K) instead of O(T^2 * N * K).
+
+The regularization matrices of each dimension are computed by the
+regularization objects of the NDimInv object prepared by
+dd_time._prepare_ND_object, and are mapped to the model vector using
+Kronecker products:
+
+    frequency regularization: I_T x WtWm_f (one block per time step)
+    time regularization: WtWm_t x P (P selects rho0, or the m_i)
+
+With first or second order time smoothing, WtWm_t is tri- or pentadiagonal,
+and the normal equations are block tridiagonal or block pentadiagonal. The
+default solver (--sparse_solver banded) then solves them using a block banded
+Cholesky factorization in O(T * K^3) operations. Time regularizations of
+larger bandwidths, and systems which are not positive definite, are solved
+using a sparse LU factorization (--sparse_solver splu).
+
+The inversion procedure of NDimInv is replicated as in ccd_single_batch:
+
+    * a fixed lambda, or the lambda search of NDimInv.reg_pars.SearchLambda
+      for the frequency regularization. Without --lam0, the initial lambda of
+      the search balances the traces of the data part and the frequency
+      regularization part of the normal equations. This differs from
+      NDimInv.reg_pars.Lam0_Easylam, which would need the dense global
+      regularization matrix, so the results only equal those of the ndiminv
+      engine for fixed lambdas or a given --lam0.
+    * fixed lambdas for the time regularizations
+    * steplength selection by fitting a parabola (SearchSteplengthParFit)
+    * the stopping criteria of NDimInv.main.InversionControl
+
+All selections and stopping criteria use the RMS of the imaginary parts
+(rms_re_im_noerr, index 1). Only the final iteration is stored in the ND
+object.
+"""
+import logging
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg
+import scipy.linalg
+import NDimInv.main
+import ccd_single_batch
+
+logger = logging.getLogger('lib_dd.decomposition.ccd_time')
+
+
+def is_supported(prep_opts):
+    """Return True if the sparse engine can replicate the inversion set up by
+    dd_time for the given options. Individual lambdas (--ind_lams) are only
+    supported by NDimInv.
+    """
+    return not prep_opts['individual_lambdas']
+
+
+def global_reg_matrix(WtWm, nr_timesteps, parsize, parameters=None):
+    """Map the regularization matrix of one dimension to the (time x
+    parameter) model vector
+
+    Parameters
+    ----------
+    WtWm: regularization matrix of the parameter dimension (K x K), or of the
+          time dimension (T x T)
+    nr_timesteps: number of time steps T
+    parsize: number of parameters K of each time step
+    parameters: None for the parameter dimension. For the time dimension,
+                the indices of the parameters (0: rho0, 1...: m_i) which are
+                regularized along the time dimension.
+
+    Returns
+    -------
+    WtWm_global: (T * K) x (T * K) scipy.sparse.csc_matrix
+    """
+    WtWm = sparse.csr_matrix(WtWm)
+    if parameters is None:
+        return sparse.kron(
+            sparse.identity(nr_timesteps), WtWm, format='csc')
+    selection = np.zeros(parsize)
+    selection[list(parameters)] = 1
+    return sparse.kron(WtWm, sparse.diags(selection), format='csc')
+
+
+class block_jacobian(object):
+    """Block diagonal Jacobian of all time steps, stored as the Jacobians of
+    the single time steps (2N x K blocks). The full matrix is never formed.
+    Vectors in model space hold the K parameters of each time step, vectors
+    in data space the 2N data values (real parts, imaginary parts) of each
+    time step, one time step after the other.
+    """
+
+    def __init__(self, blocks, weights=None):
+        """
+        Parameters
+        ----------
+        blocks: T x 2N x K array with the Jacobians of the time steps, e.g.
+                from decomposition_resistivity.Jacobian_batch
+        weights: optional T x 2N array of data weights. If given, the blocks
+                 of W_d J are stored.
+        """
+        if weights is not None:
+            blocks = blocks * weights[:, :, np.newaxis]
+        self.blocks = blocks
+        self.nr_timesteps, self.nr_data, self.parsize = blocks.shape
+        self.shape = (self.nr_timesteps * self.nr_data,
+                      self.nr_timesteps * self.parsize)
+
+    def dot(self, m):
+        """Return J m for a model space vector m"""
+        m = np.reshape(m, (self.nr_timesteps, self.parsize, 1))
+        return np.matmul(self.blocks, m).flatten()
+
+    def rdot(self, d):
+        """Return J^T d for a data space vector d"""
+        d = np.reshape(d, (self.nr_timesteps, self.nr_data, 1))
+        return np.matmul(self.blocks.transpose(0, 2, 1), d).flatten()
+
+    def JtJ_blocks(self):
+        """Return the T x K x K diagonal blocks of J^T J"""
+        Jt = self.blocks.transpose(0, 2, 1)
+        return np.matmul(Jt, self.blocks)
+
+    def JtJ(self):
+        """Return J^T J as block diagonal scipy.sparse.csc_matrix"""
+        return sparse.block_diag(self.JtJ_blocks(), format='csc')
+
+    def aslinearoperator(self):
+        """Return J as scipy.sparse.linalg.LinearOperator"""
+        return scipy.sparse.linalg.LinearOperator(
+            self.shape, matvec=self.dot, rmatvec=self.rdot, dtype=float)
+
+    def toarray(self):
+        """Return the dense Jacobian (for tests and small problems only)"""
+        return scipy.linalg.block_diag(*self.blocks)
+
+
+def bandwidth(WtWm):
+    """Return the bandwidth of a sparse matrix"""
+    WtWm = WtWm.tocoo()
+    if WtWm.nnz == 0:
+        return 0
+    return int(np.max(np.abs(WtWm.row - WtWm.col)))
+
+
+def cho_factor_block_banded(blocks):
+    """Cholesky factorization of a symmetric positive definite block banded
+    matrix with T x T blocks of size K x K and a block bandwidth of p
+
+    Parameters
+    ----------
+    blocks: list of p + 1 arrays of size T x K x K. blocks[k][t] is the
+            block (t, t - k) of the lower triangle (blocks[k][t] is ignored
+            for t < k)
+
+    Returns
+    -------
+    L: the blocks of the lower triangular factor, in the same layout
+
+    Raises
+    ------
+    numpy.linalg.LinAlgError: if the matrix is not positive definite
+    """
+    p = len(blocks) - 1
+    nr_blocks = blocks[0].shape[0]
+    L = [np.zeros_like(x) for x in blocks]
+    for t in range(nr_blocks):
+        for k in range(min(p, t), 0, -1):
+            j = t - k
+            S = blocks[k][t].copy()
+            for i in range(max(t - p, 0), j):
+                S -= L[t - i][t].dot(L[j - i][j].T)
+            # L_tj = S L_jj^-T
+            L[k][t] = scipy.linalg.solve_triangular(
+                L[0][j], S.T, lower=True).T
+        S = blocks[0][t].copy()
+        for k in range(1, min(p, t) + 1):
+            S -= L[k][t].dot(L[k][t].T)
+        L[0][t] = np.linalg.cholesky(S)
+    return L
+
+
+def cho_solve_block_banded(L, b):
+    """Solve A x = b, given the block banded Cholesky factorization L of A
+    (see cho_factor_block_banded). b and x are T x K arrays.
+    """
+    p = len(L) - 1
+    nr_blocks = b.shape[0]
+    y = np.empty_like(b)
+    for t in range(nr_blocks):
+        rhs = b[t].copy()
+        for k in range(1, min(p, t) + 1):
+            rhs -= L[k][t].dot(y[t - k])
+        y[t] = scipy.linalg.solve_triangular(L[0][t], rhs, lower=True)
+
+    x = np.empty_like(b)
+    for t in reversed(range(nr_blocks)):
+        rhs = y[t].copy()
+        for k in range(1, min(p, nr_blocks - 1 - t) + 1):
+            rhs -= L[k][t + k].T.dot(x[t + k])
+        x[t] = scipy.linalg.solve_triangular(
+            L[0][t], rhs, lower=True, trans='T')
+    return x
+
+
+class time_inversion(object):
+    """Gauss-Newton inversion of the time series of an NDimInv object
+    prepared by dd_time._prepare_ND_object, using sparse matrices
+    """
+
+    def __init__(self, ND, prep_opts):
+        self.ND = ND
+        self.model = ND.Model.obj
+        self.max_iterations = ND.settings['max_iterations']
+
+        # data (N x 2 x T) and weights, one row per time step
+        D = ND.Data.D
+        self.nr_f = D.shape[0]
+        self.nr_timesteps = D.shape[2]
+        self.d = D.transpose(2, 1, 0).reshape(self.nr_timesteps, -1)
+        self.d_imag = D[:, 1, :].T
+        self.wd = ND.Data.WD().transpose(2, 1, 0).reshape(
+            self.nr_timesteps, -1)
+
+        # starting model, one row per time step
+        self.m0 = np.asarray(ND.Model.m0, dtype=float).reshape(
+            (self.nr_timesteps, -1))
+        self.parsize = self.m0.shape[1]
+
+        # frequency regularization
+        reg_obj, lam_obj = ND.Model.regularizations[0][0]
+        self.WtWm_f_block = np.asarray(reg_obj.WtWm(self.parsize))
+        self.WtWm_f = global_reg_matrix(
+            self.WtWm_f_block, self.nr_timesteps, self.parsize)
+        self.lam_f = prep_opts['f_lambda']
+        self.lam0 = prep_opts['f_lam0']
+        self.search_lambda = self.lam_f is None
+
+        # time regularizations (rho0, m_i), weighted with their fixed lambdas
+        self.lams_t = [prep_opts['t_rho0_lambda'], prep_opts['t_m_i_lambda']]
+        self.WtWm_t = sparse.csc_matrix(
+            (self.m0.size, self.m0.size), dtype=float)
+        # (lambda, T x T matrix, parameter selection) of each time
+        # regularization
+        self.time_regs = []
+        regularizations = ND.Model.regularizations
+        if len(regularizations) > 1:
+            time_regularizations = regularizations[1]
+        else:
+            # single time steps have no time regularization
+            time_regularizations = []
+        for (reg_obj, lam_obj), lam in zip(time_regularizations,
+                                           self.lams_t):
+            if lam == 0:
+                continue
+            WtWm = sparse.csr_matrix(reg_obj.WtWm(self.nr_timesteps))
+            selection = np.zeros(self.parsize)
+            selection[list(reg_obj.outside_first_dim)] = 1
+            self.time_regs.append((lam, WtWm, selection))
+            self.WtWm_t = self.WtWm_t + lam * global_reg_matrix(
+                WtWm, self.nr_timesteps, self.parsize,
+                reg_obj.outside_first_dim)
+
+        self.solver = prep_opts.get('sparse_solver', 'banded')
+        self.bandwidth = max(
+            [bandwidth(WtWm) for lam, WtWm, selection in self.time_regs] +
+            [0])
+        if self.solver == 'banded' and self.bandwidth > 2:
+            logger.info(
+                'time regularization bandwidth {0}: using splu'.format(
+                    self.bandwidth))
+            self.solver = 'splu'
+
+    def rms(self, f):
+        """Return the rms of the imaginary parts of the forward responses f
+        (T x N x 2)
+        """
+        diff = self.d_imag - f[:, :, 1]
+        return np.sqrt(np.sum(diff ** 2) / diff.size)
+
+    def rms_of(self, m):
+        return self.rms(self.model.forward_batch(m))
+
+    def normal_equations(self, m):
+        r"""Return the regularization independent parts of the normal
+        equations, :math:`J^T W_d^T W_d J` (the T x K x K diagonal blocks) and
+        :math:`J^T W_d^T W_d (d - f)` (one row per time step)
+        """
+        f, J = self.model.forward_and_Jacobian_batch(m)
+        f_flat = f.transpose(0, 2, 1).reshape(self.nr_timesteps, -1)
+        JW = block_jacobian(J, self.wd)
+        A = JW.JtJ_blocks()
+        b = JW.rdot(self.wd * (self.d - f_flat)).reshape(m.shape)
+        return A, b
+
+    def initial_lambda(self, A):
+        """Return the initial lambda of the frequency regularization"""
+        if self.lam_f is not None:
+            return self.lam_f
+        if self.lam0 is not None:
+            return self.lam0
+        trace_WtWm = self.nr_timesteps * np.trace(self.WtWm_f_block)
+        return np.trace(A, axis1=1, axis2=2).sum() / max(trace_WtWm, 1e-12)
+
+    def banded_blocks(self, A, lam):
+        """Return the blocks of the lower triangle of the regularized normal
+        equations, see cho_factor_block_banded
+        """
+        blocks = [A + lam * self.WtWm_f_block[np.newaxis, :, :]]
+        blocks += [np.zeros_like(A) for k in range(self.bandwidth)]
+        for lam_t, WtWm, selection in self.time_regs:
+            for k in range(0, self.bandwidth + 1):
+                # entries (t, t - k) for t >= k
+                weights = lam_t * WtWm.diagonal(-k)
+                blocks[k][k:] += weights[:, np.newaxis, np.newaxis] * \
+                    np.diag(selection)[np.newaxis, :, :]
+        return blocks
+
+    def model_update(self, A, b, m, lam):
+        """Solve the regularized normal equations, using the selected solver.
+        Returns NaN updates if the system cannot be solved.
+        """
+        WtWm = lam * self.WtWm_f + self.WtWm_t
+        b = b - WtWm.dot(m.flatten()).reshape(m.shape)
+        if self.solver == 'banded':
+            try:
+                L = cho_factor_block_banded(self.banded_blocks(A, lam))
+                return cho_solve_block_banded(L, b)
+            except np.linalg.LinAlgError:
+                logger.info('system not positive definite: using splu')
+
+        A = sparse.block_diag(A, format='csc') + WtWm
+        try:
+            update = scipy.sparse.linalg.splu(A.tocsc()).solve(b.flatten())
+        except RuntimeError:
+            # singular matrix
+            update = np.empty(b.size)
+            update[:] = np.nan
+        return update.reshape(m.shape)
+
+    def steplength(self, m, update, rms_old):
+        """Fit a parabola through the rms values for the steplengths 0, 0.5
+        and 1 and return the steplength of the minimum, see
+        NDimInv.main.SearchSteplengthParFit
+        """
+        x = np.array((0, 0.5, 1))
+        y = np.array((
+            rms_old,
+            self.rms_of(m + 0.5 * update),
+            self.rms_of(m + update),
+        ))
+        A = np.zeros((3, 3), dtype=np.float64)
+        A[:, 0] = x ** 2
+        A[:, 1] = x
+        A[:, 2] = 1
+        a, b, c = np.linalg.solve(A, y)
+        x_min = -b / (2 * a)
+
+        if x_min > 1:
+            x_min = 1
+        if not x_min > 0:
+            x_min = 0.1
+        return x_min
+
+    def update_with_lambda(self, A, b, m, rms_old, lam):
+        """Return the new model after a model update with the given lambda
+        """
+        update = self.model_update(A, b, m, lam)
+        if np.any(np.isnan(update)):
+            return m + update
+        return m + self.steplength(m, update, rms_old) * update
+
+    def search_lambda_value(self, A, b, m, rms_old, lam_old):
+        """Test multiple lambda values around the last lambda and return the
+        lambda with the lowest resulting rms value, see
+        NDimInv.reg_pars.SearchLambda
+        """
+        best_lam = lam_old
+        best_rms = rms_old
+        for lam in (lam_old / 10, lam_old / 5, lam_old * 5, lam_old * 10,
+                    lam_old * 100, lam_old * 1e4):
+            m_test = self.update_with_lambda(A, b, m, rms_old, lam)
+            if np.any(np.isnan(m_test)):
+                continue
+            rms_test = self.rms_of(m_test)
+            if rms_test < best_rms:
+                best_lam = lam
+                best_rms = rms_test
+        return best_lam
+
+    def stop_now(self, m_new, rms_new, rms_old, nr):
+        """Evaluate the stopping criteria of
+        NDimInv.main.InversionControl.check_stopping_criteria_before_update
+        """
+        if np.any(np.isnan(m_new)) or np.any(m_new[:, 1:] < -15):
+            return True
+
+        increase = rms_new > rms_old
+        if increase and nr > 0:
+            return True
+        if(increase and nr == 0 and rms_new - rms_old >
+           ccd_single_batch.allowed_rms_increase_first_iteration):
+            return True
+
+        return np.abs(rms_new - rms_old) < ccd_single_batch.rms_upd_eps
+
+    def run_inversion(self):
+        """Run the inversion and store the final iteration in the ND object
+        """
+        m = self.m0.copy()
+        rms = self.rms_of(m)
+        lam = None
+        nr = 0
+        while nr < self.max_iterations:
+            A, b = self.normal_equations(m)
+            if lam is None:
+                lam = self.initial_lambda(A)
+            elif self.search_lambda:
+                lam = self.search_lambda_value(A, b, m, rms, lam)
+
+            m_new = self.update_with_lambda(A, b, m, rms, lam)
+            rms_new = self.rms_of(m_new)
+            logger.info('iteration {0}: rms {1} (lambda {2})'.format(
+                nr + 1, rms_new, lam))
+            if self.stop_now(m_new, rms_new, rms, nr):
+                break
+            m = m_new
+            rms = rms_new
+            nr += 1
+
+        if lam is None:
+            lam = self.initial_lambda(self.normal_equations(m)[0])
+        f = self.model.forward_batch(m)
+        it = NDimInv.main.Iteration(
+            nr, self.ND.Data, self.ND.Model, self.ND.RMS, self.ND.settings)
+        it.m = m.flatten()
+        it.f = f.transpose(1, 2, 0).flatten(order='F')
+        it.lams = [lam] + self.lams_t
+        self.ND.iterations = [it]
+
+
+def fit_ND(ND, prep_opts):
+    """Fit the time series of an NDimInv object prepared by
+    dd_time._prepare_ND_object and store the result as its only iteration
+    (see time_inversion)
+    """
+    inversion = time_inversion(ND, prep_opts)
+    inversion.run_inversion()
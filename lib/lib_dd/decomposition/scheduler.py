@@ -0,0 +1,162 @@
+"""
+Cost-aware scheduling of the spectra of ccd_single on multiple worker
+processes.
+
+The spectra are sorted by their expected fit cost, most expensive first, and
+split into small chunks of similar cost. The chunks are dispatched
+dynamically: each worker fetches the next chunk as soon as it is done with
+the previous one, so that expensive fits are not left for the end of the run
+while other cores sit idle.
+
+The expected cost of a spectrum is the number of frequencies times the number
+of relaxation times, times the number of iterations needed for this spectrum
+in a previous run (if available, see --prior_iterations).
+"""
+import os
+import time
+import threading
+import logging
+import numpy as np
+import lib_dd.kernels as kernels
+
+logger = logging.getLogger('lib_dd.decomposition.scheduler')
+
+# number of chunks dispatched to each worker process (on average)
+chunks_per_core = 8
+
+
+def expected_costs(data, mask_groups, prior_iterations=None):
+    """Return the expected (relative) cost of the fit of each spectrum
+
+    Parameters
+    ----------
+    data: data dict of ccd_single (see ccd_single.get_data_dd_single)
+    mask_groups: ccd_single_stateless._mask_groups object of the data
+    prior_iterations: number of iterations of each spectrum in a previous
+                      run. Default: None
+    """
+    group_costs = []
+    for frequencies in mask_groups.frequencies:
+        settings = dict(data['inv_opts'])
+        settings['frequencies'] = frequencies
+        tau = kernels.determine_tau_range(settings)[0]
+        group_costs.append(frequencies.size * tau.size)
+    costs = np.array(group_costs, dtype=float)[mask_groups.groups]
+
+    if prior_iterations is not None:
+        prior_iterations = np.atleast_1d(prior_iterations)
+        if prior_iterations.size == costs.size:
+            costs *= np.maximum(prior_iterations, 1)
+        else:
+            logger.warn(
+                'ignoring prior iterations: {0} values for {1} spectra'.format(
+                    prior_iterations.size, costs.size))
+    return costs
+
+
+def order_by_cost(indices, costs, groups):
+    """Sort the spectrum indices by decreasing expected cost. Spectra of the
+    same cost are sorted by mask group, and then by index.
+    """
+    indices = np.asarray(indices, dtype=int)
+    order = np.lexsort((indices, groups[indices], -costs[indices]))
+    return indices[order]
+
+
+def get_tasks(indices, costs, groups, nr_chunks, max_size, contiguous=False):
+    """Split the spectrum indices into (about) nr_chunks chunks of similar
+    expected cost, with at most max_size spectra each. Return the chunks in
+    the order of dispatch, i.e. with decreasing cost.
+
+    Parameters
+    ----------
+    indices: zero-based numbers of the spectra to fit
+    costs: expected cost of each spectrum, see expected_costs
+    groups: mask group of each spectrum
+    nr_chunks: number of chunks
+    max_size: maximum number of spectra in one chunk
+    contiguous: if True, keep the order of the spectra (e.g. for warm started
+                chains) and only sort the chunks by cost
+    """
+    if len(indices) == 0:
+        return []
+    if contiguous:
+        indices = np.asarray(indices, dtype=int)
+    else:
+        indices = order_by_cost(indices, costs, groups)
+
+    task_costs = costs[indices]
+    target = task_costs.sum() / nr_chunks
+    # chunk number of each spectrum, determined by the cost of all previous
+    # spectra
+    chunk_nrs = ((np.cumsum(task_costs) - task_costs) / target).astype(int)
+    bounds = np.flatnonzero(np.diff(chunk_nrs)) + 1
+    tasks = []
+    for chunk in np.split(indices, bounds):
+        tasks.extend(chunk[i: i + max_size] for i in
+                     range(0, len(chunk), max_size))
+
+    if contiguous:
+        tasks.sort(key=lambda task: -costs[task].sum())
+    return tasks
+
+
+def _worker_id():
+    """Return the process id and the thread name of the current worker
+    """
+    return '{0}/{1}'.format(os.getpid(), threading.current_thread().name)
+
+
+def _run_timed(args):
+    """Return the worker id, the run time and the result of
+    fit_function(task)
+    """
+    fit_function, task = args
+    start = time.time()
+    result = fit_function(task)
+    return _worker_id(), time.time() - start, result
+
+
+class utilization(object):
+    """Busy times of the workers (processes or threads) of one run
+    """
+
+    def __init__(self, nr_cores):
+        self.nr_cores = nr_cores
+        self.start = time.time()
+        # worker id -> [nr of tasks, busy time]
+        self.workers = {}
+
+    def add(self, worker_id, busy_time):
+        worker = self.workers.setdefault(worker_id, [0, 0.0])
+        worker[0] += 1
+        worker[1] += busy_time
+
+    def log(self):
+        wall_time = time.time() - self.start
+        if not self.workers or wall_time <= 0:
+            return
+        busy_time = sum(x[1] for x in self.workers.values())
+        logger.info(
+            '{0} tasks on {1} workers in {2:.1f} s, utilization '
+            '{3:.1%}'.format(
+                sum(x[0] for x in self.workers.values()), self.nr_cores,
+                wall_time, busy_time / (wall_time * self.nr_cores)))
+        for worker_id, (nr_tasks, busy) in sorted(self.workers.items()):
+            logger.info(
+                'worker {0}: {1} tasks, busy {2:.1f} s ({3:.1%})'.format(
+                    worker_id, nr_tasks, busy, busy / wall_time))
+
+
+def imap(pool, nr_cores, fit_function, tasks):
+    """Dispatch the tasks to the workers of the pool, one at a time,
+    and yield the results of fit_function(task) in the order of completion.
+    The utilization of the workers is logged at the end.
+    """
+    usage = utilization(nr_cores)
+    task_results = pool.imap_unordered(
+        _run_timed, ((fit_function, task) for task in tasks))
+    for worker_id, busy_time, result in task_results:
+        usage.add(worker_id, busy_time)
+        yield result
+    usage.log()
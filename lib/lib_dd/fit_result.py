@@ -0,0 +1,105 @@
+"""
+Compact representation of the result of one fit (the final iteration of an
+NDimInv inversion, comprising one or more spectra). Only the quantities
+required by the output functions are stored, so these records are cheap to
+send back from worker processes and to hold in memory for many spectra.
+"""
+import json
+
+
+def get_forward_responses(iteration):
+    """Return the forward responses of all spectra of an iteration as an
+    array of size (nr_spectra x 2N), each row containing first the N real
+    parts, then the N imaginary parts
+    """
+    M = iteration.Model.convert_to_M(iteration.m)
+    model = iteration.Model.obj
+    if hasattr(model, 'forward_batch'):
+        # all spectra in one call; the first dimension of M holds the
+        # decomposition parameters, all others are extra dimensions
+        pars = M.reshape((M.shape[0], -1), order='F').T
+        f_data = model.forward_batch(pars)
+        return f_data.transpose(0, 2, 1).reshape(pars.shape[0], -1)
+
+    f_data = iteration.Model.F(M)
+    # we know that the first two dimensions belong to frequencies,
+    # re/im
+    base_dim = f_data.shape[0] * f_data.shape[1]
+
+    if len(f_data.shape) == 3:
+        extra_dim = f_data.shape[2]
+    else:
+        extra_dim = 1
+    f_data = f_data.T
+    return f_data.reshape(extra_dim, base_dim)
+
+
+class fit_result(object):
+    """Final state of one fit
+
+    Attributes
+    ----------
+    m: final (flattened) model parameters
+    nr: number of iterations
+    lams: list of the lambda values of the final iteration
+    stat_pars: dict with the statistical parameters, see
+               NDimInv.main.Iteration.stat_pars
+    rms_values: dict with the rms values of the final iteration
+    f: forward responses, (nr_spectra x 2N) array
+    frequencies, omega, tau, s: as used by the model
+    data_format: data format of the model (and forward responses)
+    errors: diagonal of the data weighting matrix
+    rms_types, rms_names: rms definitions, see NDimInv.main.RMS_control
+    ND: the full NDimInv object, if requested
+    kernel_cache_stats: (hits, misses) of the kernel cache during this fit
+    index: zero-based number of the spectrum, if known
+    warm_start: index of the spectrum whose final model was used as the
+                starting model, None for the default starting models
+    """
+
+    def __init__(self, ND, keep_ND=False):
+        """
+        Parameters
+        ----------
+        ND: NDimInv object after the inversion
+        keep_ND: if True, keep a reference to the full NDimInv object
+        """
+        it = ND.iterations[-1]
+        model = it.Model.obj
+
+        self.m = it.m
+        self.nr = it.nr
+        self.lams = list(it.lams)
+        self.stat_pars = it.stat_pars
+        self.rms_values = it.rms_values
+        self.f = get_forward_responses(it)
+
+        self.frequencies = model.frequencies
+        self.omega = model.omega
+        self.tau = model.tau
+        self.s = model.s
+        self.data_format = model.data_format
+        self.errors = it.Data.WD().flatten(order='F')
+
+        self.rms_types = it.RMS.rms_types
+        self.rms_names = it.RMS.rms_names
+
+        self.ND = ND if keep_ND else None
+        self.kernel_cache_stats = None
+        self.index = None
+        self.warm_start = None
+
+    def save_rms_definition(self, filename):
+        """Save the rms definitions, see
+        NDimInv.main.RMS_control.save_rms_definition
+        """
+        rms_definition = (self.rms_types, self.rms_names)
+        with open(filename, 'w') as fid:
+            json.dump(rms_definition, fid)
+
+
+def get_fit_results(NDobjs):
+    """Convert a list of NDimInv objects and/or fit results to fit results
+    """
+    return [x if isinstance(x, fit_result) else fit_result(x) for x in
+            NDobjs]
@@ -205,9 +205,10 @@ def load_frequencies_and_data(options):
 # ## save functions ###
 
 
-def save_stat_pars(stat_pars, norm_factors=None):
+def save_stat_pars(stat_pars, norm_factors=None, directory='.'):
     """
-    Saves to current working directy.
+    Save the statistical parameters to the given directory (default: current
+    working directory).
     """
     # get keys of statistical parameters
     keys = stat_pars.keys()
@@ -219,7 +220,7 @@ def save_stat_pars(stat_pars, norm_factors=None):
         # them
         values = prepare_stat_values(raw_values, key, norm_factors)
 
-        filename = '{0}_results.dat'.format(key)
+        filename = os.path.join(directory, '{0}_results.dat'.format(key))
         np.savetxt(filename, np.atleast_1d(values))
 
 
@@ -285,9 +286,10 @@ def prepare_stat_values(raw_values, key, norm_factors):
     return values
 
 
-def save_rms_values(rms_list, rms_names):
+def save_rms_values(rms_list, rms_names, directory='.'):
     """
-    Save the RMS values to the corresponding filenames
+    Save the RMS values to the corresponding filenames in the given directory
+    (default: current working directory)
     """
     for key in rms_list.keys():
         # split key
@@ -301,5 +303,5 @@ def save_rms_values(rms_list, rms_names):
                 xrange(0, rms_all.shape[0])
             ]
         for name, rms in zip(names, rms_all):
-            filename = name + key_type + '.dat'
+            filename = os.path.join(directory, name + key_type + '.dat')
             np.savetxt(filename, np.atleast_1d(rms))
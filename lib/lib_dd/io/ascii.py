@@ -10,48 +10,53 @@ import lib_dd.interface as lDDi
 import helper
 
 
-def save_base_results(final_iterations, data):
+def save_base_results(final_iterations, data, directory='.'):
     """
     Save data files that are shared between
-    dd_single.py/dd_time.py/dd_space_time.py
+    dd_single.py/dd_time.py/dd_space_time.py to the given directory
     """
+    def filename(name):
+        return os.path.join(directory, name)
+
     # convert all arrays to lists
     for key in data['inv_opts'].keys():
         if isinstance(data['inv_opts'][key], np.ndarray):
             data['inv_opts'][key] = data['inv_opts'][key].tolist()
-    with open('inversion_options.json', 'w') as fid:
+    with open(filename('inversion_options.json'), 'w') as fid:
         json.dump(data['inv_opts'], fid)
 
-    with open('version.dat', 'w') as fid:
+    with open(filename('version.dat'), 'w') as fid:
         fid.write(version._get_version_numbers() + '\n')
 
     # with open('data_format.dat', 'w') as fid:
     #     fid.write(final_iterations[0][0].Data.obj.data_format + '\n')
 
     # save call to debye_decomposition.py
-    with open('command.dat', 'w') as fid:
+    with open(filename('command.dat'), 'w') as fid:
         cmd = lDDi.get_command()
         fid.write(cmd)
 
-    final_iterations[0][0].RMS.save_rms_definition('rms_definition.json')
+    final_iterations[0][0].save_rms_definition(
+        filename('rms_definition.json'))
 
     # save tau/s
-    np.savetxt('tau.dat', final_iterations[0][0].Data.obj.tau)
-    np.savetxt('s.dat', final_iterations[0][0].Data.obj.s)
+    np.savetxt(filename('tau.dat'), final_iterations[0][0].tau)
+    np.savetxt(filename('s.dat'), final_iterations[0][0].s)
 
     # save frequencies/omega
-    np.savetxt('frequencies.dat', final_iterations[0][0].Data.obj.frequencies)
-    np.savetxt('omega.dat', final_iterations[0][0].Data.obj.omega)
+    np.savetxt(
+        filename('frequencies.dat'), final_iterations[0][0].frequencies)
+    np.savetxt(filename('omega.dat'), final_iterations[0][0].omega)
 
     # save weighting factors
-    Wd_diag = final_iterations[0][0].Data.Wd.diagonal()
-    np.savetxt('errors.dat', Wd_diag)
+    Wd_diag = final_iterations[0][0].errors
+    np.savetxt(filename('errors.dat'), Wd_diag)
 
     # save lambdas
     # TODO: We want all lambdas, not only from the last iteration
     try:
         lambdas = [x[0].lams for x in final_iterations]
-        np.savetxt('lambdas.dat', lambdas)
+        np.savetxt(filename('lambdas.dat'), lambdas)
     except Exception as e:
         print('There was an error saving the lambda values')
         print(e)
@@ -59,35 +64,40 @@ def save_base_results(final_iterations, data):
 
     # save number of iterations
     nr_of_iterations = [x[0].nr for x in final_iterations]
-    np.savetxt('nr_iterations.dat', nr_of_iterations, fmt='%i')
+    np.savetxt(filename('nr_iterations.dat'), nr_of_iterations, fmt='%i')
 
     # save normalization factors
     if('norm_factors' in data):
-        np.savetxt('normalization_factors.dat', data['norm_factors'])
+        np.savetxt(
+            filename('normalization_factors.dat'), data['norm_factors'])
 
 
-def save_data(data, NDlist):
-    """Save fit results to the current directory
+def save_data(data, results, directory='.'):
+    """Save fit results to the given directory (default: current working
+    directory)
     """
-    final_iterations = [(x.iterations[-1], nr) for nr, x in enumerate(NDlist)]
+    def filename(name):
+        return os.path.join(directory, name)
+
+    final_iterations = helper.indexed_results(results)
 
-    save_base_results(final_iterations, data)
-    if not os.path.isdir('stats_and_rms'):
-        os.makedirs('stats_and_rms')
-    os.chdir('stats_and_rms')
+    save_base_results(final_iterations, data, directory)
+    stats_dir = filename('stats_and_rms')
+    if not os.path.isdir(stats_dir):
+        os.makedirs(stats_dir)
     stats_for_all_its = lDDi.aggregate_dicts(final_iterations, 'stat_pars')
     if('norm_factors' in data):
         norm_factors = data['norm_factors']
     else:
         norm_factors = None
-    lDDi.save_stat_pars(stats_for_all_its, norm_factors)
+    lDDi.save_stat_pars(stats_for_all_its, norm_factors, stats_dir)
 
     rms_for_all_its = lDDi.aggregate_dicts(final_iterations, 'rms_values')
-    lDDi.save_rms_values(rms_for_all_its, final_iterations[0][0].RMS.rms_names)
-    os.chdir('..')
+    lDDi.save_rms_values(
+        rms_for_all_its, final_iterations[0][0].rms_names, stats_dir)
 
     # save original data
-    with open('data.dat', 'wb') as fid:
+    with open(filename('data.dat'), 'wb') as fid:
         orig_data = data['raw_data']
         if norm_factors is not None:
             orig_data = orig_data / norm_factors[:, np.newaxis]
@@ -95,12 +105,13 @@ def save_data(data, NDlist):
 
     # (re)save the data format
     # open('data_format.dat', 'w').write(prep_opts['data_format'])
-    open('data_format.dat', 'w').write(data['raw_format'])
+    with open(filename('data_format.dat'), 'w') as fid:
+        fid.write(data['raw_format'])
 
     # save model response
-    with open('f.dat', 'wb') as fid:
-        helper.save_f(fid, final_iterations, norm_factors)
+    with open(filename('f.dat'), 'wb') as fid:
+        helper.save_f(fid, final_iterations, norm_factors, directory)
 
     # save times
     if 'times' in data:
-        np.savetxt('times.dat', data['times'])
+        np.savetxt(filename('times.dat'), data['times'])
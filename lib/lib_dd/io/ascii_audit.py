@@ -1,3 +1,4 @@
+import os
 import json
 import datetime
 import numpy as np
@@ -26,29 +27,33 @@ def _get_header():
     return header
 
 
-def save_results(data, NDlist):
-    """Save fit results to the current directory
+def save_results(data, results, directory='.'):
+    """Save fit results to the given directory (default: current working
+    directory)
     """
+    def filename(name):
+        return os.path.join(directory, name)
+
     norm_factors = data.get('norm_factors', None)
     header = _get_header()
-    final_iterations = [(x.iterations[-1], nr) for nr, x in enumerate(NDlist)]
+    final_iterations = helper.indexed_results(results)
 
-    save_integrated_parameters(final_iterations, data, header)
+    save_integrated_parameters(final_iterations, data, header, directory)
     save_frequency_data(final_iterations, data, header)
-    save_data(data, norm_factors, final_iterations)
+    save_data(data, norm_factors, final_iterations, directory)
 
-    with open('frequencies.dat', 'wb') as fid:
+    with open(filename('frequencies.dat'), 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         fid.write(bytes('# frequencies [Hz]\n', 'UTF-8'))
-        np.savetxt(fid, final_iterations[0][0].Data.obj.frequencies)
+        np.savetxt(fid, final_iterations[0][0].frequencies)
 
-    with open('tau.dat', 'wb') as fid:
+    with open(filename('tau.dat'), 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         fid.write(bytes(
             '# relaxation times used for the decomposition\n',
             'UTF-8')
         )
-        np.savetxt(fid, final_iterations[0][0].Data.obj.tau)
+        np.savetxt(fid, final_iterations[0][0].tau)
 
     # final_iterations[0][0].RMS.save_rms_definition('rms_definition.json')
 
@@ -59,7 +64,7 @@ def save_results(data, NDlist):
         nr_of_iterations = [x[0].nr for x in final_iterations]
         nr_its_and_lambdas = np.vstack((nr_of_iterations, lambdas)).T
 
-        with open('lams_and_nr_its.dat', 'wb') as fid:
+        with open(filename('lams_and_nr_its.dat'), 'wb') as fid:
             fid.write(bytes(header, 'UTF-8'))
             fid.write(bytes(
                 'nr-its lambda\n',
@@ -73,14 +78,14 @@ def save_results(data, NDlist):
 
     # save normalization factors
     if('norm_factors' in data):
-        with open('normalization_factors.dat', 'wb') as fid:
+        with open(filename('normalization_factors.dat'), 'wb') as fid:
             fid.write(bytes(header, 'UTF-8'))
             fid.write(bytes('# normalisation factors\n', 'UTF-8'))
             np.savetxt(fid, data['norm_factors'])
 
     # save weighting factors
-    Wd_diag = final_iterations[0][0].Data.Wd.diagonal()
-    with open('errors.dat', 'wb') as fid:
+    Wd_diag = final_iterations[0][0].errors
+    with open(filename('errors.dat'), 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         fid.write(
             bytes(
@@ -92,7 +97,7 @@ def save_results(data, NDlist):
         )
         np.savetxt(fid, Wd_diag)
 
-    with open('version.dat', 'wb') as fid:
+    with open(filename('version.dat'), 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         fid.write(bytes(
             version._get_version_numbers() + '\n', 'UTF-8')
@@ -103,7 +108,7 @@ def save_results(data, NDlist):
         if isinstance(iopts[key], np.ndarray):
             iopts[key] = iopts[key].tolist()
 
-    with open('inversion_options.json', 'wb') as fid:
+    with open(filename('inversion_options.json'), 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         fid.write(bytes('# inversion options dict\n', 'UTF-8'))
         fid.write(bytes(
@@ -112,10 +117,13 @@ def save_results(data, NDlist):
         ))
 
 
-def save_data(data, norm_factors, final_iterations):
+def save_data(data, norm_factors, final_iterations, directory='.'):
+    def filename(name):
+        return os.path.join(directory, name)
+
     header = _get_header()
     # save original data
-    with open('data.dat', 'wb') as fid:
+    with open(filename('data.dat'), 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         out_str = '# raw data, format: ' + data['raw_format'] + '\n'
         fid.write(bytes(out_str, 'UTF-8'))
@@ -126,18 +134,18 @@ def save_data(data, norm_factors, final_iterations):
         np.savetxt(fid, orig_data)
 
     # save forward response
-    with open('f.dat', 'wb') as fid:
+    with open(filename('f.dat'), 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         fid.write(bytes(
             '# forward response data format: ' +
-            final_iterations[0][0].Data.obj.data_format + '\n',
+            final_iterations[0][0].data_format + '\n',
             'UTF-8'
         ))
-        helper.save_f(fid, final_iterations, norm_factors)
+        helper.save_f(fid, final_iterations, norm_factors, directory)
 
     # save times
     if 'times' in data:
-        with open('times.dat', 'wb') as fid:
+        with open(filename('times.dat'), 'wb') as fid:
             fid.write(bytes(header, 'UTF-8'))
             # write column description
             fid.write(bytes(
@@ -146,7 +154,8 @@ def save_data(data, norm_factors, final_iterations):
             np.savetxt(fid, data['times'])
 
 
-def save_integrated_parameters(final_iterations, data, header):
+def save_integrated_parameters(final_iterations, data, header,
+                               directory='.'):
     stat_pars = lDDi.aggregate_dicts(final_iterations, 'stat_pars')
     # get keys of statistical parameters
     keys = stat_pars.keys()
@@ -178,14 +187,16 @@ def save_integrated_parameters(final_iterations, data, header):
         else:
             if key not in ('m_data', ):
                 # save to its own file
-                with open(key + '.dat', 'wb') as fid:
+                with open(os.path.join(directory, key + '.dat'),
+                          'wb') as fid:
                     fid.write(bytes(header, 'UTF-8'))
                     out_str = '#' + key + '\n'
                     fid.write(bytes(out_str, 'UTF-8'))
                     np.savetxt(fid, values)
 
     all_data = np.vstack(pars_list).T
-    with open('integrated_parameters.dat', 'wb') as fid:
+    with open(os.path.join(directory, 'integrated_parameters.dat'),
+              'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         out_str = '#' + ' '.join(pars_labels) + '\n'
         fid.write(bytes(out_str, 'UTF-8'))
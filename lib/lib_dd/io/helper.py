@@ -1,30 +1,39 @@
+import os
 import numpy as np
 
 
-def save_f(fid, final_iterations, norm_factors):
+class indexed_results(object):
+    """Sequence of (fit result, number) tuples of a sequence of fit results.
+    The results are only taken from the sequence when they are accessed, so
+    results read from a journal (lib_dd.io.journal.journal_results) are not
+    all held in memory at the same time.
+    """
+
+    def __init__(self, results):
+        self.results = results
+
+    def __len__(self):
+        return len(self.results)
+
+    def __getitem__(self, index):
+        return self.results[index], index
+
+    def __iter__(self):
+        for nr, result in enumerate(self.results):
+            yield result, nr
+
+
+def save_f(fid, final_iterations, norm_factors, directory='.'):
     """write model response directly in a file handler
 
-    Also save forward response format to f_format.dat
+    Also save forward response format to f_format.dat in the given directory
     """
     for index, itd in enumerate(final_iterations):
-        M = itd[0].Model.convert_to_M(itd[0].m)
-        f_data = itd[0].Model.F(M)
-        # we know that the first two dimensions belong to frequencies,
-        # re/im
-        base_dim = f_data.shape[0] * f_data.shape[1]
-
-        if len(f_data.shape) == 3:
-            extra_dim = f_data.shape[2]
-        else:
-            extra_dim = 1
-        f_data = f_data.T
-
-        # import pdb
-        # pdb.set_trace()
-        f_data = f_data.reshape(extra_dim, base_dim)
+        f_data = itd[0].f
         if norm_factors is not None:
             print('normalising')
-            f_data /= norm_factors[index]
+            f_data = f_data / norm_factors[index]
         np.savetxt(fid, f_data)
 
-    open('f_format.dat', 'w').write(itd[0].Data.obj.data_format)
+    with open(os.path.join(directory, 'f_format.dat'), 'w') as fid:
+        fid.write(itd[0].data_format)
@@ -1,5 +1,7 @@
 import ascii
 import ascii_audit
+import journal
+import lib_dd.fit_result as fit_result
 
 
 def _make_list(obj):
@@ -11,22 +13,28 @@ def _make_list(obj):
         return obj
 
 
-def save_fit_results(data, NDobj):
+def save_fit_results(data, NDobj, directory='.'):
     """
     Save results of all DD fits to files
 
     Parameters
     ----------
     data:
-    NDobj: one or more ND objects. This is either a ND object, or list of ND
-           objects
+    NDobj: one or more fit results. This is either a ND object, a
+           lib_dd.fit_result.fit_result object, a list of those, or the
+           results of a journal (lib_dd.io.journal.journal_results), which
+           are read one at a time
+    directory: output directory. Default: current working directory
     """
-    NDlist = _make_list(NDobj)
+    if isinstance(NDobj, journal.journal_results):
+        results = NDobj
+    else:
+        results = fit_result.get_fit_results(_make_list(NDobj))
     output_format = data['options']['output_format']
     if output_format == 'ascii':
-        ascii.save_data(data, NDlist)
+        ascii.save_data(data, results, directory)
     elif output_format == 'ascii_audit':
-        ascii_audit.save_results(data, NDlist)
+        ascii_audit.save_results(data, results, directory)
     else:
         raise Exception('Output format "{0}" not recognized!'.format(
             output_format))
@@ -0,0 +1,268 @@
+"""
+Append-only on-disk journals:
+
+journal: fit results of the streaming mode of dd_single (--stream/--resume)
+completion_journal: completed time series (pixels) of dd_space_time, used to
+                    resume aborted runs
+
+Each journal is a sequence of pickled records in the output directory: a
+header, followed by one record per fitted spectrum (or time series). Each
+record is flushed to disk right away, so a crashed or aborted run loses at
+most the record that was being written. A truncated last record is ignored
+(and overwritten) when the journal is reopened.
+"""
+import os
+import copy
+import pickle
+
+journal_filename = 'fit_journal.pickle'
+completion_journal_filename = 'completion_journal.pickle'
+
+
+def _write_record(fid, record):
+    pickle.dump(record, fid, pickle.HIGHEST_PROTOCOL)
+    fid.flush()
+    os.fsync(fid.fileno())
+
+
+def _iter_records(fid):
+    """Yield the complete records of an open journal file, starting at the
+    current position. After each record, the file position is the end of
+    this record.
+    """
+    while True:
+        try:
+            record = pickle.load(fid)
+        except Exception:
+            # end of file, or a truncated record
+            return
+        yield record
+
+
+def _read_records(filename):
+    """Read a journal file
+
+    Returns
+    -------
+    header: header record, None if the file holds no complete header
+    records: list of all complete records following the header
+    end: file position after the last complete record
+    """
+    header = None
+    records = []
+    end = 0
+    with open(filename, 'rb') as fid:
+        for record in _iter_records(fid):
+            if header is None:
+                header = record
+            else:
+                records.append(record)
+            end = fid.tell()
+    return header, records, end
+
+
+def _reopen(filename, end):
+    """Open the journal file for appending after the last complete record
+    """
+    fid = open(filename, 'r+b')
+    # drop incomplete records
+    fid.truncate(end)
+    fid.seek(end)
+    return fid
+
+
+class journal(object):
+    """Journal of the fit results of one dd_single run
+    """
+
+    def __init__(self, outdir, nr_of_spectra, resume=False):
+        """
+        Parameters
+        ----------
+        outdir: output directory to store the journal in
+        nr_of_spectra: total number of spectra of this run
+        resume: if True, keep the records of an existing journal. Otherwise
+                any existing journal is replaced.
+        """
+        self.filename = os.path.join(outdir, journal_filename)
+        self.nr_of_spectra = nr_of_spectra
+        self.indices = set()
+
+        if resume and os.path.isfile(self.filename):
+            # only the indices of the stored results are kept
+            header = None
+            end = 0
+            with open(self.filename, 'rb') as fid:
+                for record in _iter_records(fid):
+                    if header is None:
+                        header = record
+                    else:
+                        self.indices.add(record[0])
+                    end = fid.tell()
+            if header is None:
+                # not even the header made it to the disk
+                self._create()
+            else:
+                if header['nr_of_spectra'] != nr_of_spectra:
+                    raise Exception(
+                        ('Journal {0} belongs to a run with {1} spectra, '
+                         'not {2}').format(
+                            self.filename, header['nr_of_spectra'],
+                            nr_of_spectra))
+                self.fid = _reopen(self.filename, end)
+        else:
+            self._create()
+
+    def _create(self):
+        self.fid = open(self.filename, 'wb')
+        self._write({'nr_of_spectra': self.nr_of_spectra})
+
+    def _write(self, record):
+        _write_record(self.fid, record)
+
+    def append(self, index, result):
+        """Store the fit result of the spectrum with the (zero-based) index
+        """
+        if result.ND is not None:
+            # the full NDimInv objects are not journaled
+            result = copy.copy(result)
+            result.ND = None
+        self._write((index, result))
+        self.indices.add(index)
+
+    def close(self):
+        self.fid.close()
+
+    def load_results(self):
+        """Return the fit results of all spectra, sorted by the spectrum
+        index, as a journal_results sequence
+        """
+        return journal_results(self.filename, self.nr_of_spectra)
+
+
+class journal_results(object):
+    """Sequence of the fit results of a journal, sorted by the spectrum
+    index. Only the file positions of the records are kept in memory, each
+    result is read from the journal when it is accessed. Iterating over the
+    sequence therefore holds only one result at a time.
+    """
+
+    def __init__(self, filename, nr_of_spectra):
+        self.filename = filename
+        self.positions = [None] * nr_of_spectra
+        with open(filename, 'rb') as fid:
+            start = None
+            for record in _iter_records(fid):
+                if start is not None:
+                    self.positions[record[0]] = start
+                start = fid.tell()
+
+        missing = [nr for nr, position in enumerate(self.positions) if
+                   position is None]
+        if missing:
+            raise Exception(
+                'No results for spectra {0} in journal {1}'.format(
+                    missing, filename))
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        with open(self.filename, 'rb') as fid:
+            fid.seek(self.positions[index])
+            return pickle.load(fid)[1]
+
+    def __iter__(self):
+        with open(self.filename, 'rb') as fid:
+            for position in self.positions:
+                fid.seek(position)
+                yield pickle.load(fid)[1]
+
+
+class completion_journal(object):
+    """Journal of the completed time series (pixels) of one dd_space_time run
+
+    Each record is a dict with the keys
+
+    pixel: number of the time series
+    status: 'done' or 'failed'
+    duration: fit time in seconds (None if not known)
+    location: result directory of the time series, relative to the output
+              directory (None for failed fits)
+    error: traceback of a failed fit (None for successful fits)
+
+    Pixels may be recorded in any order, and more than once (e.g. a failed
+    pixel which succeeded in a later run). The last record of a pixel counts.
+    Reopening the journal reads only these records, i.e. the time needed
+    grows with the number of completed pixels, not with the number of result
+    directories on disk.
+    """
+
+    def __init__(self, outdir, nr_of_pixels):
+        """
+        Parameters
+        ----------
+        outdir: output directory to store the journal in
+        nr_of_pixels: total number of time series of this run
+        """
+        self.filename = os.path.join(outdir, completion_journal_filename)
+        self.nr_of_pixels = nr_of_pixels
+        # last record of each pixel
+        self.records = {}
+        self.existed = False
+
+        header = None
+        if os.path.isfile(self.filename):
+            header, records, end = _read_records(self.filename)
+
+        if header is None:
+            # no journal, or not even the header made it to the disk
+            self.fid = open(self.filename, 'wb')
+            self._write({'nr_of_pixels': nr_of_pixels})
+        else:
+            if header['nr_of_pixels'] != nr_of_pixels:
+                raise Exception(
+                    ('Journal {0} belongs to a run with {1} time series, '
+                     'not {2}').format(
+                        self.filename, header['nr_of_pixels'], nr_of_pixels))
+            self.existed = True
+            for record in records:
+                self.records[record['pixel']] = record
+            self.fid = _reopen(self.filename, end)
+
+    def _write(self, record):
+        _write_record(self.fid, record)
+
+    def _select(self, status):
+        return set(
+            pixel for pixel, record in self.records.items() if
+            record['status'] == status
+        )
+
+    @property
+    def finished(self):
+        """set of the pixels fitted successfully"""
+        return self._select('done')
+
+    @property
+    def failed(self):
+        """set of the pixels whose last fit failed"""
+        return self._select('failed')
+
+    def append(self, pixel, status, duration=None, location=None,
+               error=None):
+        """Record the completion of a pixel (see the class documentation for
+        the parameters)
+        """
+        record = {
+            'pixel': pixel,
+            'status': status,
+            'duration': duration,
+            'location': location,
+            'error': error,
+        }
+        self._write(record)
+        self.records[pixel] = record
+
+    def close(self):
+        self.fid.close()
@@ -0,0 +1,160 @@
+"""
+Consolidated binary store of the statistical parameters of all time series
+(pixels) of a dd_space_time run.
+
+The store is the directory result_store/ of the output directory. It holds
+one numpy array file per parameter (e.g. m_tot_n.npy) with the shape
+(nr_pixels, nr_timesteps, nr_values), which is accessed as a memory map.
+nr_values is 1 for scalar parameters (rho0, m_tot_n, ...), and e.g. the
+number of relaxation times for m_i. The values are the same as those saved to
+the text files of each time series (stats_and_rms/*_results.dat).
+
+The arrays are preallocated (filled with nan) when the first pixel is stored,
+and each further pixel is written into its rows. filled.npy marks the pixels
+stored so far. Parameters with a variable number of values (tau_peaks_all,
+f_peaks_all) are only saved to the text files.
+"""
+import os
+import json
+import numpy as np
+import lib_dd.interface as lDDi
+import lib_dd.fit_result as fit_result
+
+store_dirname = 'result_store'
+_layout_filename = 'layout.json'
+_filled_filename = 'filled.npy'
+
+# parameters with a variable number of values per time step
+_variable_length = ('tau_peaks_all', 'f_peaks_all')
+
+
+def get_stat_values(data, ND):
+    """Return the statistical parameters of a fitted time series
+
+    Parameters
+    ----------
+    data: data dict of the time series (see dd_time.fit_data)
+    ND: NDimInv object or fit result of the time series
+
+    Returns
+    -------
+    values: dict with one (nr_timesteps, nr_values) array per parameter
+    """
+    result = fit_result.get_fit_results([ND])[0]
+    norm_factors = data.get('norm_factors', None)
+    nr_timesteps = len(data['times'])
+    values = {}
+    for key, raw_values in result.stat_pars.items():
+        if key in _variable_length:
+            continue
+        prepared = lDDi.prepare_stat_values(raw_values, key, norm_factors)
+        values[key] = np.asarray(prepared, dtype=float).reshape(
+            (nr_timesteps, -1))
+    return values
+
+
+class result_store(object):
+    """Result store of one dd_space_time run, see the module documentation
+    """
+
+    def __init__(self, outdir, nr_pixels=None, nr_timesteps=None,
+                 mode='r+'):
+        """Open the store of the output directory outdir. A new store is only
+        created when the first pixel is written.
+
+        Parameters
+        ----------
+        outdir: output directory of the dd_space_time run
+        nr_pixels: number of time series of the run (needed for writing)
+        nr_timesteps: number of time steps of the run (needed for writing)
+        mode: 'r+' to write pixels, 'r' to read an existing store
+        """
+        self.directory = os.path.join(outdir, store_dirname)
+        self.nr_pixels = nr_pixels
+        self.nr_timesteps = nr_timesteps
+        self.mode = mode
+        self.arrays = {}
+        self.filled = None
+
+        layout_file = os.path.join(self.directory, _layout_filename)
+        if os.path.isfile(layout_file):
+            with open(layout_file, 'r') as fid:
+                layout = json.load(fid)
+            if nr_pixels is not None and (
+                    layout['nr_pixels'] != nr_pixels or
+                    layout['nr_timesteps'] != nr_timesteps):
+                raise Exception(
+                    ('Result store {0} belongs to a run with {1} time series '
+                     'of {2} time steps, not {3} of {4}').format(
+                        self.directory, layout['nr_pixels'],
+                        layout['nr_timesteps'], nr_pixels, nr_timesteps))
+            self.nr_pixels = layout['nr_pixels']
+            self.nr_timesteps = layout['nr_timesteps']
+            for key in layout['keys']:
+                self.arrays[key] = np.load(
+                    self._filename(key), mmap_mode=mode)
+            self.filled = np.load(
+                os.path.join(self.directory, _filled_filename),
+                mmap_mode=mode)
+        elif mode == 'r':
+            raise IOError('No result store in {0}'.format(outdir))
+
+    def _filename(self, key):
+        return os.path.join(self.directory, '{0}.npy'.format(key))
+
+    def _create(self, values):
+        """Preallocate the arrays for the parameters in values
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        for key, value in values.items():
+            array = np.lib.format.open_memmap(
+                self._filename(key), mode='w+', dtype=float,
+                shape=(self.nr_pixels, self.nr_timesteps, value.shape[1]))
+            array[:] = np.nan
+            array.flush()
+            self.arrays[key] = array
+        self.filled = np.lib.format.open_memmap(
+            os.path.join(self.directory, _filled_filename), mode='w+',
+            dtype=bool, shape=(self.nr_pixels, ))
+        self.filled.flush()
+
+        # the layout file marks a complete store
+        with open(os.path.join(self.directory, _layout_filename), 'w') as fid:
+            json.dump({
+                'nr_pixels': self.nr_pixels,
+                'nr_timesteps': self.nr_timesteps,
+                'keys': sorted(values.keys()),
+            }, fid)
+
+    def write(self, pixel, values):
+        """Store the parameters of one pixel
+
+        Parameters
+        ----------
+        pixel: number of the time series
+        values: dict with one (nr_timesteps, nr_values) array per parameter,
+                see get_stat_values
+        """
+        if not self.arrays:
+            self._create(values)
+        for key, array in self.arrays.items():
+            array[pixel] = values[key]
+            array.flush()
+        # mark the pixel after its values are on disk
+        self.filled[pixel] = True
+        self.filled.flush()
+
+    def get_map(self, key):
+        """Return the (nr_pixels, nr_timesteps) values of a scalar parameter,
+        or the (nr_pixels, nr_timesteps, nr_values) values of other
+        parameters. Pixels not stored yet are nan.
+        """
+        array = self.arrays[key]
+        if array.shape[2] == 1:
+            return array[:, :, 0]
+        return array
+
+    def is_complete(self):
+        return self.filled is not None and bool(np.all(self.filled))
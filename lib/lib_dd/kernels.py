@@ -0,0 +1,283 @@
+r"""
+Process-wide cache of the parameter independent parts of the Debye/Cole-Cole
+decomposition: the relaxation time range and the kernel matrices.
+
+For both formulations the decomposition response can be written in terms of
+two real kernel matrices K' and K'' of size (nr_frequencies x nr_tau):
+
+.. math::
+
+    Re = s_0 \cdot (1 - K' \cdot m), \quad -Im = s_0 \cdot K'' \cdot m
+
+with :math:`s_0` either :math:`\rho_0` (resistivity formulation, the
+imaginary part is returned with a negative sign) or :math:`\sigma_\infty`
+(conductivity formulation). The kernels only depend on the frequencies, the
+relaxation times and the Cole-Cole exponent c, and are therefore shared
+between all spectra measured on the same frequency grid.
+
+Entries are evicted in least-recently-used order if the cache grows beyond
+its maximum size, which can be set using the environment variable
+DD_KERNEL_CACHE_SIZE.
+"""
+import os
+import threading
+import collections
+import numpy as np
+import lib_dd.base_class as base_class
+
+
+class _lru_cache(object):
+    """Small bounded cache with least-recently-used eviction. The cache can
+    be used by multiple threads (see --backend threads). Hits and misses are
+    counted in total and for each thread (see thread_info).
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.local = threading.local()
+
+    def _count(self, hit):
+        if hit:
+            self.hits += 1
+            self.local.hits = getattr(self.local, 'hits', 0) + 1
+        else:
+            self.misses += 1
+            self.local.misses = getattr(self.local, 'misses', 0) + 1
+
+    def thread_info(self):
+        """Return the number of hits and misses of the calling thread"""
+        return (getattr(self.local, 'hits', 0),
+                getattr(self.local, 'misses', 0))
+
+    def get(self, key, create, count=True):
+        """Return the entry for key. Call create() to generate a missing
+        entry. If count is False, the access is not counted as a hit or
+        miss.
+        """
+        with self.lock:
+            if key in self.entries:
+                if count:
+                    self._count(True)
+                value = self.entries.pop(key)
+            else:
+                if count:
+                    self._count(False)
+                value = create()
+                if len(self.entries) >= self.maxsize:
+                    self.entries.popitem(last=False)
+            self.entries[key] = value
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.local = threading.local()
+
+
+_maxsize = int(os.environ.get('DD_KERNEL_CACHE_SIZE', 64))
+_tau_cache = _lru_cache(_maxsize)
+_kernel_cache = _lru_cache(_maxsize)
+
+
+def _read_only(*arrays):
+    for array in arrays:
+        array.flags.writeable = False
+    return arrays
+
+
+def _array_key(array):
+    return np.ascontiguousarray(array, dtype=float).tobytes()
+
+
+def determine_tau_range(settings):
+    """Cached version of :func:`lib_dd.base_class.determine_tau_range`. The
+    returned arrays are shared and thus read-only.
+    """
+    if 'tau_values' in settings:
+        # custom tau values are not cached
+        return base_class.determine_tau_range(settings)
+
+    key = (
+        _array_key(settings['frequencies']),
+        settings['Nd'],
+        settings['tausel'],
+    )
+
+    def create():
+        return _read_only(*base_class.determine_tau_range(settings))
+
+    return _tau_cache.get(key, create)
+
+
+def get_kernel(frequencies, tau, c, formulation, count=True):
+    """Return the (shared) decomposition kernel for the given frequencies,
+    relaxation times and Cole-Cole exponent c
+
+    Parameters
+    ----------
+    frequencies: numpy.ndarray of size N
+    tau: numpy.ndarray of size K
+    c: Cole-Cole exponent. Ignored for the conductivity formulation.
+    formulation: 'resistivity' or 'conductivity'
+    count: if False, do not count the access in the cache statistics (see
+           cache_info)
+    """
+    if formulation == 'conductivity':
+        c = 1.0
+    key = (formulation, _array_key(frequencies), _array_key(tau), float(c))
+
+    def create():
+        return decomposition_kernel(frequencies, tau, c, formulation)
+
+    return _kernel_cache.get(key, create, count)
+
+
+def _get_kernel_uncounted(frequencies, tau, c, formulation):
+    """Return the kernel of an unpickled decomposition_kernel, without
+    counting the access in the cache statistics
+    """
+    return get_kernel(frequencies, tau, c, formulation, count=False)
+
+
+def cache_info():
+    """Return the number of hits and misses of the kernel cache of this
+    process
+    """
+    return _kernel_cache.hits, _kernel_cache.misses
+
+
+def thread_cache_info():
+    """Return the number of hits and misses of the kernel cache caused by the
+    calling thread (see --backend threads)
+    """
+    return _kernel_cache.thread_info()
+
+
+def clear_cache():
+    _tau_cache.clear()
+    _kernel_cache.clear()
+
+
+class decomposition_kernel(object):
+    """Kernel matrices K' and K'' of one frequency/tau/c combination, together
+    with the forward response and Jacobian computed from them. Parameters are
+    always given as [log10(s_0), log10(m_i)].
+    """
+
+    def __init__(self, frequencies, tau, c, formulation):
+        self.frequencies = np.array(frequencies, dtype=float)
+        self.tau = np.array(tau, dtype=float)
+        self.c = float(c)
+        self.formulation = formulation
+
+        omegatau = (2.0 * np.pi * self.frequencies[:, np.newaxis] *
+                    self.tau[np.newaxis, :])
+        if formulation == 'conductivity':
+            # Debye terms
+            self.kernel_re = 1.0 / (1.0 + omegatau ** 2)
+            self.kernel_im = omegatau * self.kernel_re
+        elif formulation == 'resistivity':
+            # Cole-Cole terms
+            otc = omegatau ** self.c
+            ang = self.c * np.pi / 2.0
+            denom = 1.0 + 2.0 * otc * np.cos(ang) + otc ** 2
+            self.kernel_re = otc * (np.cos(ang) + otc) / denom
+            self.kernel_im = otc * np.sin(ang) / denom
+        else:
+            raise Exception(
+                'unknown formulation: {0}'.format(formulation))
+        _read_only(self.frequencies, self.tau, self.kernel_re, self.kernel_im)
+
+    def __reduce__(self):
+        # only pickle the key, the kernel is recreated (or taken from the
+        # cache) when unpickled. Unpickling is not a use of the kernel, and
+        # is therefore not counted in the cache statistics
+        return (
+            _get_kernel_uncounted,
+            (self.frequencies, self.tau, self.c, self.formulation)
+        )
+
+    def forward(self, pars):
+        """Return the forward response as an Nx2 array (real parts, negative
+        imaginary parts for resistivities, imaginary parts for conductivities)
+        """
+        return self.forward_batch(pars[np.newaxis, :])[0]
+
+    def Jacobian(self, pars):
+        r"""Return the :math:`2N \times (K + 1)` Jacobian of the forward
+        response. The first N rows hold the derivatives of the real parts, the
+        last N rows the derivatives of the imaginary parts.
+        """
+        return self.Jacobian_batch(pars[np.newaxis, :])[0]
+
+    def forward_and_Jacobian(self, pars):
+        """Return forward response and Jacobian, sharing the kernel products
+        """
+        response, J = self.forward_and_Jacobian_batch(pars[np.newaxis, :])
+        return response[0], J[0]
+
+    def forward_batch(self, pars):
+        """Return the forward responses of S parameter sets
+
+        Parameters
+        ----------
+        pars: S x (K + 1) array
+
+        Returns
+        -------
+        response: S x N x 2 array
+        """
+        s0, m, km_re, km_im = self._kernel_products(pars)
+        return self._assemble_response(s0, km_re, km_im)
+
+    def Jacobian_batch(self, pars):
+        """Return the Jacobians of S parameter sets as an S x 2N x (K + 1)
+        array
+        """
+        s0, m, km_re, km_im = self._kernel_products(pars)
+        return self._assemble_Jacobian(s0, m, km_re, km_im)
+
+    def forward_and_Jacobian_batch(self, pars):
+        """Return forward responses (S x N x 2) and Jacobians
+        (S x 2N x (K + 1)) of S parameter sets
+        """
+        s0, m, km_re, km_im = self._kernel_products(pars)
+        return (self._assemble_response(s0, km_re, km_im),
+                self._assemble_Jacobian(s0, m, km_re, km_im))
+
+    def _kernel_products(self, pars):
+        """Return s_0 (S x 1), m (S x K) and the kernel products K' m and K''
+        m (S x N) for the parameter sets given as rows of pars
+        """
+        s0 = 10 ** pars[:, 0:1]
+        m = 10 ** pars[:, 1:]
+        km_re = m.dot(self.kernel_re.T)
+        km_im = m.dot(self.kernel_im.T)
+        return s0, m, km_re, km_im
+
+    def _assemble_response(self, s0, km_re, km_im):
+        response = np.empty(km_re.shape + (2, ))
+        response[:, :, 0] = s0 * (1 - km_re)
+        response[:, :, 1] = s0 * km_im
+        return response
+
+    def _assemble_Jacobian(self, s0, m, km_re, km_im):
+        """Assemble the Jacobians from the kernel products K' m and K'' m
+        """
+        nr_f = self.frequencies.size
+        J = np.empty((m.shape[0], 2 * nr_f, m.shape[1] + 1))
+        s0m = (s0 * m)[:, np.newaxis, :]
+        # real parts
+        J[:, 0:nr_f, 0] = s0 * (1 - km_re)
+        J[:, 0:nr_f, 1:] = -self.kernel_re[np.newaxis, :, :] * s0m
+        # imaginary parts
+        J[:, nr_f:, 0] = s0 * km_im
+        J[:, nr_f:, 1:] = self.kernel_im[np.newaxis, :, :] * s0m
+        J *= np.log(10)
+        return J
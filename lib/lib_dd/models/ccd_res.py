@@ -1,13 +1,11 @@
 #!/usr/bin/python
 """Cole-Cole decomposition in resistivities
 """
-from NDimInv.plot_helper import *
 import os
 import numpy as np
 import NDimInv.model_template as mt
 import lib_dd.base_class as base_class
-# import resistivity
-import sip_models.res.cc as cc_res
+import lib_dd.kernels as kernels
 import lib_dd.starting_parameters as starting_parameters
 import lib_dd.plot_stats as plot_stats
 
@@ -28,8 +26,6 @@ class decomposition_resistivity(
 
         self.frequencies = settings['frequencies']
         self.set_settings(settings)
-        self.cc = cc_res.cc(self.settings['frequencies'])
-        self.set_settings(settings)
 
     def set_settings(self, settings):
         """
@@ -45,7 +41,10 @@ class decomposition_resistivity(
         self.tau_data_min = 1 / (2 * np.pi * self.frequencies.max())
         self.tau_data_max = 1 / (2 * np.pi * self.frequencies.min())
 
-        self.tau, self.s, self.tau_f_values = base_class.determine_tau_range(settings)
+        self.tau, self.s, self.tau_f_values = kernels.determine_tau_range(
+            settings)
+        self.kernel = kernels.get_kernel(
+            self.frequencies, self.tau, self.settings['c'], 'resistivity')
 
     def convert_parameters(self, pars):
         r"""
@@ -66,20 +65,6 @@ class decomposition_resistivity(
         pars_converted[:] = 10 ** pars[:]
         return pars_converted
 
-    def _get_full_pars(self, pars_dec):
-        # prepare Cole-Cole parameters
-        rho0 = 10**pars_dec[0][np.newaxis]
-        m = 10 ** pars_dec[1:]
-        tau = self.tau
-        if m.size != tau.size:
-            raise Exception('m and tau have different sizes!')
-
-        c = np.ones_like(m) * self.settings['c']
-
-        pars = np.hstack((rho0, m, tau, c))
-        return pars
-
-
     def forward(self, pars_dec):
         """
 
@@ -95,12 +80,9 @@ class decomposition_resistivity(
                negative imaginary parts on the second axis
 
         """
-        pars = self._get_full_pars(pars_dec)
-        response = self.cc.response(pars)
-
-        remim = response.rre_rim
-        remim[:, 1] *= -1
-        return remim
+        if pars_dec.size - 1 != self.tau.size:
+            raise Exception('m and tau have different sizes!')
+        return self.kernel.forward(pars_dec)
 
     def Jacobian(self, pars_dec):
         """
@@ -112,26 +94,45 @@ class decomposition_resistivity(
         -------
         J: (2N) X K array with derivatives.
         """
-        pars = self._get_full_pars(pars_dec)
-        partials = []
-
-        # real part
-        real_J = np.concatenate(
-            (
-                self.cc.dre_dlog10rho0(pars)[:, np.newaxis],
-                self.cc.dre_dlog10m(pars)
-            ),
-            axis=1
-        )
-        imag_J = -np.concatenate(
-            (
-                self.cc.dim_dlog10rho0(pars)[:, np.newaxis],
-                self.cc.dim_dlog10m(pars)
-            ),
-            axis=1
-        )
-        J = np.concatenate((real_J, imag_J), axis=0).squeeze()
-        return J
+        return self.kernel.Jacobian(pars_dec)
+
+    def forward_and_Jacobian(self, pars_dec):
+        """Return forward response and Jacobian for one parameter set
+        """
+        return self.kernel.forward_and_Jacobian(pars_dec)
+
+    def forward_batch(self, pars_dec):
+        """Forward responses of multiple parameter sets
+
+        Parameters
+        ----------
+        pars_dec: S x (K + 1) array, each row containing [log10(rho0),
+                  log10(m_i)]
+
+        Returns
+        -------
+        remim: S x N x 2 array, see self.forward
+        """
+        return self.kernel.forward_batch(pars_dec)
+
+    def Jacobian_batch(self, pars_dec):
+        """Jacobians of multiple parameter sets
+
+        Parameters
+        ----------
+        pars_dec: S x (K + 1) array, see self.forward_batch
+
+        Returns
+        -------
+        J: S x 2N x (K + 1) array
+        """
+        return self.kernel.Jacobian_batch(pars_dec)
+
+    def forward_and_Jacobian_batch(self, pars_dec):
+        """Forward responses (S x N x 2) and Jacobians (S x 2N x (K + 1)) of
+        multiple parameter sets
+        """
+        return self.kernel.forward_and_Jacobian_batch(pars_dec)
 
     def get_data_base_dimensions(self):
         """
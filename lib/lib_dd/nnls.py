@@ -0,0 +1,76 @@
+r"""
+Non-negative least squares (NNLS) fit of the Debye decomposition.
+
+For fixed relaxation times, the decomposition response is linear in
+:math:`s_0` and :math:`q_i = s_0 \cdot m_i` (see lib_dd.kernels):
+
+.. math::
+
+    Re = s_0 - K' \cdot q, \quad -Im = K'' \cdot q
+
+A Tikhonov regularized NNLS solve (first order smoothing of q) therefore
+yields the relaxation time distribution in one step, without the iterative
+Gauss-Newton fit of the log10 parameters. The same linearisation holds for
+the Cole-Cole kernels (c < 1) and the conductivity formulation. The data are
+scaled by the low-frequency magnitude (high-frequency magnitude for
+conductivities), as estimated by lib_dd.base_class.starting_pars_3.
+"""
+import numpy as np
+import scipy.optimize
+import lib_dd.base_class as base_class
+
+# default regularization strength, relative to the squared norm of the
+# kernel matrices
+default_lambda = 1e-4
+# lower limit of the m_i values (which are returned as log10 values)
+m_min = 1e-15
+# lower limit of s_0, relative to the magnitude scale of the data. NNLS can
+# return s_0 = 0, for which log10(s_0) and m_i = q_i / s_0 are not defined
+s0_min = 1e-15
+
+
+def fit_spectrum(kernel, data, weights, lam=None):
+    """Fit one spectrum
+
+    Parameters
+    ----------
+    kernel: lib_dd.kernels.decomposition_kernel
+    data: N x 2 array in the data format of the model
+    weights: N x 2 array with the data weights
+    lam: regularization strength relative to the squared norm of the
+         kernel matrices. Default: default_lambda
+
+    Returns
+    -------
+    pars: model parameters [log10(s_0), log10(m_i)]
+    """
+    if lam is None:
+        lam = default_lambda
+    nr_f, nr_tau = kernel.kernel_re.shape
+    scale = base_class.starting_pars_3(
+        data[:, 0], data[:, 1], kernel.frequencies, kernel.tau).rho0
+
+    # unknowns: s_0, q_i (scaled)
+    A = np.zeros((2 * nr_f, nr_tau + 1))
+    A[0:nr_f, 0] = 1
+    A[0:nr_f, 1:] = -kernel.kernel_re
+    A[nr_f:, 1:] = kernel.kernel_im
+    w = weights.flatten(order='F')
+    A *= w[:, np.newaxis]
+    b = w * data.flatten(order='F') / scale
+
+    # first order smoothing of q, s_0 is not regularized
+    R = np.zeros((nr_tau - 1, nr_tau + 1))
+    R[:, 1:-1] -= np.eye(nr_tau - 1)
+    R[:, 2:] += np.eye(nr_tau - 1)
+    lam_abs = lam * np.sum(A[:, 1:] ** 2) / np.sum(R ** 2)
+
+    x, residual = scipy.optimize.nnls(
+        np.vstack((A, np.sqrt(lam_abs) * R)),
+        np.hstack((b, np.zeros(nr_tau - 1))))
+
+    s0 = max(x[0], s0_min)
+    pars = np.empty(nr_tau + 1)
+    pars[0] = np.log10(s0 * scale)
+    pars[1:] = np.log10(np.maximum(x[1:] / s0, m_min))
+    return pars
@@ -16,10 +16,23 @@ with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import os
-from NDimInv.plot_helper import *
 import numpy as np
 import sip_formats.convert as sip_convert
 
+# matplotlib is imported on first use, see _import_matplotlib
+plt = None
+mpl = None
+
+
+def _import_matplotlib():
+    """Import matplotlib (with the settings of NDimInv.plot_helper). This is
+    deferred until the first plot, so that runs without plots do not pay for
+    the import.
+    """
+    global plt, mpl
+    if plt is None:
+        from NDimInv.plot_helper import plt, mpl
+
 
 class plot_iteration():
     """
@@ -30,6 +43,7 @@ class plot_iteration():
     In addition, it will renormalise data if necessary.
     """
     def plot(self, it, filename, keep_plot=False, norm_factors=None):
+        _import_matplotlib()
         try:
             if norm_factors is None:
                 self.norm_factors = 1.0
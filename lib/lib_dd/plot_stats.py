@@ -1,19 +1,26 @@
-from NDimInv.plot_helper import *
+import os
 import numpy as np
 
 class _plot_stats(object):
 
-    def plot_stats(self, prefix):
+    def plot_stats(self, stat_pars, prefix, directory='.'):
         """
-        Plot various statistics. Requires self.stat_pars to be present.
+        Plot various statistics of a fit to the given directory.
+
+        Parameters
+        ----------
+        stat_pars: statistical parameters of the fit (see
+                   compute_par_stats)
         """
-        self._plot_coverages(prefix)
+        self._plot_coverages(stat_pars, prefix, directory)
 
-    def _plot_coverages(self, prefix):
+    def _plot_coverages(self, stat_pars, prefix, directory):
+        # matplotlib is only imported if something is plotted
+        from NDimInv.plot_helper import plt
         f = self.frequencies
         fig, axes = plt.subplots(2, 2, figsize=(5, 4))
         # plot data/fig
-        pars = np.hstack((self.stat_pars['rho0'], self.stat_pars['m_i']))
+        pars = np.hstack((stat_pars['rho0'], stat_pars['m_i']))
         rre_rim = self.forward(pars)
         rre = rre_rim[:, 0]
         rmim = -rre_rim[:, 1]
@@ -37,7 +44,7 @@ class _plot_stats(object):
         # plot coverages
         ax = axes[0, 1]
         try:
-            ax.semilogx(f, self.stat_pars['covf'], '.-', color='k')
+            ax.semilogx(f, stat_pars['covf'], '.-', color='k')
         except:
             pass
         ax.set_xlabel('Frequency (Hz)')
@@ -47,7 +54,7 @@ class _plot_stats(object):
         ax = axes[1, 1]
         s = self.s
         try:
-            ax.plot(s, self.stat_pars['covm'], '.-', color='k')
+            ax.plot(s, stat_pars['covm'], '.-', color='k')
         except:
             pass
         ax.set_xlabel(r'$s = log_{10}(\tau)$')
@@ -56,7 +63,8 @@ class _plot_stats(object):
         ax.invert_xaxis()
 
         fig.tight_layout()
-        outfile = '{0}_coverages_nr.png'.format(prefix)
+        outfile = os.path.join(
+            directory, '{0}_coverages_nr.png'.format(prefix))
         fig.savefig(outfile)
         fig.clf()
         plt.close(fig)
@@ -41,7 +41,6 @@ class starting_parameters(object):
         TODO: Florsch et al. 2014 has a name for this kind of heuristic...
         """
         parameters = np.zeros((self.s.shape[0] + 1))
-        pars = np.zeros(parameters.shape)
 
         # rho0
         parameters[0] = np.sqrt(re[0] ** 2 + mim[0] ** 2)
@@ -49,22 +48,22 @@ class starting_parameters(object):
         # generate test chargeabilities m_i
         test_m = np.logspace(-12, 0, 20)
 
-        best = 0
-        best_diff = None
-        for nr, i in enumerate(test_m):
-            pars[0] = parameters[0]
-            pars[1:] = i
-            pars = self.convert_parameters(pars)
-            tre_tmim = self.forward(pars)
-            tre = tre_tmim[:, 0]
-            tmim = tre_tmim[:, 1]
-
-            diff_im = np.sum(np.abs(tmim - mim))
-            if(best_diff is None or best_diff > diff_im):
-                best_diff = diff_im
-                best = nr
-            if('DD_DEBUG_STARTING_PARS' in os.environ and
-               os.environ['DD_DEBUG_STARTING_PARS'] == '1'):
+        # compute all test responses at once
+        test_pars = np.empty((test_m.size, parameters.size))
+        test_pars[:, 0] = parameters[0]
+        test_pars[:, 1:] = test_m[:, np.newaxis]
+        test_pars = self.convert_parameters(test_pars)
+        test_responses = self.forward_batch(test_pars)
+
+        diffs_im = np.sum(np.abs(test_responses[:, :, 1] - mim), axis=1)
+        best = np.argmin(diffs_im)
+
+        if('DD_DEBUG_STARTING_PARS' in os.environ and
+           os.environ['DD_DEBUG_STARTING_PARS'] == '1'):
+            for nr, i in enumerate(test_m):
+                tre = test_responses[nr, :, 0]
+                tmim = test_responses[nr, :, 1]
+                diff_im = diffs_im[nr]
                 # enable debug plots
                 fig, axes = plt.subplots(2, 1, figsize=(5, 4))
                 fig.suptitle('test m: {0} - diff\_im: {1}'.format(
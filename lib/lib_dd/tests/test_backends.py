@@ -0,0 +1,99 @@
+"""
+Test the execution backends (processes, threads) of multi-core fits and the
+coordination of the BLAS threads
+
+Run with
+
+nosetests test_backends.py -s -v
+"""
+import os
+import numpy as np
+from nose.tools import *
+import lib_dd.decomposition.backends as backends
+from test_batch_engine import _get_ccd_single_object
+
+
+def test_blas_threads():
+    prep_opts = {'nr_cores': 2, 'blas_threads': 3}
+    assert_equal(backends.get_blas_threads(prep_opts), 3)
+    prep_opts['blas_threads'] = None
+    prep_opts['nr_cores'] = 100000
+    assert_equal(backends.get_blas_threads(prep_opts), 1)
+
+    original = os.environ.get('OMP_NUM_THREADS')
+    backends.limit_blas_threads(2)
+    assert_equal(os.environ['OMP_NUM_THREADS'], '2')
+    backends.restore_blas_threads()
+    assert_equal(os.environ.get('OMP_NUM_THREADS'), original)
+
+
+def test_thread_backend():
+    for engine in ('ndiminv', 'nnls'):
+        obj = _get_ccd_single_object()
+        obj.data['prep_opts']['engine'] = engine
+        obj.fit_data()
+        results_single = obj.results
+
+        obj.data['prep_opts']['nr_cores'] = 2
+        obj.data['prep_opts']['backend'] = 'threads'
+        assert_false(obj._use_shared_memory(range(3)))
+        obj.fit_data()
+        for result_single, result in zip(results_single, obj.results):
+            assert_equal(result.index, result_single.index)
+            np.testing.assert_allclose(result.m, result_single.m)
+            np.testing.assert_allclose(
+                result.stat_pars['m_tot_n'], result_single.stat_pars['m_tot_n'])
+
+
+def test_thread_backend_templates():
+    # many spectra of one ND template fitted at the same time
+    obj = _get_ccd_single_object()
+    obj.data['raw_data'] = np.tile(obj.data['raw_data'], (4, 1))
+    obj.data['cr_data'] = obj.data['cr_data'] * 4
+    obj.fit_data()
+    results_single = obj.results
+
+    obj.data['prep_opts']['nr_cores'] = 4
+    obj.data['prep_opts']['backend'] = 'threads'
+    obj.fit_data()
+    assert_equal(len(obj.results), 12)
+    for result_single, result in zip(results_single, obj.results):
+        np.testing.assert_allclose(result.m, result_single.m)
+        np.testing.assert_allclose(result.lams, result_single.lams)
+        assert_equal(sorted(result.stat_pars.keys()),
+                     sorted(result_single.stat_pars.keys()))
+        for key in result_single.stat_pars.keys():
+            np.testing.assert_allclose(
+                result.stat_pars[key], result_single.stat_pars[key])
+
+
+@raises(Exception)
+def test_thread_backend_plot():
+    obj = _get_ccd_single_object()
+    obj.data['prep_opts']['nr_cores'] = 2
+    obj.data['prep_opts']['backend'] = 'threads'
+    obj.data['prep_opts']['plot'] = True
+    obj.fit_data()
+
+
+def test_persistent_pool():
+    prep_opts = {'nr_cores': 2, 'blas_threads': 1}
+    pool = backends.get_pool(prep_opts)
+    assert_true(backends.get_pool(prep_opts) is pool)
+    other_pool = backends.get_pool(prep_opts, persistent=False)
+    assert_false(other_pool is pool)
+    other_pool.close()
+
+    # results are identical for consecutive runs on the same workers
+    results = []
+    for run in range(2):
+        obj = _get_ccd_single_object()
+        obj.data['prep_opts']['nr_cores'] = 2
+        obj.data['prep_opts']['keep_nd'] = True
+        obj.fit_data()
+        results.append(obj.results)
+    for result1, result2 in zip(*results):
+        np.testing.assert_allclose(result1.m, result2.m)
+
+    backends.shutdown()
+    assert_equal(len(backends._pools), 0)
@@ -0,0 +1,80 @@
+"""
+Compare the batched Gauss-Newton engine to the NDimInv based fit of single
+spectra
+
+Run with
+
+nosetests test_batch_engine.py -s -v
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+from lib_dd.models import ccd_res
+
+
+def _get_ccd_single_object():
+    """Synthetic Debye decomposition spectra (rmag_rpha) with different
+    chargeability distributions
+    """
+    frequencies = np.logspace(-2, 4, 25)
+    model = ccd_res.decomposition_resistivity(
+        {'Nd': 10, 'tausel': 'data_ext', 'frequencies': frequencies, 'c': 1.0}
+    )
+    raw_data = []
+    for center in (0.3, 0.5, 0.7):
+        m = 1e-3 * np.exp(
+            -(np.linspace(0, 1, model.tau.size) - center) ** 2 / 0.01)
+        pars = np.hstack((2, np.log10(m)))
+        remim = model.forward(pars)
+        magnitude = np.abs(remim[:, 0] - 1j * remim[:, 1])
+        phase = np.arctan2(-remim[:, 1], remim[:, 0]) * 1000
+        raw_data.append(np.hstack((magnitude, phase)))
+
+    config = cfg_single.cfg_single()
+    config['nr_terms_decade'] = 10
+    prep_opts, inv_opts = config.split_options()
+    data = {
+        'frequencies': frequencies,
+        'raw_data': np.array(raw_data),
+        'cr_data': [x.reshape((frequencies.size, 2), order='F') for x in
+                    raw_data],
+        'outdir': '.',
+        'options': config,
+        'prep_opts': prep_opts,
+        'inv_opts': inv_opts,
+    }
+    obj = ccd_single.ccd_single(config)
+    obj.data = data
+    return obj
+
+
+def test_batch_engine():
+    obj = _get_ccd_single_object()
+    obj.fit_data()
+    results_ndiminv = obj.results
+
+    obj.data['prep_opts']['engine'] = 'batch'
+    obj.fit_data()
+    results_batch = obj.results
+
+    assert_equal(len(results_batch), len(results_ndiminv))
+    for result, result_batch in zip(results_ndiminv, results_batch):
+        assert_equal(result.nr, result_batch.nr)
+        np.testing.assert_allclose(result.lams, result_batch.lams)
+        np.testing.assert_allclose(result.m, result_batch.m, rtol=1e-8)
+        np.testing.assert_allclose(
+            result.rms_values['rms_re_im_noerr'],
+            result_batch.rms_values['rms_re_im_noerr'],
+            rtol=1e-8)
+        np.testing.assert_allclose(result.f, result_batch.f, rtol=1e-8)
+        assert_true(result.ND is None)
+
+
+@raises(Exception)
+def test_batch_engine_plot_lambda():
+    # the batch engine does not keep the iteration history
+    obj = _get_ccd_single_object()
+    obj.data['prep_opts']['engine'] = 'batch'
+    obj.data['prep_opts']['plot_lambda'] = 1
+    obj.fit_data()
@@ -0,0 +1,224 @@
+"""
+Test the fits of dd_time in windows of time steps, without time
+regularization, in which the time steps are fitted independently, and with
+the sparse engine
+
+Run with
+
+nosetests test_dd_time.py -s -v
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from nose.tools import *
+import lib_dd.config.cfg_time as cfg_time
+from lib_dd.models import ccd_res
+
+_src_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'src')
+sys.path.append(os.path.join(_src_dir, 'dd_time'))
+import dd_time
+
+
+def _get_data(nr_timesteps=4, **settings):
+    """Synthetic Debye decomposition time series (rmag_rpha), in which the
+    chargeability distribution moves with time. settings overwrite the
+    cfg_time options.
+    """
+    frequencies = np.logspace(-2, 4, 20)
+    model = ccd_res.decomposition_resistivity(
+        {'Nd': 10, 'tausel': 'data_ext', 'frequencies': frequencies, 'c': 1.0}
+    )
+    raw_data = []
+    for center in np.linspace(0.3, 0.7, nr_timesteps):
+        m = 1e-3 * np.exp(
+            -(np.linspace(0, 1, model.tau.size) - center) ** 2 / 0.01)
+        pars = np.hstack((2, np.log10(m)))
+        remim = model.forward(pars)
+        magnitude = np.abs(remim[:, 0] - 1j * remim[:, 1])
+        phase = np.arctan2(-remim[:, 1], remim[:, 0]) * 1000
+        raw_data.append(np.hstack((magnitude, phase)))
+
+    config = cfg_time.cfg_time()
+    config['nr_terms_decade'] = 10
+    config['freq_lambda'] = 10
+    for key, value in settings.items():
+        config[key] = value
+    prep_opts, inv_opts = config.split_options()
+    data = {
+        'frequencies': frequencies,
+        'times': np.arange(nr_timesteps),
+        'raw_data': np.array(raw_data),
+        'raw_format': 'rmag_rpha',
+        'options': {'output_format': 'ascii'},
+        'prep_opts': prep_opts,
+        'inv_opts': inv_opts,
+    }
+    data['cr_data'] = data['raw_data']
+    return data
+
+
+def _get_fit_data(nr_timesteps=4, **settings):
+    return dd_time._get_fit_datas(
+        _get_data(nr_timesteps, **settings), tempfile.gettempdir())
+
+
+def test_is_decoupled():
+    assert_true(dd_time._is_decoupled(_get_fit_data()))
+    assert_false(dd_time._is_decoupled(_get_fit_data(1)))
+    assert_false(dd_time._is_decoupled(_get_fit_data(engine='nnls')))
+    assert_false(dd_time._is_decoupled(_get_fit_data(time_rho0_lambda=1)))
+    assert_false(dd_time._is_decoupled(_get_fit_data(time_m_i_lambda=1)))
+    assert_false(dd_time._is_decoupled(
+        _get_fit_data(individual_lambdas=True)))
+
+
+def test_decoupled_plot_options():
+    # the iteration plots need a joint inversion
+    assert_false(dd_time._is_decoupled(_get_fit_data(plot_it_spectra=True)))
+    assert_false(dd_time._is_decoupled(_get_fit_data(plot_lambda=0)))
+
+
+@raises(Exception)
+def test_window_plot_options():
+    dd_time.check_options(_get_data(window=2, plot_lambda=0)['prep_opts'])
+
+
+def test_fit_decoupled():
+    data = _get_fit_data()
+    ND = dd_time.fit_decoupled(data)
+    final_iteration = ND.iterations[-1]
+    m = np.array(final_iteration.m).reshape((4, -1))
+    assert_equal(len(ND.iterations), 1)
+    np.testing.assert_allclose(final_iteration.lams, [10, 0, 0])
+
+    for t in range(4):
+        # each time step equals the fit of the time step alone
+        ND_t = dd_time._prepare_ND_object(
+            dd_time._get_window_data(data, t, t + 1))
+        ND_t.run_inversion()
+        np.testing.assert_allclose(m[t], ND_t.iterations[-1].m)
+        assert_equal(ND.time_step_results[t, 0], t)
+        assert_equal(ND.time_step_results[t, 1], 10)
+        assert_equal(ND.time_step_results[t, 2], ND_t.iterations[-1].nr)
+    assert_equal(final_iteration.nr, ND.time_step_results[:, 2].max())
+
+    # the stitched model reproduces the stitched forward response
+    np.testing.assert_allclose(
+        final_iteration.f, ND.Model.f(final_iteration.m))
+
+
+def test_time_step_lambdas():
+    outdir = tempfile.mkdtemp()
+    try:
+        data = _get_data(3, freq_lambda=None)
+        ND = dd_time.fit_data(data, outdir)
+        filename = os.path.join(outdir, 'time_step_lambdas.dat')
+        assert_true(os.path.isfile(filename))
+        with open(filename, 'r') as fid:
+            assert_equal(fid.readline().strip(),
+                         '# window lambda nr_iterations')
+        time_step_results = np.loadtxt(filename)
+        assert_equal(time_step_results.shape, (3, 3))
+        np.testing.assert_allclose(time_step_results[:, 0], range(3))
+        np.testing.assert_allclose(
+            time_step_results, ND.time_step_results, rtol=1e-9)
+    finally:
+        shutil.rmtree(outdir)
+
+
+def test_get_windows():
+    # series shorter than the window
+    assert_equal(dd_time.get_windows(3, 5, 2), [(0, 3)])
+    assert_equal(dd_time.get_windows(10, 4, 1), [(0, 4), (3, 7), (6, 10)])
+    # the last window is shifted back to hold 4 time steps
+    assert_equal(dd_time.get_windows(9, 4, 1), [(0, 4), (3, 7), (5, 9)])
+    assert_equal(dd_time.get_windows(4, 2, 0), [(0, 2), (2, 4)])
+
+
+@raises(Exception)
+def test_get_windows_negative_overlap():
+    dd_time.get_windows(10, 4, -1)
+
+
+@raises(Exception)
+def test_get_windows_overlap_too_large():
+    dd_time.get_windows(10, 4, 4)
+
+
+def test_keep_ranges():
+    keep_ranges = dd_time._get_keep_ranges([(0, 4), (3, 7), (5, 9)])
+    assert_equal(keep_ranges, [(0, 3), (3, 6), (6, 9)])
+    assert_equal(dd_time._get_keep_ranges([(0, 5)]), [(0, 5)])
+
+
+def test_stitch_windows():
+    data = _get_fit_data(9, window=4, window_overlap=1)
+    windows = [(0, 4), (3, 7), (5, 9)]
+    m0 = np.array(dd_time._prepare_ND_object(
+        dd_time._get_window_data(data, 0, 1)).Model.m0)
+    # the parameters of each window hold the window number
+    results = [(np.tile(m0 + 0.01 * nr, (4, 1)), [nr + 1, 0, 0], nr + 2)
+               for nr in range(3)]
+    ND = dd_time._stitch_windows(data, windows, results)
+    m = np.array(ND.iterations[-1].m).reshape((9, -1))
+    window_nrs = [0, 0, 0, 1, 1, 1, 2, 2, 2]
+    for t, nr in enumerate(window_nrs):
+        np.testing.assert_allclose(m[t], m0 + 0.01 * nr)
+    np.testing.assert_allclose(ND.time_step_results[:, 0], window_nrs)
+    np.testing.assert_allclose(
+        ND.time_step_results[:, 1], np.array(window_nrs) + 1)
+    np.testing.assert_allclose(
+        ND.time_step_results[:, 2], np.array(window_nrs) + 2)
+    assert_equal(ND.iterations[-1].nr, 4)
+    # the windows used different lambdas
+    assert_true(np.isnan(ND.iterations[-1].lams[0]))
+
+
+def test_single_window():
+    # a window covering the whole series equals the joint inversion
+    data = _get_fit_data(
+        4, window=4, time_rho0_lambda=1, time_m_i_lambda=1)
+    ND_windowed = dd_time.fit_windowed(data)
+    ND = dd_time._prepare_ND_object(data)
+    ND.run_inversion()
+
+    windowed_iteration = ND_windowed.iterations[-1]
+    final_iteration = ND.iterations[-1]
+    np.testing.assert_allclose(windowed_iteration.m, final_iteration.m)
+    np.testing.assert_allclose(windowed_iteration.f, final_iteration.f)
+    assert_equal(windowed_iteration.nr, final_iteration.nr)
+    np.testing.assert_allclose(windowed_iteration.lams, [10, 1, 1])
+    np.testing.assert_allclose(ND_windowed.time_step_results[:, 0], 0)
+
+
+def _compare_engines(**settings):
+    """Fit the same time series with the ndiminv and the sparse engine"""
+    iterations = []
+    for engine in ('ndiminv', 'sparse'):
+        data = _get_fit_data(
+            5, engine=engine, time_rho0_lambda=1, time_m_i_lambda=1,
+            **settings)
+        assert_false(dd_time._is_decoupled(data))
+        ND = dd_time._prepare_ND_object(data)
+        dd_time._run_inversion(data, ND)
+        iterations.append(ND.iterations[-1])
+
+    final_iteration, sparse_iteration = iterations
+    assert_equal(sparse_iteration.nr, final_iteration.nr)
+    np.testing.assert_allclose(sparse_iteration.lams, final_iteration.lams)
+    np.testing.assert_allclose(
+        sparse_iteration.m, final_iteration.m, rtol=1e-6, atol=1e-8)
+    np.testing.assert_allclose(
+        sparse_iteration.f, final_iteration.f, rtol=1e-6)
+
+
+def test_sparse_engine_fixed_lambdas():
+    _compare_engines()
+
+
+def test_sparse_engine_lambda_search():
+    # the initial lambda of the search must be given, see --lam0
+    _compare_engines(freq_lambda=None, f_lam0=100)
@@ -0,0 +1,80 @@
+"""
+Test the streaming mode of ccd_single and resuming from the fit journal
+
+Run with
+
+nosetests test_journal.py -s -v
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from nose.tools import *
+import lib_dd.io.journal as journal
+from test_batch_engine import _get_ccd_single_object
+
+
+def test_resume():
+    outdir = tempfile.mkdtemp()
+    try:
+        obj = _get_ccd_single_object()
+        obj.data['outdir'] = outdir
+        obj.data['prep_opts']['stream'] = True
+        obj.fit_data()
+        assert_true(isinstance(obj.results, journal.journal_results))
+        assert_equal(len(obj.results), 3)
+        results = list(obj.results)
+
+        # simulate an aborted run: keep the first two results and a part
+        # of the third one
+        filename = os.path.join(outdir, journal.journal_filename)
+        with open(filename, 'rb') as fid:
+            content = fid.read()
+        with open(filename, 'wb') as fid:
+            fid.write(content[:-1])
+        fit_journal = journal.journal(outdir, 3, resume=True)
+        fit_journal.close()
+        assert_equal(len(fit_journal.indices), 2)
+
+        obj.data['prep_opts']['resume'] = True
+        obj.fit_data()
+        for result, result_resumed in zip(results, obj.results):
+            np.testing.assert_allclose(result.m, result_resumed.m)
+            assert_equal(result.nr, result_resumed.nr)
+    finally:
+        shutil.rmtree(outdir)
+
+
+def test_completion_journal():
+    outdir = tempfile.mkdtemp()
+    try:
+        fit_journal = journal.completion_journal(outdir, 4)
+        assert_false(fit_journal.existed)
+        # out-of-order completion
+        fit_journal.append(2, 'done', 1.5, location='fits/tmp_ts_2')
+        fit_journal.append(0, 'failed', 0.1, error='error')
+        fit_journal.append(3, 'done', 2.0, location='fits/tmp_ts_3')
+        fit_journal.close()
+
+        # truncated last record
+        filename = os.path.join(outdir, journal.completion_journal_filename)
+        with open(filename, 'rb') as fid:
+            content = fid.read()
+        with open(filename, 'wb') as fid:
+            fid.write(content[:-1])
+
+        fit_journal = journal.completion_journal(outdir, 4)
+        assert_true(fit_journal.existed)
+        assert_equal(fit_journal.finished, set([2]))
+        assert_equal(fit_journal.failed, set([0]))
+        assert_equal(fit_journal.records[2]['duration'], 1.5)
+
+        # retry of a failed pixel
+        fit_journal.append(0, 'done', 1.0, location='fits/tmp_ts_0')
+        fit_journal.close()
+        fit_journal = journal.completion_journal(outdir, 4)
+        fit_journal.close()
+        assert_equal(fit_journal.finished, set([0, 2]))
+        assert_equal(fit_journal.failed, set())
+    finally:
+        shutil.rmtree(outdir)
@@ -0,0 +1,106 @@
+"""
+Test the process-wide kernel cache
+
+Run with
+
+nosetests test_kernels.py -s -v
+"""
+import pickle
+import threading
+import numpy as np
+from nose.tools import *
+import lib_dd.kernels as kernels
+from lib_dd.models import ccd_res
+
+
+def _settings(frequencies, c=1.0):
+    return {'Nd': 20,
+            'tausel': 'data_ext',
+            'frequencies': frequencies,
+            'c': c,
+            }
+
+
+def test_kernel_is_shared():
+    kernels.clear_cache()
+    frequencies = np.logspace(-2, 4, 20)
+    model1 = ccd_res.decomposition_resistivity(_settings(frequencies))
+    model2 = ccd_res.decomposition_resistivity(_settings(frequencies.copy()))
+    assert_true(model1.kernel is model2.kernel)
+    assert_equal(kernels.cache_info(), (1, 1))
+
+    # a different Cole-Cole exponent requires a new kernel
+    model3 = ccd_res.decomposition_resistivity(_settings(frequencies, 0.5))
+    assert_false(model3.kernel is model1.kernel)
+    assert_equal(kernels.cache_info(), (1, 2))
+
+
+def test_unpickling_is_not_counted():
+    kernels.clear_cache()
+    frequencies = np.logspace(-2, 4, 20)
+    model = ccd_res.decomposition_resistivity(_settings(frequencies))
+    kernel = pickle.loads(pickle.dumps(model.kernel))
+    assert_true(kernel is model.kernel)
+    assert_equal(kernels.cache_info(), (0, 1))
+
+
+def test_lru_eviction():
+    cache = kernels._lru_cache(2)
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get(key, lambda: key)
+    assert_equal(list(cache.entries.keys()), ['a', 'c'])
+    assert_equal((cache.hits, cache.misses), (1, 3))
+
+
+def test_thread_cache_info():
+    kernels.clear_cache()
+    frequencies = np.logspace(-2, 4, 20)
+    ccd_res.decomposition_resistivity(_settings(frequencies))
+    assert_equal(kernels.thread_cache_info(), (0, 1))
+
+    # accesses of other threads are only included in the total
+    thread = threading.Thread(
+        target=ccd_res.decomposition_resistivity,
+        args=(_settings(frequencies), ))
+    thread.start()
+    thread.join()
+    assert_equal(kernels.thread_cache_info(), (0, 1))
+    assert_equal(kernels.cache_info(), (1, 1))
+
+
+def test_resistivity_kernel():
+    """Compare to the complex Cole-Cole formulation"""
+    frequencies = np.logspace(-2, 4, 20)
+    c = 0.6
+    model = ccd_res.decomposition_resistivity(_settings(frequencies, c))
+    random = np.random.RandomState(42)
+    pars = np.hstack((2, random.uniform(-6, -2, model.tau.size)))
+
+    omega = 2 * np.pi * frequencies[:, np.newaxis]
+    terms = 10 ** pars[1:] * (
+        1 - 1 / (1 + (1j * omega * model.tau) ** c))
+    response = 10 ** pars[0] * (1 - np.sum(terms, axis=1))
+    np.testing.assert_allclose(
+        model.forward(pars),
+        np.vstack((response.real, -response.imag)).T,
+        rtol=1e-12)
+
+
+def test_batch_api():
+    """Batched forward responses/Jacobians equal the single spectrum ones"""
+    frequencies = np.logspace(-2, 4, 20)
+    model = ccd_res.decomposition_resistivity(_settings(frequencies, 0.8))
+    random = np.random.RandomState(42)
+    pars = np.hstack((
+        random.uniform(1, 3, (5, 1)),
+        random.uniform(-6, -2, (5, model.tau.size))
+    ))
+    responses = model.forward_batch(pars)
+    Js = model.Jacobian_batch(pars)
+    assert_equal(responses.shape, (5, frequencies.size, 2))
+    assert_equal(Js.shape, (5, 2 * frequencies.size, model.tau.size + 1))
+    for index in range(pars.shape[0]):
+        np.testing.assert_allclose(
+            responses[index], model.forward(pars[index]), rtol=1e-12)
+        np.testing.assert_allclose(
+            Js[index], model.Jacobian(pars[index]), rtol=1e-12)
@@ -0,0 +1,97 @@
+"""
+Test the grouping of spectra by their NaN values and the masking of missing
+data points by zero data weights
+
+Run with
+
+nosetests test_nan_handling.py -s -v
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+from test_batch_engine import _get_ccd_single_object
+
+
+def _get_object_with_nans():
+    obj = _get_ccd_single_object()
+    cr_data = [x.copy() for x in obj.data['cr_data']]
+    cr_data[0][3, :] = np.nan
+    cr_data[2][3, :] = np.nan
+    obj.data['cr_data'] = cr_data
+    return obj
+
+
+def test_mask_groups():
+    obj = _get_object_with_nans()
+    fit_datas = list(decomp_single_sl._get_fit_datas(obj.data))
+    assert_equal([x['mask_group'] for x in fit_datas], [0, 1, 0])
+    assert_true(fit_datas[0]['frequencies'] is fit_datas[2]['frequencies'])
+    assert_equal(fit_datas[0]['data'].shape[0], 24)
+
+    obj.data['prep_opts']['nan_handling'] = 'weights'
+    fit_datas = list(decomp_single_sl._get_fit_datas(obj.data))
+    assert_equal(fit_datas[0]['data'].shape[0], 25)
+    assert_false(np.any(np.isnan(fit_datas[0]['data'])))
+    assert_equal(np.where(fit_datas[0]['mask'])[0].tolist(), [3])
+    assert_true(fit_datas[1]['mask'] is None)
+
+
+def test_masked_weights():
+    obj = _get_object_with_nans()
+    obj.data['prep_opts']['nan_handling'] = 'weights'
+    obj.data['prep_opts']['keep_nd'] = True
+    obj.fit_data()
+    WD = obj.results[0].ND.Data.WD()
+    assert_true(np.all(WD[3, :] == 0))
+    assert_true(np.all(WD[4, :] > 0))
+
+    # the masked fits are close to those of the full spectra
+    obj_full = _get_ccd_single_object()
+    obj_full.fit_data()
+    for index in (0, 2):
+        np.testing.assert_allclose(
+            obj.results[index].stat_pars['m_tot_n'],
+            obj_full.results[index].stat_pars['m_tot_n'],
+            atol=0.02)
+
+
+def test_lazy_fit_datas():
+    obj = _get_ccd_single_object()
+    raw_data = np.vstack([x.flatten(order='F') for x in obj.data['cr_data']])
+    obj.data['cr_data'] = decomp_single_sl._cr_spectra(raw_data)
+    fit_datas = decomp_single_sl._get_fit_datas(obj.data, indices=[2, 1])
+    assert_false(isinstance(fit_datas, list))
+
+    fit_datas = list(fit_datas)
+    assert_equal([x['nr'] for x in fit_datas], [3, 2])
+    assert_true(np.may_share_memory(fit_datas[0]['data'], raw_data))
+    np.testing.assert_array_equal(
+        fit_datas[0]['data'].flatten(order='F'), raw_data[2])
+
+
+def test_masked_rms():
+    obj = _get_object_with_nans()
+    obj.data['prep_opts']['nan_handling'] = 'weights'
+    fit_datas = list(decomp_single_sl._get_fit_datas(obj.data))
+    # the rms of masked spectra ignores the interpolated data points
+    assert_equal(decomp_single_sl._get_rms_key(fit_datas[0]), 'rms_re_im')
+    assert_equal(
+        decomp_single_sl._get_rms_key(fit_datas[1]), 'rms_re_im_noerr')
+    ND0 = decomp_single_sl._prepare_ND_object(fit_datas[0])
+    ND1 = decomp_single_sl._prepare_ND_object(fit_datas[1])
+    assert_false(ND0.Model.obj is ND1.Model.obj)
+    assert_equal(ND0.stop_rms_key, 'rms_re_im')
+
+    # the batch engine optimizes the same rms
+    obj.fit_data()
+    results_ndiminv = obj.results
+    obj.data['prep_opts']['engine'] = 'batch'
+    obj.fit_data()
+    for result, result_batch in zip(results_ndiminv, obj.results):
+        assert_true(np.all(np.isfinite(result_batch.m)))
+        assert_equal(result.nr, result_batch.nr)
+        np.testing.assert_allclose(result.lams, result_batch.lams)
+        np.testing.assert_allclose(result.m, result_batch.m, rtol=1e-8)
+        np.testing.assert_allclose(
+            result.rms_values['rms_re_im'],
+            result_batch.rms_values['rms_re_im'], rtol=1e-8)
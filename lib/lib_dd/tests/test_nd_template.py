@@ -0,0 +1,58 @@
+"""
+Test the sharing of NDimInv templates between spectra
+
+Run with
+
+nosetests test_nd_template.py -s -v
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+from test_batch_engine import _get_ccd_single_object
+
+
+def test_nd_template():
+    obj = _get_ccd_single_object()
+    fit_datas = list(decomp_single_sl._get_fit_datas(obj.data))
+    ND1 = decomp_single_sl._prepare_ND_object(fit_datas[0])
+    ND2 = decomp_single_sl._prepare_ND_object(fit_datas[1])
+
+    # only the read-only parts are shared
+    model1 = ND1.Model.obj
+    model2 = ND2.Model.obj
+    assert_false(model1 is model2)
+    assert_true(model1.tau is model2.tau)
+    assert_true(model1.kernel is model2.kernel)
+    template = decomp_single_sl._get_template(fit_datas[0])
+    assert_false('global_prefix' in template.model_settings)
+    assert_false('norm_factors' in template.model_settings)
+    reg1, lam1 = ND1.Model.regularizations[0][0]
+    reg2, lam2 = ND2.Model.regularizations[0][0]
+    assert_false(reg1 is reg2)
+    parsize = model1.tau.size + 1
+    assert_true(reg1.WtWm(parsize) is reg2.WtWm(parsize))
+    assert_false(reg1.WtWm(parsize).flags.writeable)
+    assert_false(lam1 is lam2)
+    assert_false(ND1.Model.steplength_selector is
+                 ND2.Model.steplength_selector)
+    assert_false(ND1.Data.data_weighting_func is ND2.Data.data_weighting_func)
+    assert_false(np.allclose(ND1.Data.D, ND2.Data.D))
+
+    # other settings require a new template
+    fit_datas[2]['inv_opts']['max_iterations'] += 1
+    assert_false(decomp_single_sl._get_template(fit_datas[2]) is
+                 decomp_single_sl._get_template(fit_datas[0]))
+
+
+def test_shared_model_stats():
+    obj = _get_ccd_single_object()
+    obj.fit_data()
+    fit_datas = list(decomp_single_sl._get_fit_datas(obj.data))
+    model = decomp_single_sl._prepare_ND_object(fit_datas[0]).Model.obj
+
+    # the statistical parameters are not stored in the shared model object
+    stat_pars = [model.compute_par_stats(result.m) for result in obj.results]
+    assert_false(hasattr(model, 'stat_pars'))
+    for result, stats in zip(obj.results, stat_pars):
+        np.testing.assert_allclose(
+            stats['m_tot_n'], result.stat_pars['m_tot_n'])
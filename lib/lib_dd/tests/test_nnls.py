@@ -0,0 +1,52 @@
+"""
+Compare the NNLS engine to the NDimInv based fit of single spectra
+
+Run with
+
+nosetests test_nnls.py -s -v
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.nnls as nnls
+import lib_dd.kernels as kernels
+from test_batch_engine import _get_ccd_single_object
+
+
+def test_nnls_engine():
+    obj = _get_ccd_single_object()
+    obj.fit_data()
+    results_ndiminv = obj.results
+
+    obj.data['prep_opts']['engine'] = 'nnls'
+    obj.fit_data()
+    results_nnls = obj.results
+
+    for result, result_nnls in zip(results_ndiminv, results_nnls):
+        assert_equal(result_nnls.nr, 0)
+        np.testing.assert_allclose(
+            result_nnls.stat_pars['rho0'], result.stat_pars['rho0'],
+            atol=1e-3)
+        np.testing.assert_allclose(
+            result_nnls.stat_pars['m_tot_n'], result.stat_pars['m_tot_n'],
+            atol=0.05)
+        assert_true(
+            result_nnls.rms_values['rms_re_im_noerr'][1] <
+            2 * result.rms_values['rms_re_im_noerr'][1])
+
+
+def test_zero_s0():
+    frequencies = np.logspace(-2, 4, 25)
+    tau = np.logspace(-5, 2, 20)
+    kernel = kernels.get_kernel(frequencies, tau, 1.0, 'resistivity')
+    data = np.vstack((100 * np.ones(25), np.ones(25))).T
+    weights = np.ones_like(data)
+
+    # NNLS may return s_0 = 0
+    original = nnls.scipy.optimize.nnls
+    nnls.scipy.optimize.nnls = lambda A, b: (
+        np.hstack((0, np.ones(A.shape[1] - 1))), 0)
+    try:
+        pars = nnls.fit_spectrum(kernel, data, weights)
+    finally:
+        nnls.scipy.optimize.nnls = original
+    assert_true(np.all(np.isfinite(pars)))
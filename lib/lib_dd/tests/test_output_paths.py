@@ -0,0 +1,30 @@
+"""
+Test that the results are written to explicit output directories, without
+changing the working directory
+
+Run with
+
+nosetests test_output_paths.py -s -v
+"""
+import os
+import shutil
+import tempfile
+from nose.tools import *
+import lib_dd.io.io_general as iog
+from test_batch_engine import _get_ccd_single_object
+
+
+def test_save_fit_results():
+    obj = _get_ccd_single_object()
+    obj.fit_data()
+    obj.data['raw_format'] = 'rmag_rpha'
+    obj.data['options']['output_format'] = 'ascii'
+
+    pwd = os.getcwd()
+    outdir = tempfile.mkdtemp(suffix='ccd_')
+    iog.save_fit_results(obj.data, obj.results, outdir)
+    assert_equal(os.getcwd(), pwd)
+    for filename in ('f.dat', 'f_format.dat', 'nr_iterations.dat',
+                     os.path.join('stats_and_rms', 'm_tot_n_results.dat')):
+        assert_true(os.path.isfile(os.path.join(outdir, filename)))
+    shutil.rmtree(outdir)
@@ -0,0 +1,74 @@
+"""
+Test the consolidated result store of dd_space_time
+
+Run with
+
+nosetests test_result_store.py -s -v
+"""
+import shutil
+import tempfile
+import numpy as np
+from nose.tools import *
+import lib_dd.io.result_store as result_store
+
+
+def _get_values(pixel, nr_timesteps=3, nr_tau=4):
+    return {
+        'm_tot_n': np.ones((nr_timesteps, 1)) * pixel,
+        'm_i': np.ones((nr_timesteps, nr_tau)) * pixel,
+    }
+
+
+def test_store():
+    outdir = tempfile.mkdtemp()
+    try:
+        store = result_store.result_store(outdir, 5, 3)
+        # out-of-order completion
+        for pixel in (3, 0, 1):
+            store.write(pixel, _get_values(pixel))
+        assert_false(store.is_complete())
+
+        # resume
+        store = result_store.result_store(outdir, 5, 3)
+        for pixel in (4, 2):
+            store.write(pixel, _get_values(pixel))
+        assert_true(store.is_complete())
+
+        store = result_store.result_store(outdir, mode='r')
+        m_tot_n = store.get_map('m_tot_n')
+        assert_equal(m_tot_n.shape, (5, 3))
+        np.testing.assert_allclose(m_tot_n[:, 1], np.arange(5))
+        assert_equal(store.get_map('m_i').shape, (5, 3, 4))
+    finally:
+        shutil.rmtree(outdir)
+
+
+def test_unfilled_pixels():
+    outdir = tempfile.mkdtemp()
+    try:
+        store = result_store.result_store(outdir, 2, 3)
+        store.write(1, _get_values(1))
+        store = result_store.result_store(outdir, mode='r')
+        assert_true(np.all(np.isnan(store.get_map('m_tot_n')[0])))
+    finally:
+        shutil.rmtree(outdir)
+
+
+@raises(Exception)
+def test_layout_mismatch():
+    outdir = tempfile.mkdtemp()
+    try:
+        store = result_store.result_store(outdir, 2, 3)
+        store.write(0, _get_values(0))
+        result_store.result_store(outdir, 4, 3)
+    finally:
+        shutil.rmtree(outdir)
+
+
+@raises(IOError)
+def test_no_store():
+    outdir = tempfile.mkdtemp()
+    try:
+        result_store.result_store(outdir, mode='r')
+    finally:
+        shutil.rmtree(outdir)
@@ -0,0 +1,50 @@
+"""
+Test the cost-aware scheduling of spectra on multiple worker processes
+
+Run with
+
+nosetests test_scheduler.py -s -v
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+import lib_dd.decomposition.scheduler as scheduler
+from test_nan_handling import _get_object_with_nans
+
+
+def test_expected_costs():
+    obj = _get_object_with_nans()
+    mask_groups = decomp_single_sl._mask_groups(obj.data)
+    costs = scheduler.expected_costs(obj.data, mask_groups)
+    # spectrum 1 has one more frequency
+    assert_equal(costs[0], costs[2])
+    assert_true(costs[1] > costs[0])
+
+    costs = scheduler.expected_costs(
+        obj.data, mask_groups, prior_iterations=[1, 2, 10])
+    assert_equal(list(np.argsort(-costs)), [2, 1, 0])
+
+
+def test_get_tasks():
+    costs = np.array([1, 1, 8, 1, 1, 4, 1, 1, 1, 1], dtype=float)
+    groups = np.zeros(10, dtype=int)
+    tasks = scheduler.get_tasks(range(10), costs, groups, 4, 3)
+    # all spectra, most expensive first, cost-balanced chunks
+    assert_equal(sorted(np.hstack(tasks).tolist()), list(range(10)))
+    assert_equal(tasks[0].tolist(), [2])
+    assert_equal(tasks[1].tolist(), [5])
+    assert_true(max(len(task) for task in tasks) <= 3)
+
+    tasks = scheduler.get_tasks(
+        range(10), costs, groups, 2, 10, contiguous=True)
+    assert_equal([task.tolist() for task in tasks],
+                 [[0, 1, 2], [3, 4, 5, 6, 7, 8, 9]])
+
+
+def test_multi_core():
+    obj = _get_object_with_nans()
+    obj.data['prep_opts']['nr_cores'] = 2
+    obj.fit_data()
+    assert_equal([result.index for result in obj.results], [0, 1, 2])
+    assert_equal(obj.results[0].frequencies.size, 24)
+    assert_equal(obj.results[1].frequencies.size, 25)
@@ -0,0 +1,83 @@
+"""
+Test the multi-core fits using shared memory for the data and the results
+
+Run with
+
+nosetests test_shared_memory.py -s -v
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.decomposition.backends as backends
+import lib_dd.decomposition.ccd_single_shared as decomp_single_shared
+from test_batch_engine import _get_ccd_single_object
+
+
+def test_shared_memory():
+    for engine in ('ndiminv', 'nnls'):
+        obj = _get_ccd_single_object()
+        obj.data['prep_opts']['engine'] = engine
+        obj.fit_data()
+        results_single = obj.results
+
+        obj.data['prep_opts']['nr_cores'] = 2
+        assert_true(obj._use_shared_memory(range(3)))
+        obj.fit_data()
+        for result_single, result in zip(results_single, obj.results):
+            assert_equal(result.index, result_single.index)
+            assert_equal(result.nr, result_single.nr)
+            np.testing.assert_allclose(result.m, result_single.m)
+            np.testing.assert_allclose(result.f, result_single.f)
+            for key, value in result_single.stat_pars.items():
+                np.testing.assert_allclose(result.stat_pars[key], value)
+            for key, value in result_single.rms_values.items():
+                np.testing.assert_allclose(result.rms_values[key], value)
+
+
+def test_start_method():
+    obj = _get_ccd_single_object()
+    obj.fit_data()
+    obj.data['prep_opts']['nr_cores'] = 2
+    original = backends.get_start_method
+    backends.get_start_method = lambda: 'spawn'
+    try:
+        # spawned workers do not inherit the shared arrays
+        assert_false(obj._use_shared_memory(range(3)))
+    finally:
+        backends.get_start_method = original
+
+
+def test_irregular_fields():
+    obj = _get_ccd_single_object()
+    obj.fit_data()
+    probe = obj.results[0]
+    layout = decomp_single_shared._get_layout(probe)
+    outputs = dict(
+        (field, decomp_single_shared.shared_array((2, ) + shape, dtype)) for
+        field, (value_type, shape, dtype) in layout.items())
+
+    # a result with two peaks does not fit into the output arrays
+    result = obj.results[1]
+    result.stat_pars['tau_peaks_all'] = [np.array([-3.0, -1.0])]
+    remainder = decomp_single_shared._store_result(
+        outputs, layout, 1, result)
+    assert_equal(set(remainder.keys()),
+                 set([('stat_pars', 'tau_peaks_all'), 'warm_start']))
+
+    restored = decomp_single_shared._get_result(
+        probe, outputs, layout, 1, remainder)
+    assert_equal(restored.stat_pars['tau_peaks_all'][0].tolist(), [-3.0, -1.0])
+    assert_equal(type(restored.nr), int)
+    np.testing.assert_allclose(
+        restored.stat_pars['m_i'][0], result.stat_pars['m_i'][0])
+
+
+def test_shared_input():
+    obj = _get_ccd_single_object()
+    obj.data['prep_opts']['nr_cores'] = 2
+    raw_data = obj.data['raw_data']
+    obj.fit_data()
+    # the main process only keeps the shared copy of the input data
+    assert_false(np.may_share_memory(obj.data['raw_data'], raw_data))
+    np.testing.assert_array_equal(obj.data['raw_data'], raw_data)
+    assert_true(np.may_share_memory(obj.data['cr_data'][1],
+                                    obj.data['raw_data']))
@@ -0,0 +1,72 @@
+"""
+Test that failed time series do not stop a dd_space_time run
+
+Run with
+
+nosetests test_space_time.py -s -v
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from nose.tools import *
+import lib_dd.config.cfg_time as cfg_time
+import lib_dd.io.journal as journal
+import lib_dd.io.result_store as result_store
+
+_src_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'src')
+sys.path.append(os.path.join(_src_dir, 'dd_time'))
+sys.path.append(os.path.join(_src_dir, 'dd_space_time'))
+import dd_space_time
+
+
+def _get_data(options):
+    # each time series holds its own number
+    sip_data = np.ones((2, 3, 4)) * np.arange(3)[np.newaxis, :, np.newaxis]
+    return {
+        'frequencies': np.logspace(-1, 2, 2),
+        'times': np.arange(2),
+        'sip_data': sip_data,
+    }
+
+
+def _fit_data(ts_data, outdir):
+    if ts_data['raw_data'][0, 0] == 1:
+        raise Exception('fit failed')
+    return ts_data['raw_data'][0, 0]
+
+
+def _get_stat_values(ts_data, ND):
+    return {'m_tot_n': np.ones((len(ts_data['times']), 1)) * ND}
+
+
+def test_failed_time_series():
+    outdir = tempfile.mkdtemp()
+    originals = (dd_space_time.get_data, dd_space_time.dd_time.fit_data,
+                 result_store.get_stat_values)
+    dd_space_time.get_data = _get_data
+    dd_space_time.dd_time.fit_data = _fit_data
+    result_store.get_stat_values = _get_stat_values
+    try:
+        options = cfg_time.cfg_time()
+        options['nr_cores'] = 1
+        dd_space_time.fit_space_time_data(options, outdir)
+
+        fit_journal = journal.completion_journal(outdir, 3)
+        fit_journal.close()
+        assert_equal(fit_journal.finished, set([0, 2]))
+        assert_equal(fit_journal.failed, set([1]))
+        assert_true('fit failed' in fit_journal.records[1]['error'])
+        assert_false(os.path.isdir(
+            os.path.join(outdir, 'fits', 'tmp_ts_1')))
+
+        store = result_store.result_store(outdir, mode='r')
+        m_tot_n = store.get_map('m_tot_n')
+        np.testing.assert_allclose(m_tot_n[[0, 2], 0], [0, 2])
+        assert_false(store.is_complete())
+    finally:
+        (dd_space_time.get_data, dd_space_time.dd_time.fit_data,
+         result_store.get_stat_values) = originals
+        shutil.rmtree(outdir)
@@ -0,0 +1,45 @@
+"""
+Test that matplotlib is only imported when something is plotted
+
+Run with
+
+nosetests test_startup.py -s -v
+"""
+import os
+import sys
+import subprocess
+from nose.tools import *
+
+_dd_single_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'src',
+    'dd_single')
+
+
+def _run(code):
+    """Run code in a fresh interpreter and return its output
+    """
+    return subprocess.check_output([sys.executable, '-c', code]).strip()
+
+
+def test_lazy_matplotlib():
+    output = _run(
+        'import lib_dd.plot as lDDp\n'
+        'import lib_dd.plot_stats\n'
+        'import lib_dd.decomposition.ccd_single\n'
+        'print(lDDp.plt is None)\n'
+    )
+    assert_equal(output, b'True')
+
+
+def test_no_matplotlib_import():
+    # the import chain of dd_single.py, including NDimInv
+    output = _run(
+        'import sys\n'
+        'sys.path.append({0!r})\n'
+        'import dd_single\n'
+        'import lib_dd.decomposition.ccd_single\n'
+        'import lib_dd.decomposition.ccd_single_stateless\n'
+        'import lib_dd.io.io_general\n'
+        "print('matplotlib' in sys.modules)\n".format(_dd_single_dir)
+    )
+    assert_equal(output, b'False')
@@ -0,0 +1,120 @@
+"""
+Test the sparse regularization operators of the dd_time engine
+lib_dd.decomposition.ccd_time
+
+Run with
+
+nosetests test_time_sparse.py -s -v
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.decomposition.ccd_time as ccd_time
+
+
+def _first_order(size):
+    R = np.zeros((size - 1, size))
+    R[:, :-1] -= np.eye(size - 1)
+    R[:, 1:] += np.eye(size - 1)
+    return R.T.dot(R)
+
+
+def test_parameter_dimension():
+    nr_timesteps, parsize = 4, 3
+    WtWm = _first_order(parsize)
+    WtWm_global = ccd_time.global_reg_matrix(WtWm, nr_timesteps, parsize)
+    dense = WtWm_global.toarray()
+    for t in range(nr_timesteps):
+        block = slice(t * parsize, (t + 1) * parsize)
+        np.testing.assert_allclose(dense[block, block], WtWm)
+    assert_equal(WtWm_global.nnz, nr_timesteps * np.count_nonzero(WtWm))
+
+
+def test_time_dimension():
+    nr_timesteps, parsize = 5, 4
+    WtWm = _first_order(nr_timesteps)
+    WtWm_global = ccd_time.global_reg_matrix(
+        WtWm, nr_timesteps, parsize, [1, 2, 3])
+    M = np.arange(nr_timesteps * parsize, dtype=float).reshape(
+        (nr_timesteps, parsize)) ** 2
+    # the model vector holds one time step after the other
+    result = WtWm_global.dot(M.flatten()).reshape(M.shape)
+    np.testing.assert_allclose(result[:, 0], 0)
+    np.testing.assert_allclose(result[:, 1:], WtWm.dot(M[:, 1:]))
+
+
+def test_block_jacobian():
+    nr_timesteps, nr_data, parsize = 3, 6, 4
+    blocks = np.random.RandomState(1).normal(
+        size=(nr_timesteps, nr_data, parsize))
+    weights = np.random.RandomState(2).uniform(
+        size=(nr_timesteps, nr_data))
+    J = ccd_time.block_jacobian(blocks, weights)
+    dense = J.toarray()
+    np.testing.assert_allclose(
+        dense, np.diag(weights.flatten()).dot(
+            ccd_time.block_jacobian(blocks).toarray()))
+    assert_equal(dense.shape, J.shape)
+
+    m = np.arange(nr_timesteps * parsize, dtype=float)
+    d = np.arange(nr_timesteps * nr_data, dtype=float)
+    np.testing.assert_allclose(J.dot(m), dense.dot(m))
+    np.testing.assert_allclose(J.rdot(d), dense.T.dot(d))
+    np.testing.assert_allclose(J.JtJ().toarray(), dense.T.dot(dense))
+    np.testing.assert_allclose(J.aslinearoperator().rmatvec(d),
+                               dense.T.dot(d))
+
+
+def _get_inversion(solver, first_order):
+    """Return a time_inversion object with random normal equations, without
+    an NDimInv object
+    """
+    nr_timesteps, parsize = 6, 4
+    inversion = ccd_time.time_inversion.__new__(ccd_time.time_inversion)
+    inversion.nr_timesteps = nr_timesteps
+    inversion.parsize = parsize
+    inversion.WtWm_f_block = _first_order(parsize)
+    inversion.WtWm_f = ccd_time.global_reg_matrix(
+        inversion.WtWm_f_block, nr_timesteps, parsize)
+
+    if first_order:
+        WtWm = _first_order(nr_timesteps)
+    else:
+        R = np.zeros((nr_timesteps - 2, nr_timesteps))
+        for i in range(nr_timesteps - 2):
+            R[i, i:i + 3] = (1, -2, 1)
+        WtWm = R.T.dot(R)
+    inversion.time_regs = []
+    inversion.WtWm_t = 0
+    for lam, parameters in ((10, [0]), (5, [1, 2, 3])):
+        selection = np.zeros(parsize)
+        selection[parameters] = 1
+        inversion.time_regs.append(
+            (lam, ccd_time.sparse.csr_matrix(WtWm), selection))
+        inversion.WtWm_t = inversion.WtWm_t + lam * \
+            ccd_time.global_reg_matrix(
+                WtWm, nr_timesteps, parsize, parameters)
+    inversion.bandwidth = 1 if first_order else 2
+    inversion.solver = solver
+    return inversion
+
+
+def test_solvers():
+    rs = np.random.RandomState(3)
+    J = ccd_time.block_jacobian(rs.normal(size=(6, 10, 4)))
+    A = J.JtJ_blocks()
+    b = rs.normal(size=(6, 4))
+    m = rs.normal(size=(6, 4))
+    for first_order in (True, False):
+        banded = _get_inversion('banded', first_order)
+        splu = _get_inversion('splu', first_order)
+        update = banded.model_update(A, b, m, 2.0)
+        np.testing.assert_allclose(
+            update, splu.model_update(A, b, m, 2.0), rtol=1e-8, atol=1e-10)
+
+        # dense normal equations
+        WtWm = (2.0 * banded.WtWm_f + banded.WtWm_t).toarray()
+        rhs = b.flatten() - WtWm.dot(m.flatten())
+        np.testing.assert_allclose(
+            update.flatten(),
+            np.linalg.solve(J.JtJ().toarray() + WtWm, rhs),
+            rtol=1e-8, atol=1e-10)
@@ -0,0 +1,31 @@
+"""
+Test warm starting the fits from the previous spectrum
+
+Run with
+
+nosetests test_warm_start.py -s -v
+"""
+import numpy as np
+from nose.tools import *
+from test_batch_engine import _get_ccd_single_object
+
+
+def test_warm_start():
+    obj = _get_ccd_single_object()
+    # three times the same spectrum
+    obj.data['cr_data'] = [obj.data['cr_data'][0]] * 3
+    obj.fit_data()
+    results_cold = obj.results
+
+    obj.data['prep_opts']['warm_start'] = True
+    obj.fit_data()
+    results_warm = obj.results
+
+    assert_true(results_warm[0].warm_start is None)
+    assert_equal(results_warm[0].nr, results_cold[0].nr)
+    for index in (1, 2):
+        assert_equal(results_warm[index].warm_start, index - 1)
+        assert_true(results_warm[index].nr < results_cold[index].nr)
+        assert_true(
+            results_warm[index].rms_values['rms_re_im_noerr'][1] <=
+            results_cold[index].rms_values['rms_re_im_noerr'][1] * 1.01)
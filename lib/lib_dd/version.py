@@ -13,26 +13,45 @@ FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along
 with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import pkg_resources
+# version string, determined on first use, see _get_version_numbers
+_versions = []
+
+
+def _get_version(names):
+    """Return the version of the first installed distribution in names.
+    importlib.metadata is used if available, as importing pkg_resources is
+    slow.
+    """
+    try:
+        from importlib import metadata
+        not_found = metadata.PackageNotFoundError
+        get_version = metadata.version
+    except ImportError:
+        import pkg_resources
+        not_found = pkg_resources.DistributionNotFound
+
+        def get_version(name):
+            return pkg_resources.get_distribution(name).version
+
+    for name in names[:-1]:
+        try:
+            return get_version(name)
+        except not_found:
+            pass
+    return get_version(names[-1])
 
 
 def _get_version_numbers():
     """Return a string containing the version numbers of geccoinv and
     dd_interface. The string is meant to be human readable.
     """
-    try:
-        geccoinv_version = pkg_resources.require('geccoinv')[0].version
-    except pkg_resources.DistributionNotFound:
-        geccoinv_version = pkg_resources.require('dd-tools')[0].version
+    if not _versions:
+        geccoinv_version = _get_version(('geccoinv', 'dd-tools'))
+        ccd_tools_version = _get_version(('ccd_tools', 'dd-tools'))
 
-    try:
-        ccd_tools_version = pkg_resources.require('ccd_tools')[0].version
-    except pkg_resources.DistributionNotFound:
-        ccd_tools_version = pkg_resources.require('dd-tools')[0].version
-
-    versions = ''.join(('geccoinv version: ',
-                        geccoinv_version,
-                        '\n',
-                        'ccd_tools version: ',
-                        ccd_tools_version))
-    return versions
+        _versions.append(''.join(('geccoinv version: ',
+                                  geccoinv_version,
+                                  '\n',
+                                  'ccd_tools version: ',
+                                  ccd_tools_version)))
+    return _versions[0]
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+"""
+Benchmark the execution backends (processes, threads) of dd_single for
+different problem sizes and numbers of cores.
+
+Synthetic spectra are fitted using the Python interface of dd_single. For
+each combination of problem size, engine, backend and number of cores the
+wall time is measured. The results are printed and saved to
+benchmark_results.dat.
+
+Usage:
+
+    python benchmark.py [nr_spectra]
+"""
+import sys
+import time
+import numpy as np
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+from lib_dd.models import ccd_res
+
+# (number of frequencies, number of relaxation times per decade)
+problem_sizes = (
+    (10, 2),
+    (25, 5),
+    (25, 20),
+    (60, 20),
+)
+engines = ('ndiminv', 'nnls')
+backends = ('processes', 'threads')
+nr_cores_list = (2, 4, 8)
+
+
+def generate_data(nr_spectra, nr_frequencies, Nd):
+    """Return frequencies and rmag_rpha data of nr_spectra synthetic spectra
+    with randomly shifted chargeability distributions
+    """
+    frequencies = np.logspace(-2, 4, nr_frequencies)
+    model = ccd_res.decomposition_resistivity(
+        {'Nd': Nd, 'tausel': 'data_ext', 'frequencies': frequencies,
+         'c': 1.0}
+    )
+    np.random.seed(5)
+    raw_data = []
+    for center in np.random.uniform(0.2, 0.8, nr_spectra):
+        m = 1e-3 * np.exp(
+            -(np.linspace(0, 1, model.tau.size) - center) ** 2 / 0.01)
+        pars = np.hstack((2, np.log10(m)))
+        remim = model.forward(pars)
+        magnitude = np.abs(remim[:, 0] - 1j * remim[:, 1])
+        phase = np.arctan2(-remim[:, 1], remim[:, 0]) * 1000
+        raw_data.append(np.hstack((magnitude, phase)))
+    return frequencies, np.array(raw_data)
+
+
+def get_object(frequencies, raw_data, Nd, engine, backend, nr_cores):
+    config = cfg_single.cfg_single()
+    config['nr_terms_decade'] = Nd
+    config['engine'] = engine
+    config['backend'] = backend
+    config['nr_cores'] = nr_cores
+    prep_opts, inv_opts = config.split_options()
+    data = {
+        'frequencies': frequencies,
+        'raw_data': raw_data,
+        'cr_data': [x.reshape((frequencies.size, 2), order='F') for x in
+                    raw_data],
+        'outdir': '.',
+        'options': config,
+        'prep_opts': prep_opts,
+        'inv_opts': inv_opts,
+    }
+    obj = ccd_single.ccd_single(config)
+    obj.data = data
+    return obj
+
+
+def benchmark(nr_spectra):
+    results = []
+    for nr_frequencies, Nd in problem_sizes:
+        frequencies, raw_data = generate_data(nr_spectra, nr_frequencies, Nd)
+        for engine in engines:
+            obj = get_object(frequencies, raw_data, Nd, engine, 'processes', 1)
+            start = time.time()
+            obj.fit_data()
+            time_single = time.time() - start
+
+            for nr_cores in nr_cores_list:
+                for backend in backends:
+                    obj = get_object(
+                        frequencies, raw_data, Nd, engine, backend, nr_cores)
+                    start = time.time()
+                    obj.fit_data()
+                    wall_time = time.time() - start
+                    results.append((
+                        nr_frequencies, Nd, engine, backend, nr_cores,
+                        wall_time, time_single / wall_time))
+                    print(
+                        'N={0:3} Nd={1:2} {2:8} {3:9} {4:2} cores: '
+                        '{5:8.2f} s, speedup {6:5.2f}'.format(*results[-1]))
+    return results
+
+
+if __name__ == '__main__':
+    nr_spectra = 200
+    if len(sys.argv) > 1:
+        nr_spectra = int(sys.argv[1])
+    results = benchmark(nr_spectra)
+    with open('benchmark_results.dat', 'w') as fid:
+        fid.write('# nr_frequencies Nd engine backend nr_cores wall_time '
+                  'speedup\n')
+        for result in results:
+            fid.write('{0} {1} {2} {3} {4} {5:.3f} {6:.3f}\n'.format(*result))
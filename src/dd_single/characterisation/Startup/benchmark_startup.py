@@ -0,0 +1,67 @@
+#!/usr/bin/python
+"""
+Measure the startup time of the dd_single modules.
+
+Each module is imported in a fresh interpreter (as in each new worker process
+on platforms without fork, and for each call of dd_single.py). The import
+time and whether matplotlib was imported are printed and saved to
+startup_times.dat.
+
+Usage:
+
+    python benchmark_startup.py [nr_repetitions]
+"""
+import sys
+import subprocess
+import numpy as np
+
+modules = (
+    'numpy',
+    'NDimInv',
+    'lib_dd.models.ccd_res',
+    'lib_dd.decomposition.ccd_single',
+    'lib_dd.io.io_general',
+    'lib_dd.plot',
+    'NDimInv.plot_helper',
+)
+
+code = '''
+import sys
+import time
+start = time.time()
+import {0}
+duration = time.time() - start
+start = time.time()
+import lib_dd.version
+lib_dd.version._get_version_numbers()
+print(duration, time.time() - start, int('matplotlib' in sys.modules))
+'''
+
+
+def measure(module, nr_repetitions):
+    """Return the mean import time of the module, the time needed to
+    determine the version numbers afterwards, and if matplotlib was imported
+    """
+    results = []
+    for i in range(nr_repetitions):
+        output = subprocess.check_output(
+            [sys.executable, '-c', code.format(module)])
+        results.append([float(x) for x in output.split()])
+    return np.mean(results, axis=0)
+
+
+if __name__ == '__main__':
+    nr_repetitions = 5
+    if len(sys.argv) > 1:
+        nr_repetitions = int(sys.argv[1])
+
+    with open('startup_times.dat', 'w') as fid:
+        fid.write('# module import_time[s] version_time[s] matplotlib\n')
+        for module in modules:
+            import_time, version_time, matplotlib = measure(
+                module, nr_repetitions)
+            print('{0:35} {1:6.3f} s (version: {2:6.3f} s), '
+                  'matplotlib: {3}'.format(
+                      module, import_time, version_time, bool(matplotlib)))
+            fid.write('{0} {1:.4f} {2:.4f} {3:.0f}\n'.format(
+                module, import_time, version_time, matplotlib))
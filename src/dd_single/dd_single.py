@@ -24,7 +24,6 @@ import logging
 logging.basicConfig(level=logging.INFO)
 import os
 import shutil
-from NDimInv.plot_helper import *
 import lib_dd.io.io_general as iog
 import lib_dd.config.cfg_single as cfg_single
 import lib_dd.interface as lDDi
@@ -51,18 +50,12 @@ def main():
     # fit the data
     ccds_object.fit_data()
 
-    # for the fitting process, change to the output_directory
-    pwd = os.getcwd()
-    os.chdir(options['output_dir'])
-
     iog.save_fit_results(
         ccds_object.data,
-        ccds_object.results
+        ccds_object.results,
+        options['output_dir'],
     )
 
-    # go back to initial working directory
-    os.chdir(pwd)
-
     # move temp directory to output directory
     if options['use_tmp']:
         if os.path.isdir(outdir_real):
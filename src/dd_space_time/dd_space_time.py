@@ -39,12 +39,21 @@ Plan
 * danach: führe die Ergebnisse zusammen
 """
 import os
-import numpy as np
 import glob
 import shutil
+import time
+import logging
+import traceback
+import numpy as np
 import dd_time
-import dd_single
 import lib_dd.interface as lDDi
+import lib_dd.config.cfg_time as cfg_time
+import lib_dd.io.journal as journal
+import lib_dd.io.result_store as result_store
+import lib_dd.decomposition.backends as backends
+import lib_dd.decomposition.scheduler as scheduler
+
+logger = logging.getLogger('dd_space_time')
 
 
 def _get_cr_data(options):
@@ -54,12 +63,13 @@ def _get_cr_data(options):
     """
     # read index
     # the data_index holds relative file paths
-    dirname = os.path.dirname(options.data_file)
+    dirname = os.path.dirname(options['data_file'])
     if dirname == '':
         dirname = '.'
 
-    with open(options.data_file, 'r') as fid:
-        data_index = [dirname + os.sep + x.strip() for x in fid.readlines()]
+    with open(options['data_file'], 'r') as fid:
+        data_index = [os.path.join(dirname, x.strip()) for x in
+                      fid.readlines()]
 
     # read SIP data
     time_rmag = []
@@ -95,62 +105,181 @@ def get_data(options):
     return data
 
 
+def _get_ts_dirname(ts_nr, nr_digits):
+    """Return the name of the result directory of time series ts_nr
+    """
+    return 'tmp_ts_{0:0{1}}'.format(ts_nr, nr_digits)
+
+
+def _scan_result_dirs(outdir, nr_digits):
+    """Return the numbers of all time series with a result directory
+    """
+    results = glob.glob(os.path.join(outdir, 'fits', 'tmp_ts_*'))
+    return set(
+        int(os.path.basename(x)[-nr_digits:]) for x in results if
+        os.path.isdir(x)
+    )
+
+
 def get_fit_status(outdir, nr_ts):
-    """Return the fit status, i.e. how many times series where fitted yet. This
-    is determined by the directory with the hightest number in the format
-    "tmp_ts_%.Xi", where X is the number of digits of the maximum time series
-    number
+    """Return the fit status, i.e. the completion journal of the output
+    directory, which records each fitted (or failed) time series. Resuming
+    from the journal only reads the records of the completed time series.
+
+    Output directories without journal (e.g. of older versions) are scanned
+    once for result directories in the format "tmp_ts_%.Xi", where X is the
+    number of digits of the maximum time series number. The time series
+    found are added to the new journal.
 
     Parameters
     ----------
     outdir: output directoy
     nr_ts: number of time series
+
+    Returns
+    -------
+    fit_journal: completion journal
+    nr_digits: number of digits X
     """
     nr_digits = int(np.floor(np.log10(nr_ts)) + 1)
-    results = sorted(glob.glob(outdir + '/fits/tmp_ts_*'))
-    result_dirs = [x for x in results if os.path.isdir(x)]
-    if not result_dirs:
-        return -1, nr_digits
-    else:
-        max_result_nr = int(os.path.basename(result_dirs[-1])[-nr_digits:])
-    return max_result_nr, nr_digits
+    fit_journal = journal.completion_journal(outdir, nr_ts)
+    if not fit_journal.existed:
+        for ts_nr in sorted(_scan_result_dirs(outdir, nr_digits)):
+            fit_journal.append(
+                ts_nr, 'done',
+                location=os.path.join(
+                    'fits', _get_ts_dirname(ts_nr, nr_digits)))
+    return fit_journal, nr_digits
+
+
+def _fit_time_series(task):
+    """Fit one time series in its own temporary directory, and publish the
+    results by renaming the directory to its final name (atomic on the same
+    file system). A failed fit does not stop the other fits.
+
+    Returns
+    -------
+    ts_nr: number of the time series
+    duration: fit time in seconds
+    values: statistical parameters for the result store (None for failed
+            fits), see lib_dd.io.result_store.get_stat_values
+    error: None, or the traceback of a failed fit
+    """
+    ts_nr, ts_data, temp_dir, ts_dir = task
+    start = time.time()
+    if os.path.isdir(temp_dir):
+        shutil.rmtree(temp_dir)
+    os.makedirs(temp_dir)
+    try:
+        ND = dd_time.fit_data(ts_data, temp_dir)
+        values = result_store.get_stat_values(ts_data, ND)
+    except Exception:
+        return ts_nr, time.time() - start, None, traceback.format_exc()
+
+    if os.path.isdir(ts_dir):
+        shutil.rmtree(ts_dir)
+    os.rename(temp_dir, ts_dir)
+    return ts_nr, time.time() - start, values, None
+
+
+def _get_tasks(data, options, ts_numbers, fits_dir, nr_digits):
+    """Generate the fit tasks of the given time series for _fit_time_series
+    """
+    prep_opts, inv_opts = options.split_options()
+    # the time series themselves are distributed to the cores
+    prep_opts['nr_cores'] = 1
+    for ts_nr in ts_numbers:
+        ts_data = {
+            'frequencies': data['frequencies'],
+            'times': data['times'],
+            'raw_data': data['sip_data'][:, ts_nr, :],
+            'raw_format': options['data_format'],
+            # only the output format is needed to save the results
+            'options': {'output_format': options['output_format']},
+            'prep_opts': prep_opts,
+            # dd_time modifies the inversion options
+            'inv_opts': inv_opts.copy(),
+        }
+        ts_data['cr_data'] = ts_data['raw_data']
+        dirname = _get_ts_dirname(ts_nr, nr_digits)
+        yield (
+            ts_nr, ts_data,
+            os.path.join(fits_dir, dirname.replace('tmp_ts_', 'tmp_fit_')),
+            os.path.join(fits_dir, dirname)
+        )
 
 
 def fit_space_time_data(options, outdir):
     """Fit each time series separately by using the corresponding fit function
-    from dd_time
+    from dd_time. The results of time series X are stored in the directory
+    fits/tmp_ts_X of the output directory. Time series which were already
+    fitted are skipped, time series which failed are fitted again. Each
+    completed time series is recorded in the completion journal (see
+    get_fit_status). The statistical parameters of all time series are
+    collected in the result store of the output directory (see
+    lib_dd.io.result_store), which is used by ddpst.py.
+
+    With multiple cores (--nr_cores), the time series are fitted in parallel
+    by worker processes. Each fit runs in its own temporary directory
+    fits/tmp_fit_X, which is renamed to fits/tmp_ts_X when the fit is
+    finished.
     """
-    prep_opts, inv_opts = dd_time.split_options(options)
+    # fail before fitting any time series
+    dd_time.check_options(options.split_options()[0])
     data = get_data(options)
     max_ts_nr = data['sip_data'].shape[1]
-    fit_status, nr_digits = get_fit_status(outdir, nr_ts=max_ts_nr)
-
-    # for the fitting process, change to the output_directory
-    pwd = os.getcwd()
-    os.chdir(outdir)
-    if not os.path.isdir('fits'):
-        os.makedirs('fits')
-    os.chdir('fits')
-    pwd_outdir = os.getcwd()
-    for ts_nr in xrange(fit_status, max_ts_nr):
-        print('Fitting time series {0}/{1}'.format(ts_nr + 1, max_ts_nr))
-        # fit in temp directory
-        temp_dir = 'tmp_fit'
-        if os.path.isdir(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir)
-        os.chdir(temp_dir)
-        data['cr_data'] = data['sip_data'][:, ts_nr, :].squeeze()
-        dd_time.fit_sip_data(data, prep_opts, inv_opts)
-        # fit_data(data, prep_opts, inv_opts)
-        # go back to initial working directory
-        os.chdir(pwd_outdir)
-        ts_dir = r'tmp_ts_{0:0' + '{0}'.format(nr_digits) + '}'
-        ts_dir = ts_dir.format(ts_nr)
-        shutil.move(temp_dir, ts_dir)
-    os.chdir(pwd)
+    fit_journal, nr_digits = get_fit_status(outdir, nr_ts=max_ts_nr)
+    finished = fit_journal.finished
+    ts_numbers = [x for x in range(0, max_ts_nr) if x not in finished]
+    logger.info(
+        ('{0} of {1} time series already fitted, fitting {2} ({3} of them '
+         'failed before)').format(
+            len(finished), max_ts_nr, len(ts_numbers),
+            len(fit_journal.failed)))
+
+    fits_dir = os.path.join(outdir, 'fits')
+    if not os.path.isdir(fits_dir):
+        os.makedirs(fits_dir)
+
+    tasks = _get_tasks(data, options, ts_numbers, fits_dir, nr_digits)
+    nr_cores = options['nr_cores']
+    if nr_cores == 1:
+        task_results = (_fit_time_series(task) for task in tasks)
+    else:
+        p = backends.get_pool({'nr_cores': nr_cores})
+        task_results = scheduler.imap(p, nr_cores, _fit_time_series, tasks)
+
+    store = result_store.result_store(
+        outdir, max_ts_nr, data['sip_data'].shape[0])
+    try:
+        for nr, (ts_nr, duration, values, error) in enumerate(task_results):
+            if error is None:
+                # store first: the journal record marks the pixel as done
+                store.write(ts_nr, values)
+                fit_journal.append(
+                    ts_nr, 'done', duration,
+                    location=os.path.join(
+                        'fits', _get_ts_dirname(ts_nr, nr_digits)))
+                print('Fitted time series {0} ({1}/{2}) in {3:.1f} s'.format(
+                    ts_nr + 1, nr + 1, len(ts_numbers), duration))
+            else:
+                fit_journal.append(ts_nr, 'failed', duration, error=error)
+                logger.error('Fit of time series {0} failed:\n{1}'.format(
+                    ts_nr + 1, error))
+    finally:
+        fit_journal.close()
+
+    failed = sorted(fit_journal.failed)
+    if failed:
+        logger.error(
+            ('{0} time series failed: {1}. They are fitted again when '
+             'resuming this run').format(
+                len(failed), [x + 1 for x in failed]))
+
 
 if __name__ == '__main__':
-    options = dd_time.handle_cmd_options()
-    outdir = dd_single.get_output_dir(options)
-    fit_space_time_data(options, outdir)
+    options = cfg_time.cfg_time()
+    options.parse_cmd_arguments()
+    options.check_input_files(['times', ])
+    outdir_real, options = lDDi.create_output_dir(options)
+    fit_space_time_data(options, options['output_dir'])
@@ -23,6 +23,7 @@ import logging
 logging.basicConfig(level=logging.INFO)
 import numpy as np
 import NDimInv
+import NDimInv.main
 import NDimInv.regs as RegFuncs
 import NDimInv.reg_pars as LamFuncs
 import sip_formats.convert as SC
@@ -32,7 +33,11 @@ import lib_dd.plot as lDDp
 import lib_dd.conductivity.model as cond_model
 from lib_dd.models import ccd_res
 import lib_dd.config.cfg_time as cfg_time
-import lib_dd.io.general as iog
+import lib_dd.decomposition.ccd_nnls as ccd_nnls
+import lib_dd.decomposition.ccd_time as ccd_time
+import lib_dd.decomposition.backends as backends
+import lib_dd.decomposition.scheduler as scheduler
+import lib_dd.io.io_general as iog
 
 
 def _get_times(options):
@@ -93,11 +98,12 @@ def get_data_dd_time(options):
     return data
 
 
-def _get_fit_datas(data):
+def _get_fit_datas(data, outdir='.'):
 
     # add frequencies to inv_opts
     data['inv_opts']['frequencies'] = data['frequencies'].copy()
-    data['inv_opts']['global_prefix'] = 'times_'
+    # NDimInv writes all plots to files starting with the global prefix
+    data['inv_opts']['global_prefix'] = os.path.join(outdir, 'times_')
     if('norm_factors' in data):
         data['inv_opts']['norm_factors'] = data['norm_factors']
     else:
@@ -114,17 +120,42 @@ def _get_fit_datas(data):
 
 
 # @profile
-def fit_data(data):
+def check_options(prep_opts):
+    """Raise an exception for option combinations which are not possible
     """
-    Call the fit routine for each pixel
+    engine = prep_opts['engine']
+    # the nnls and sparse engines only keep the final iteration
+    single_iteration = engine == 'nnls' or (
+        engine == 'sparse' and ccd_time.is_supported(prep_opts))
+    if single_iteration and (prep_opts['plot_it_spectra'] or
+                             prep_opts['plot_lambda'] is not None):
+        raise Exception(
+            '--plot_it_spectra and --plot_lambda are not possible with '
+            '--engine {0}'.format(engine))
+    # windowed fits are stitched from several inversions
+    if prep_opts['window'] and (prep_opts['plot_it_spectra'] or
+                                prep_opts['plot_lambda'] is not None):
+        raise Exception(
+            '--plot_it_spectra and --plot_lambda are not possible with '
+            '--window')
+
+
+def fit_data(data, outdir='.'):
     """
-    data_struct = _get_fit_datas(data)
+    Call the fit routine for each pixel. Plots and results are written to the
+    directory outdir. Return the NDimInv object of the fit.
+    """
+    check_options(data['prep_opts'])
+    data_struct = _get_fit_datas(data, outdir)
 
     # fit the time-lapse data
     ND = fit_one_time_series(data_struct)
 
     # results now contains one or more ND objects
-    iog.save_fit_results(data, ND)
+    iog.save_fit_results(data, ND, outdir)
+    if getattr(ND, 'time_step_results', None) is not None:
+        save_time_step_results(ND.time_step_results, outdir)
+    return ND
 
 
 def _prepare_ND_object(data):
@@ -201,6 +232,10 @@ def _prepare_ND_object(data):
     reg_object = RegFuncs.SmoothingFirstOrder(decouple=[0, ])
     ND.Model.add_regularization(0, reg_object, lam_obj)
 
+    if nr_timesteps == 1:
+        # no time regularization for single time steps
+        return ND
+
     # # add time regularization
     # rho0 regularization
     if(data['prep_opts']['time_weighting_rho0'] or
@@ -252,12 +287,27 @@ def _prepare_ND_object(data):
     return ND
 
 
-def fit_one_time_series(data):
-    ND = _prepare_ND_object(data)
-    ND.run_inversion()
-    final_iteration = ND.iterations[-1]
+def _run_inversion(data, ND):
+    """Run the inversion of a prepared NDimInv object with the selected
+    engine
+    """
+    engine = data['prep_opts']['engine']
+    if engine == 'sparse' and not ccd_time.is_supported(data['prep_opts']):
+        print('The sparse engine does not support individual lambdas, '
+              'using the ndiminv engine')
+        engine = 'ndiminv'
+
+    if engine == 'nnls':
+        ccd_nnls.fit_ND(ND, data['prep_opts']['f_lambda'])
+    elif engine == 'sparse':
+        ccd_time.fit_ND(ND, data['prep_opts'])
+    else:
+        ND.run_inversion()
 
-    # renormalize data
+
+def _renormalize(data, ND):
+    """Apply the normalization factors to the final iteration"""
+    final_iteration = ND.iterations[-1]
     if data['inv_opts']['norm_factors'] is not None:
         parsize = final_iteration.Model.M_base_dims[0][1]
         spectrum_nr = 0
@@ -272,10 +322,267 @@ def fit_one_time_series(data):
             final_iteration.Data.D[:, :, spectrum_nr] /= norm_fac
             spectrum_nr += 1
 
+
+def fit_one_time_series(data):
+    if _is_decoupled(data):
+        ND = fit_decoupled(data)
+    elif _use_windows(data):
+        ND = fit_windowed(data)
+    else:
+        ND = _prepare_ND_object(data)
+        _run_inversion(data, ND)
+
+    # renormalize data
+    _renormalize(data, ND)
+
     call_fit_functions(data, ND)
     return ND
 
 
+def _use_windows(data):
+    window = data['prep_opts'].get('window')
+    return bool(window) and window < data['data'].shape[0]
+
+
+def get_windows(nr_timesteps, window, overlap):
+    """Return the (start, end) time step indices of windows of window time
+    steps, covering all time steps. Neighbouring windows share (at least)
+    overlap time steps: the last window is moved back to hold window time
+    steps.
+    """
+    if overlap < 0 or overlap >= window:
+        raise Exception(
+            'The window overlap must be between 0 and the window size - 1')
+    windows = [(0, min(window, nr_timesteps))]
+    while windows[-1][1] < nr_timesteps:
+        start = min(windows[-1][1] - overlap, nr_timesteps - window)
+        windows.append((start, start + window))
+    return windows
+
+
+def _get_window_data(data, start, end):
+    """Return the fit data dict (see _get_fit_datas) of the time steps start
+    to end - 1
+    """
+    window_data = dict(data)
+    window_data['data'] = data['data'][start:end]
+    window_data['times'] = data['times'][start:end]
+    window_data['prep_opts'] = data['prep_opts'].copy()
+    window_data['inv_opts'] = data['inv_opts'].copy()
+    if data['inv_opts']['norm_factors'] is not None:
+        window_data['inv_opts']['norm_factors'] = \
+            data['inv_opts']['norm_factors'][start:end]
+    return window_data
+
+
+def _apply_boundary_model(window_data, ND, previous):
+    """Start the inversion of a window from the final model of the previous
+    window: the time steps shared with the previous window start from its
+    final parameters, the following time steps from its last chargeabilities
+    (m_i). The lambda search starts at its final frequency lambda.
+
+    Parameters
+    ----------
+    window_data: fit data dict of the window
+    ND: NDimInv object of the window, prepared by _prepare_ND_object
+    previous: (m, lams) of the previous window, with m the final parameters of
+              the shared time steps (nr_shared x K)
+    """
+    m_shared, lams = previous
+    m0 = np.array(ND.Model.m0, dtype=float).reshape(
+        (window_data['data'].shape[0], -1))
+    nr_shared = m_shared.shape[0]
+    m0[:nr_shared] = m_shared
+    m0[nr_shared:, 1:] = m_shared[-1, 1:]
+    ND.Model.m0 = m0.flatten()
+
+    if window_data['prep_opts']['f_lambda'] is None:
+        window_data['prep_opts']['f_lam0'] = lams[0]
+        lam_obj = ND.Model.regularizations[0][0][1]
+        if isinstance(lam_obj, LamFuncs.SearchLambda):
+            lam_obj.lam0_obj = LamFuncs.Lam0_Fixed(lams[0])
+
+
+def _fit_window(task):
+    """Fit one window of time steps
+
+    Parameters
+    ----------
+    task: (window number, fit data dict of the window, previous), see
+          _apply_boundary_model for previous (None: default starting model)
+
+    Returns
+    -------
+    window number, final parameters (nr_timesteps x K), final lambdas, number
+    of iterations
+    """
+    window_nr, window_data, previous = task
+    ND = _prepare_ND_object(window_data)
+    if previous is not None:
+        _apply_boundary_model(window_data, ND, previous)
+    _run_inversion(window_data, ND)
+    final_iteration = ND.iterations[-1]
+    m = np.array(final_iteration.m).reshape(
+        (window_data['data'].shape[0], -1))
+    return window_nr, m, list(final_iteration.lams), final_iteration.nr
+
+
+def _fit_windows(data, windows, carry_forward):
+    """Fit the given windows of time steps (see _fit_window). On one core
+    (prep_opts['nr_cores']) the windows are fitted one after another. If
+    carry_forward is True, each window then starts from the final model of
+    the previous window (see _apply_boundary_model). On multiple cores the
+    windows are fitted in parallel, each starting from the default starting
+    model.
+
+    Returns
+    -------
+    results: for each window a tuple (final parameters, lambdas, number of
+             iterations)
+    """
+    nr_cores = data['prep_opts'].get('nr_cores', 1)
+    results = [None] * len(windows)
+    if nr_cores == 1:
+        previous = None
+        for window_nr, (start, end) in enumerate(windows):
+            task = (window_nr, _get_window_data(data, start, end), previous)
+            results[window_nr] = _fit_window(task)[1:]
+            if carry_forward and window_nr + 1 < len(windows):
+                next_start = windows[window_nr + 1][0]
+                m, lams, nr = results[window_nr]
+                previous = (m[next_start - start:], lams)
+    else:
+        tasks = [(window_nr, _get_window_data(data, start, end), None) for
+                 window_nr, (start, end) in enumerate(windows)]
+        p = backends.get_pool({'nr_cores': nr_cores})
+        for task_result in scheduler.imap(p, nr_cores, _fit_window, tasks):
+            results[task_result[0]] = task_result[1:]
+    return results
+
+
+def _get_keep_ranges(windows):
+    """Return the (start, end) time step indices of each window which are
+    kept in the stitched result: each overlap of two windows is split in the
+    middle
+    """
+    keep_ranges = []
+    for window_nr, (start, end) in enumerate(windows):
+        keep_start = start
+        if window_nr > 0:
+            keep_start = (start + windows[window_nr - 1][1]) // 2
+        keep_end = end
+        if window_nr + 1 < len(windows):
+            keep_end = (windows[window_nr + 1][0] + end) // 2
+        keep_ranges.append((keep_start, keep_end))
+    return keep_ranges
+
+
+def _stitch_windows(data, windows, results):
+    """Stitch the results of the windows to one NDimInv object of all time
+    steps. Each overlap of two windows is split in the middle (see
+    _get_keep_ranges).
+
+    The stitched result is stored as the only iteration of the returned
+    NDimInv object. Its iteration number is the maximum number of iterations
+    of all windows. Its frequency lambda is that of the windows if they all
+    used the same lambda, otherwise nan. The window, frequency lambda and
+    number of iterations of each time step are stored in
+    ND.time_step_results (see save_time_step_results).
+    """
+    m_parts = []
+    time_step_results = []
+    keep_ranges = _get_keep_ranges(windows)
+    for window_nr, (start, end) in enumerate(windows):
+        keep_start, keep_end = keep_ranges[window_nr]
+        m, lams, nr = results[window_nr]
+        m_parts.append(m[keep_start - start:keep_end - start])
+        time_step_results += [
+            (window_nr, lams[0], nr)] * (keep_end - keep_start)
+
+    ND = _prepare_ND_object(data)
+    it = NDimInv.main.Iteration(
+        max(x[2] for x in results), ND.Data, ND.Model, ND.RMS, ND.settings)
+    it.m = np.vstack(m_parts).flatten()
+    it.f = ND.Model.f(it.m)
+    f_lambdas = set(x[1][0] for x in results)
+    if len(f_lambdas) == 1:
+        f_lambda = f_lambdas.pop()
+    else:
+        f_lambda = np.nan
+    it.lams = [
+        f_lambda,
+        data['prep_opts']['t_rho0_lambda'],
+        data['prep_opts']['t_m_i_lambda'],
+    ]
+    ND.iterations = [it]
+    ND.time_step_results = np.array(time_step_results)
+    return ND
+
+
+def save_time_step_results(time_step_results, directory='.'):
+    """Save the window, frequency lambda and number of iterations of each time
+    step of a stitched fit (see _stitch_windows) to the file
+    time_step_lambdas.dat of the given directory
+    """
+    filename = os.path.join(directory, 'time_step_lambdas.dat')
+    with open(filename, 'w') as fid:
+        fid.write('# window lambda nr_iterations\n')
+        np.savetxt(fid, time_step_results, fmt='%i %.10e %i')
+
+
+def fit_windowed(data):
+    """Invert overlapping windows of prep_opts['window'] time steps
+    (overlapping by prep_opts['window_overlap'] time steps), and stitch the
+    results to one NDimInv object of all time steps. The memory needed by the
+    inversion is bounded by the window size.
+
+    On one core (prep_opts['nr_cores']), the windows are fitted one after
+    another, and each window starts from the final model of the previous
+    window (see _apply_boundary_model). On multiple cores the windows are
+    fitted in parallel.
+    """
+    nr_timesteps = data['data'].shape[0]
+    windows = get_windows(
+        nr_timesteps, data['prep_opts']['window'],
+        data['prep_opts']['window_overlap'])
+    print('Fitting {0} windows of {1} time steps'.format(
+        len(windows), data['prep_opts']['window']))
+    results = _fit_windows(data, windows, carry_forward=True)
+    return _stitch_windows(data, windows, results)
+
+
+def _is_decoupled(data):
+    """Return True if the time steps can be fitted independently: there is
+    no time regularization, and no individual lambdas are used. The nnls
+    engine already fits each time step separately. The iteration plots
+    (--plot_it_spectra, --plot_lambda) need the iterations of one joint
+    inversion, which is then used instead.
+    """
+    prep_opts = data['prep_opts']
+    return (data['data'].shape[0] > 1 and
+            prep_opts['engine'] != 'nnls' and
+            prep_opts['t_rho0_lambda'] == 0 and
+            prep_opts['t_m_i_lambda'] == 0 and
+            not prep_opts['individual_lambdas'] and
+            not prep_opts['plot_it_spectra'] and
+            prep_opts['plot_lambda'] is None)
+
+
+def fit_decoupled(data):
+    """Fit each time step independently (in parallel on multiple cores, see
+    prep_opts['nr_cores']), and stitch the results to one NDimInv object of
+    all time steps. Used if there is no time regularization, as the time
+    steps are then independent. With the lambda search, the frequency lambda
+    is searched for each time step (see save_time_step_results).
+    """
+    nr_timesteps = data['data'].shape[0]
+    print('No time regularization: fitting {0} time steps '
+          'independently'.format(nr_timesteps))
+    windows = [(x, x + 1) for x in range(nr_timesteps)]
+    results = _fit_windows(data, windows, carry_forward=False)
+    return _stitch_windows(data, windows, results)
+
+
 def call_fit_functions(data, ND):
     if data['prep_opts']['plot']:
         print('Plotting final iteration')
@@ -298,10 +605,4 @@ if __name__ == '__main__':
     outdir_real, options = lDDi.create_output_dir(options)
 
     data = get_data_dd_time(options)
-
-    # for the fitting process, change to the output_directory
-    pwd = os.getcwd()
-    os.chdir(options['output_dir'])
-    fit_data(data)
-    # go back to initial working directory
-    os.chdir(pwd)
+    fit_data(data, options['output_dir'])
@@ -0,0 +1,25 @@
+#!/bin/bash
+# Compare the joint inversion of all time steps with windowed inversions
+# (--window), fitted one after another (starting from the previous window),
+# and in parallel
+
+datadir="../../TimeRegularization/02_linear/data"
+
+function dd
+{
+    outdir="$1"
+    additional_options="$2"
+    test -d ${outdir} && rm -r ${outdir}
+    dd_time.py -f ${datadir}/frequencies.dat --times ${datadir}/times.dat\
+        -d ${datadir}/data.dat\
+        -o ${outdir}\
+        --f_lambda 1\
+        --tm_i_lambda 5\
+        --tmi_first_order\
+        ${additional_options}
+    ddpt.py --plot_stats -i "${outdir}"
+}
+
+dd "results_joint" ""
+dd "results_windows" "--window 4 --window_overlap 2"
+dd "results_windows_parallel" "--window 4 --window_overlap 2 -c 2"
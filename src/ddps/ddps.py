@@ -28,17 +28,15 @@ Planned features:
 """
 # from memory_profiler import *
 import json
-from multiprocessing import Pool
 import shutil
 from optparse import OptionParser
 import os
 import glob
 import numpy as np
-from NDimInv.plot_helper import *
-import NDimInv.elem as elem
 import NDimInv
 import lib_dd.plot as lDDp
 import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+import lib_dd.decomposition.backends as backends
 import lib_dd.io.io_general as iog
 
 
@@ -185,9 +183,9 @@ def _add_dd_grid_plot_opts(parser):
 
 def load_data(options):
     # load data files
-    pwd = os.getcwd()
-    os.chdir(options.result_dir + '/stats_and_rms')
-    result_files_raw = glob.glob('*.dat')
+    stats_dir = os.path.join(options.result_dir, 'stats_and_rms')
+    result_files_raw = [os.path.basename(x) for x in
+                        glob.glob(os.path.join(stats_dir, '*.dat'))]
 
     result_files_filtered = []
     for filename in result_files_raw:
@@ -202,9 +200,8 @@ def load_data(options):
     data = {}
     for filename in result_files_filtered:
         key = filename[:-12]
-        subdata = np.loadtxt(filename)
+        subdata = np.loadtxt(os.path.join(stats_dir, filename))
         data[key] = subdata
-    os.chdir(pwd)
 
     data = filter_data(data, options)
     return data
@@ -244,23 +241,25 @@ def plot_to_grid(options):
     """
     Plot statistics to grid
     """
+    # matplotlib is only imported when plotting
+    from NDimInv.plot_helper import plt
+    import NDimInv.elem as elem
     data = load_data(options)
-    pwd = os.getcwd()
 
     # plot files
     elem.load_elem_file(options.elem_file)
     elem.load_elec_file(options.elec_file)
-    outdir = options.result_dir + '/plots_stats_grid'
+    outdir = os.path.join(options.result_dir, 'plots_stats_grid')
     if(not os.path.isdir(outdir)):
         os.makedirs(outdir)
-    os.chdir(outdir)
     nr_elements = len(elem.element_type_list[0])
     for key in sorted(data.keys()):
         print('Plotting {0}'.format(key))
         # set limits
         if(data[key].size != nr_elements):
             # check if this result dir was previously filtered
-            remaining_indices_file = '../remaining_indices.dat'
+            remaining_indices_file = os.path.join(
+                options.result_dir, 'remaining_indices.dat')
 
             if(os.path.isfile(remaining_indices_file)):
                 print('Filtered data set')
@@ -301,10 +300,10 @@ def plot_to_grid(options):
         fig, ax = plt.subplots(1, 1, figsize=(6, 4))
         elem.plot_element_data_to_ax(cid, ax, scale=scale)
 
-        fig.savefig(key + '.png', bbox_inches='tight', dpi=300)
+        fig.savefig(os.path.join(outdir, key + '.png'), bbox_inches='tight',
+                    dpi=300)
         plt.close(fig)
         del(fig)
-    os.chdir(pwd)
 
 
 def _get_ND(subdata):
@@ -346,21 +345,23 @@ def recreate_ND_obj_list(result_dir, indices=None, nr_cpus=1):
     -------
     ND_list : list with ND objects
     """
-    pwd = os.getcwd()
-    os.chdir(result_dir)
+    def filename(name):
+        return os.path.join(result_dir, name)
+
     # get settings
-    with open('inversion_options.json', 'r') as fid:
+    with open(filename('inversion_options.json'), 'r') as fid:
         inv_opts = json.load(fid)
 
-    frequencies = np.loadtxt('frequencies.dat')
+    frequencies = np.loadtxt(filename('frequencies.dat'))
 
-    data_format = open('data_format.dat').readline().strip()
+    with open(filename('data_format.dat'), 'r') as fid:
+        data_format = fid.readline().strip()
     prep_opts = {}
     prep_opts['data_format'] = data_format
     # now we need a list with spectra
     pre_data = {}
     data_list = []
-    with open('data.dat', 'r') as fid:
+    with open(filename('data.dat'), 'r') as fid:
         for line in fid.readlines():
             subdata = np.fromstring(line.strip(), sep=' ')
             subdata = subdata.reshape((int(subdata.size / 2), 2), order='F')
@@ -376,16 +377,19 @@ def recreate_ND_obj_list(result_dir, indices=None, nr_cpus=1):
     data['inv_opts'] = inv_opts
     data['cr_data'] = data_list
 
-    data['outdir'] = os.getcwd()
+    # plots of the recreated iterations are written to the result directory
+    data['outdir'] = os.path.abspath(result_dir)
 
-    fit_datas = decomp_single_sl._get_fit_datas(data)
+    fit_datas = list(decomp_single_sl._get_fit_datas(data))
 
     # # spectrum specific data ##
-    lambdas = np.atleast_1d(np.loadtxt('lambdas.dat'))
+    lambdas = np.atleast_1d(np.loadtxt(filename('lambdas.dat')))
     # convert to list
     lambdas = [x for x in lambdas]
-    rho0 = np.atleast_1d(np.loadtxt('stats_and_rms/rho0_results.dat'))
-    m_i = np.atleast_2d(np.loadtxt('stats_and_rms/m_i_results.dat'))
+    rho0 = np.atleast_1d(np.loadtxt(
+        filename(os.path.join('stats_and_rms', 'rho0_results.dat'))))
+    m_i = np.atleast_2d(np.loadtxt(
+        filename(os.path.join('stats_and_rms', 'm_i_results.dat'))))
     # #  ##
 
     ND_list = []
@@ -414,10 +418,9 @@ def recreate_ND_obj_list(result_dir, indices=None, nr_cpus=1):
     if(nr_cpus == 1):
         ND_list = [x for x in map(_get_ND, data_list)]
     else:
-        p = Pool(nr_cpus)
+        p = backends.get_pool({'nr_cores': nr_cpus})
         ND_list = p.map(_get_ND, data_list)
 
-    os.chdir(pwd)
     return ND_list, total_nr_spectra
 
 
@@ -431,9 +434,9 @@ def plot_iterations(options):
         options.result_dir + '/nr_iterations.dat').size
     indices = extract_indices_from_range_str(options.spec_ranges,
                                              total_nr_spectra)
+    # the plots are written to the result directory, see
+    # recreate_ND_obj_list
     ND_list, _ = recreate_ND_obj_list(options.result_dir, indices)
-    pwd = os.getcwd()
-    os.chdir(options.result_dir)
     total_nr = len(ND_list)
     for nr, ND in enumerate(ND_list):
         print('Plotting {0} of {1}'.format(nr + 1, total_nr))
@@ -444,7 +447,6 @@ def plot_iterations(options):
             ND.iterations[-1].plot()
         if(options.plot_reg_strength):
             ND.iterations[-1].plot_reg_strengths()
-    os.chdir(pwd)
 
 
 def extract_indices_from_range_str(filter_string, max_index=None):
@@ -584,11 +586,11 @@ def save_filter_results(options, remaining_indices, deleted_indices, ND_list):
     # copy inversion options files
     shutil.copy(options.result_dir + '/inversion_options.json',
                 options.output_dir)
-    pwd = os.getcwd()
-    os.chdir(options.output_dir)
     # save filter_mask.dat
-    np.savetxt('remaining_indices.dat', remaining_indices, fmt='%i')
-    np.savetxt('deleted_indices.dat', deleted_indices, fmt='%i')
+    np.savetxt(os.path.join(options.output_dir, 'remaining_indices.dat'),
+               remaining_indices, fmt='%i')
+    np.savetxt(os.path.join(options.output_dir, 'deleted_indices.dat'),
+               deleted_indices, fmt='%i')
 
     # save fit results
     # the data format is kept
@@ -607,8 +609,7 @@ def save_filter_results(options, remaining_indices, deleted_indices, ND_list):
         'inv_opts': {},
     }
 
-    iog.save_fit_results(data_options, ND_list)
-    os.chdir(pwd)
+    iog.save_fit_results(data_options, ND_list, options.output_dir)
 
 
 def _is_log10(filename):
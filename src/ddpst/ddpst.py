@@ -17,7 +17,12 @@ with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 This tool operates on inversion results created by dd_space_time.py and offers
 the following functions:
-    -
+    - aggregate the results of all pixels (-a)
+    - plot the results to grids
+
+The results are read from the result store of dd_space_time.py (see
+lib_dd.io.result_store). For results without a (complete) store, the text
+files of all time series are read.
 
 Planned features:
     - plot (selected) spectra
@@ -32,6 +37,7 @@ import glob
 import shutil
 import ddps
 import NDimInv.elem as elem
+import lib_dd.io.result_store as result_store
 
 
 def handle_cmd_options():
@@ -62,6 +68,20 @@ def handle_cmd_options():
     return options, args
 
 
+def _open_store(result_dir):
+    """Return the result store of dd_space_time, or None if there is no
+    complete store (e.g. results of older versions, or unfinished runs)
+    """
+    try:
+        store = result_store.result_store(result_dir, mode='r')
+    except IOError:
+        return None
+    if not store.is_complete():
+        print('Result store is incomplete, using the text files')
+        return None
+    return store
+
+
 def aggregate_results(options):
     """Assemble the fit results for all pixels of each time series
     """
@@ -72,6 +92,15 @@ def aggregate_results(options):
         shutil.rmtree(outdir)
     os.makedirs(outdir)
 
+    store = _open_store(options.result_dir)
+    if store is not None:
+        # for now, save only 1D or 2D results
+        for key in store.arrays.keys():
+            data_all = store.get_map(key)
+            if len(data_all.shape) <= 2:
+                np.savetxt(outdir + os.sep + key + '_results.dat', data_all)
+        return
+
     ts_dirs = sorted(glob.glob(indir + '/tmp_ts_*'))
     result_files = [os.path.basename(x) for x in
                     glob.glob(ts_dirs[0] + '/stats_and_rms/*.dat')]
@@ -136,7 +165,7 @@ def plot_to_grids(data_list, key, options):
         ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(3))
 
     fig.tight_layout()
-    fig.savefig(key + '.png', dpi=200)
+    fig.savefig(os.path.join(options.result_dir, key + '.png'), dpi=200)
 
 
 def plot_to_grid(options):
@@ -149,17 +178,23 @@ def plot_to_grid(options):
     elem.load_elec_file(options.elec_file)
 
     result_dir_abs = os.path.abspath(options.result_dir)
-    os.chdir(options.result_dir)
+    store = _open_store(result_dir_abs)
 
     data_list = {}
     # we use the result definitions from ddps
     for key in reversed(ddps.dd_stats.keys()):
         print('Plotting {0}'.format(key))
-        data_file = result_dir_abs + '/stats_and_rms_agg/' + \
-            ddps.dd_stats[key]['filename']
-        if not os.path.isfile(data_file):
-            continue
-        data = np.loadtxt(data_file)
+        if store is not None:
+            if key not in store.arrays:
+                continue
+            # copy, the maps are modified for plotting
+            data = np.array(store.get_map(key))
+        else:
+            data_file = result_dir_abs + '/stats_and_rms_agg/' + \
+                ddps.dd_stats[key]['filename']
+            if not os.path.isfile(data_file):
+                continue
+            data = np.loadtxt(data_file)
         if pixel_mask is not None:
             tmp = np.ones_like(data) * np.nan
             tmp[pixel_mask] = data[pixel_mask]
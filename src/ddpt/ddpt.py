@@ -68,10 +68,10 @@ def _load_data(result_dir):
         raise IOError('Directory not found!')
 
     # load data files
-    pwd = os.getcwd()
-    os.chdir(result_dir + '/stats_and_rms')
-    times = np.loadtxt('../times.dat')
-    result_files_raw = glob.glob('*.dat')
+    stats_dir = os.path.join(result_dir, 'stats_and_rms')
+    times = np.loadtxt(os.path.join(result_dir, 'times.dat'))
+    result_files_raw = [os.path.basename(x) for x in
+                        glob.glob(os.path.join(stats_dir, '*.dat'))]
 
     result_files_filtered = []
     for filename in result_files_raw:
@@ -86,10 +86,9 @@ def _load_data(result_dir):
     data = {}
     for filename in result_files_filtered:
         key = filename[:-4]
-        subdata = np.loadtxt(filename)
+        subdata = np.loadtxt(os.path.join(stats_dir, filename))
         if(subdata.size > 0):
             data[key] = subdata
-    os.chdir(pwd)
     return data, times
 
 
@@ -100,20 +99,17 @@ def plot_stats(options):
     data, times = _load_data(options.result_dir)
 
     # plot files
-    outdir = options.result_dir + '/plots_stats'
+    outdir = os.path.join(options.result_dir, 'plots_stats')
     if(not os.path.isdir(outdir)):
         os.makedirs(outdir)
-    pwd = os.getcwd()
-    os.chdir(outdir)
     for key in data.keys():
         print('Plotting {0}'.format(key))
         fig, ax = plt.subplots(1, 1, figsize=(6, 4))
         ax.set_title(key.replace('_', '\_'))
         ax.plot(times, data[key], '.-')
-        fig.savefig(key + '.png')
+        fig.savefig(os.path.join(outdir, key + '.png'))
         plt.close(fig)
         del(fig)
-    os.chdir(pwd)
 
 
 def plot_multiple_stats(options, args):
@@ -132,8 +128,6 @@ def plot_multiple_stats(options, args):
     outdir = 'comparison_stats'
     if(not os.path.isdir(outdir)):
         os.makedirs(outdir)
-    pwd = os.getcwd()
-    os.chdir(outdir)
     for key in data_list[0].keys():
         print('Plotting {0}'.format(key))
         fig, ax = plt.subplots(1, 1, figsize=(6, 4))
@@ -154,10 +148,9 @@ def plot_multiple_stats(options, args):
         ltext = leg.get_texts()
         plt.setp(ltext, fontsize='6')
 
-        fig.savefig(key + '.png')
+        fig.savefig(os.path.join(outdir, key + '.png'))
         plt.close(fig)
         del(fig)
-    os.chdir(pwd)
 
 
 def pick_peak(options):
@@ -225,10 +218,8 @@ def pick_peak(options):
             f_peak_list[nr] = np.nan
             s_peak_list[nr] = np.nan
 
-    pwd = os.getcwd()
     if(not os.path.isdir(options.output)):
         os.makedirs(options.output)
-    os.chdir(options.output)
 
     if(options.plot_peaks):
         # create plots of the rel. times
@@ -243,13 +234,13 @@ def pick_peak(options):
             ax.set_title('Time: {0}'.format(time_indices[nr]))
             ax.invert_xaxis()
         fig.tight_layout()
-        fig.savefig('picked_taus.png', dpi=150)
+        fig.savefig(os.path.join(options.output, 'picked_taus.png'),
+                    dpi=150)
         plt.close(fig)
         del(fig)
 
-    np.savetxt('peaks.dat', f_peak_list)
-    np.savetxt('times.dat', time_indices)
-    os.chdir(pwd)
+    np.savetxt(os.path.join(options.output, 'peaks.dat'), f_peak_list)
+    np.savetxt(os.path.join(options.output, 'times.dat'), time_indices)
 
 
 if __name__ == '__main__':